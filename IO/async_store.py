@@ -0,0 +1,135 @@
+"""
+    Module for reading a store without blocking the caller. Reads run on a
+    small, fixed pool of threads and return pending results, so that a
+    server's event loop can answer many concurrent queries without a
+    thread per request.
+"""
+
+import collections
+import threading
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
+
+class PendingResult(object):
+    """
+    The result of a read that has been requested, with the interface of
+    multiprocessing.pool.AsyncResult.
+    """
+
+    def __init__(self, callback=None):
+        self.__callback = callback
+        self.__done = threading.Event()
+        self.__value = None
+        self.__error = None
+
+    def _set(self, value, error=None):
+        self.__value = value
+        self.__error = error
+        if self.__callback and error is None:
+            self.__callback(value)
+        self.__done.set()
+
+    def ready(self):
+        return self.__done.is_set()
+
+    def successful(self):
+        if not self.ready():
+            raise ValueError("the read has not completed")
+        return self.__error is None
+
+    def wait(self, timeout=None):
+        self.__done.wait(timeout)
+
+    def get(self, timeout=None):
+        """ the read's result, or the exception it raised """
+        self.wait(timeout)
+        if not self.ready():
+            raise TimeoutError
+        if self.__error is not None:
+            raise self.__error
+        return self.__value
+
+class AsyncStore(object):
+    """
+    Wraps a store's read API. find and get return PendingResult objects,
+    which work like multiprocessing.pool.AsyncResult, and whose get() gives
+    the same result as the store's synchronous call. The optional callback
+    receives the result on a worker thread; event loops should hand it
+    back to their own thread, e.g. with asyncio's loop.call_soon_threadsafe
+    or tornado's IOLoop.add_callback.
+
+    At most max_in_flight reads are handed to the workers at a time. Reads
+    requested beyond that are queued and handed on as others complete, so
+    requesting a read never blocks the caller.
+    """
+
+    def __init__(self, store, workers=4, max_in_flight=16):
+        self.store = store
+        self.max_in_flight = max_in_flight
+        self.__pool = ThreadPool(workers)
+        self.__lock = threading.Condition()
+        self.__waiting = collections.deque()
+        self.__running = 0
+
+    def __submit(self, func, args, callback):
+        result = PendingResult(callback)
+        with self.__lock:
+            self.__waiting.append((func, args, result))
+            self.__dispatch()
+        return result
+
+    def __dispatch(self):
+        """ hands queued reads to the workers while slots are free """
+        while self.__waiting and self.__running < self.max_in_flight:
+            self.__running += 1
+            self.__pool.apply_async(self.__run, self.__waiting.popleft())
+
+    def __run(self, func, args, result):
+        try:
+            value, error = func(*args), None
+        except Exception as e:
+            value, error = None, e
+        with self.__lock:
+            self.__running -= 1
+            self.__dispatch()
+            self.__lock.notify_all()
+        result._set(value, error)
+
+    def __find(self, q):
+        return list(self.store.find(q))
+
+    def find(self, q=None, callback=None):
+        """ list of the documents matching the query """
+        return self.__submit(self.__find, (q,), callback)
+
+    def get(self, descriptor, callback=None):
+        """ the document with the descriptor, or None """
+        return self.__submit(self.store.get, (descriptor,), callback)
+
+    def iterate(self, q=None, prefetch=4):
+        """
+        Yields the documents matching the query in the order find would,
+        reading up to prefetch of them ahead in parallel. Only the document
+        to be yielded next is waited for.
+        """
+        if not hasattr(self.store, 'find_files'):
+            for doc in self.find(q).get():
+                yield doc
+            return
+
+        files = self.__submit(list, (self.store.find_files(q),), None).get()
+        pending = collections.deque()
+        for doc_file in files:
+            pending.append(self.__submit(self.store.load_image, (doc_file,), None))
+            if len(pending) > prefetch:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+    def close(self):
+        """ waits for outstanding reads and stops the workers """
+        with self.__lock:
+            while self.__waiting or self.__running:
+                self.__lock.wait()
+        self.__pool.close()
+        self.__pool.join()
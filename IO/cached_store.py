@@ -0,0 +1,171 @@
+"""
+    Module defining a file store that keeps local copies of the documents
+    it reads, for stores that live on slow, shared or remote file systems.
+"""
+
+import collections
+import hashlib
+import os
+import os.path
+import shutil
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+import cinema_store
+
+#utime keeps microseconds, which floats blur, so modification times this
+#close are the same
+_MTIME_RESOLUTION = 2e-6
+
+class CachedFileStore(cinema_store.FileStore):
+    """
+    A FileStore that reads documents through a cache directory on a local
+    disk. The cache keeps the most recently read documents up to max_bytes
+    and drops the least recently used ones beyond that. It survives across
+    sessions, so a second session reads everything locally.
+
+    Cached copies keep the size and modification time of the file they
+    came from. When validate is set, a document is read again whenever its
+    file no longer matches; otherwise cached copies are trusted, which
+    saves a stat of the remote file per read.
+    """
+
+    def __init__(self, dbfilename=None, cache_dir=None,
+                 max_bytes=1024 ** 3, validate=True):
+        super(CachedFileStore, self).__init__(dbfilename)
+        if not cache_dir:
+            cache_dir = os.path.join(os.path.expanduser("~"), ".cache", "cinema")
+        #one sub directory per store so that stores can share a cache_dir
+        key = hashlib.md5(os.path.abspath(self.dbfilename)).hexdigest()
+        self.cache_dir = os.path.join(cache_dir, key)
+        self.max_bytes = max_bytes
+        self.validate = validate
+        self.hits = 0
+        self.misses = 0
+        self.__lock = threading.Lock()
+        self.__entries = collections.OrderedDict()
+        self.__bytes = 0
+        self.__scan()
+
+    def __scan(self):
+        """ rebuilds the recency order from a previous session's files """
+        found = []
+        if os.path.exists(self.cache_dir):
+            for root, dirs, files in os.walk(self.cache_dir):
+                for fn in files:
+                    if fn.startswith(".") or ".partial" in fn:
+                        #not a copy, or one still being made
+                        continue
+                    local = os.path.join(root, fn)
+                    st = os.stat(local)
+                    found.append((st.st_atime, local, st.st_size))
+        for atime, local, size in sorted(found):
+            self.__entries[local] = size
+            self.__bytes += size
+
+    def __local_name(self, doc_file):
+        rel = os.path.relpath(doc_file, os.path.dirname(self.dbfilename))
+        return os.path.join(self.cache_dir, rel)
+
+    def __touch(self, local, mtime):
+        #atime records recency, mtime the source's modification time
+        os.utime(local, (time.time(), mtime))
+
+    def __evict(self):
+        while self.__bytes > self.max_bytes and self.__entries:
+            local, size = self.__entries.popitem(last=False)
+            self.__bytes -= size
+            try:
+                os.remove(local)
+            except OSError:
+                pass
+
+    def __forget(self, local):
+        with self.__lock:
+            size = self.__entries.pop(local, None)
+            if size is not None:
+                self.__bytes -= size
+
+    def fetch(self, doc_file):
+        """ returns the name of an up to date local copy of doc_file """
+        local = self.__local_name(doc_file)
+        with self.__lock:
+            cached = local in self.__entries
+        if cached:
+            try:
+                st = os.stat(local)
+            except OSError:
+                #evicted meanwhile
+                st = None
+                cached = False
+            if cached and self.validate:
+                src = os.stat(doc_file)
+                cached = (src.st_size == st.st_size and
+                          abs(src.st_mtime - st.st_mtime) < _MTIME_RESOLUTION)
+            if cached:
+                with self.__lock:
+                    self.hits += 1
+                    if local in self.__entries:
+                        self.__entries[local] = self.__entries.pop(local)
+                try:
+                    self.__touch(local, st.st_mtime)
+                except OSError:
+                    pass
+                return local
+            self.__forget(local)
+
+        cinema_store._makedirs(os.path.dirname(local))
+        tmp = cinema_store._temporary_name(local)
+        shutil.copyfile(doc_file, tmp)
+        os.rename(tmp, local)
+        self.__touch(local, os.stat(doc_file).st_mtime)
+        size = os.path.getsize(local)
+        with self.__lock:
+            self.misses += 1
+            if local in self.__entries:
+                self.__bytes -= self.__entries.pop(local)
+            self.__entries[local] = size
+            self.__bytes += size
+            self.__evict()
+        return local
+
+    def load_image(self, doc_file):
+        try:
+            with open(self.fetch(doc_file), "r") as file:
+                data = file.read()
+        except IOError:
+            #evicted before it could be read
+            with open(doc_file, "r") as file:
+                data = file.read()
+        self._log_access(doc_file)
+        doc = cinema_store.Document(self.get_descriptor(doc_file), data)
+        doc.attributes = None
+        return doc
+
+    def insert(self, document):
+        super(CachedFileStore, self).insert(document)
+        self.__forget(self.__local_name(self.get_filename(document)))
+
+    def warm(self, q=None, workers=8):
+        """
+        Copies the documents matching the query into the cache ahead of
+        time, several at once. Returns the number of documents.
+        """
+        pool = ThreadPool(workers)
+        try:
+            return len(pool.map(self.fetch, list(self.find_files(q))))
+        finally:
+            pool.close()
+
+    @property
+    def cached_bytes(self):
+        return self.__bytes
+
+    def clear_cache(self):
+        """ removes every cached copy """
+        with self.__lock:
+            self.__entries.clear()
+            self.__bytes = 0
+            if os.path.exists(self.cache_dir):
+                shutil.rmtree(self.cache_dir)
@@ -0,0 +1,187 @@
+"""
+    Module defining camera paths. A camera path maps the values of one or
+    more store parameters onto camera poses (position, focal point and view
+    up). All poses are computed at once with numpy when the path is prepared
+    so that tracks only have to look them up while exploring.
+"""
+
+import numpy
+
+def _roll(vectors, offset):
+    """
+    Rotates vectors expressed with Z as the up axis onto the axis selected
+    by offset (Z => 0 | Y => 2 | X => 1).
+    """
+    return numpy.roll(vectors, offset, axis=-1)
+
+def _normalize(vectors):
+    norms = numpy.sqrt((vectors * vectors).sum(axis=-1))
+    norms[norms == 0] = 1.0
+    return vectors / norms[:, numpy.newaxis]
+
+class CameraPath(object):
+    """
+    Abstract camera path. Subclasses name the parameters they respond to
+    and compute a pose for every combination of their values.
+    """
+
+    #the name of this parameterization, recorded in the store's metadata
+    kind = None
+
+    #parameters that wrap around when stepping past either end
+    wrapping = ()
+
+    def __init__(self, parameters):
+        self.parameters = list(parameters)
+        self.values = None
+        self.positions = None
+        self.focal_points = None
+        self.view_ups = None
+        self.__index = {}
+
+    def prepare(self, store):
+        """ computes every pose for the values the store defines """
+        self.values = [store.get_parameter(name)['values']
+                       for name in self.parameters]
+        grids = numpy.meshgrid(*[numpy.asarray(v, dtype=float)
+                                 for v in self.values], indexing='ij')
+        flat = [g.ravel() for g in grids]
+        self.positions, self.focal_points, self.view_ups = self.compute(*flat)
+
+        shape = [len(v) for v in self.values]
+        self.__index = {}
+        for i, key in enumerate(numpy.ndindex(*shape)):
+            self.__index[tuple(self.values[a][k] for a, k in enumerate(key))] = i
+
+    def compute(self, *values):
+        """
+        Given one flat array per parameter, returns (N,3) arrays of
+        positions, focal points and view ups. Subclasses must define this.
+        """
+        raise RuntimeError("Subclasses must define this method")
+
+    def get_pose(self, descriptor):
+        """
+        Returns position, focal point and view up for the document
+        descriptor as lists.
+        """
+        key = tuple(descriptor[name] for name in self.parameters)
+        i = self.__index.get(key)
+        if i is None:
+            #not one of the prepared values, compute it on the spot
+            pos, focal, up = self.compute(
+                *[numpy.array([float(v)]) for v in key])
+            return pos[0].tolist(), focal[0].tolist(), up[0].tolist()
+        return (self.positions[i].tolist(),
+                self.focal_points[i].tolist(),
+                self.view_ups[i].tolist())
+
+    def get_metadata(self):
+        """
+        Describes the path and all of its poses so that viewers can step
+        between neighbouring poses without recomputing them.
+        """
+        return {
+            'type': self.kind,
+            'parameters': self.parameters,
+            'values': self.values,
+            'wrap': [name for name in self.parameters
+                     if name in self.wrapping],
+            'positions': self.positions.tolist(),
+            'focal_points': self.focal_points.tolist(),
+            'view_ups': self.view_ups.tolist()
+            }
+
+class SphericalPath(CameraPath):
+    """
+    Places the camera on a sphere around center. phi is the longitude and
+    theta the latitude, both in degrees.
+    """
+    kind = 'spherical'
+    wrapping = ('phi',)
+
+    def __init__(self, center, distance, offset=0):
+        super(SphericalPath, self).__init__(['phi', 'theta'])
+        self.center = numpy.asarray(center, dtype=float)
+        self.distance = float(distance)
+        self.offset = offset
+
+    def compute(self, phi, theta):
+        phi_rad = numpy.radians(phi)
+        theta_rad = numpy.radians(theta)
+        cos_phi = numpy.cos(phi_rad)
+        sin_phi = numpy.sin(phi_rad)
+        cos_theta = numpy.cos(theta_rad)
+        sin_theta = numpy.sin(theta_rad)
+
+        pos = numpy.column_stack((
+            - cos_phi * self.distance * cos_theta,
+            + sin_phi * self.distance * cos_theta,
+            + sin_theta * self.distance))
+        up = numpy.column_stack((
+            + cos_phi * sin_theta,
+            - sin_phi * sin_theta,
+            + cos_theta))
+        pos = _roll(pos, self.offset) + self.center
+        up = _roll(up, self.offset)
+        focal = numpy.tile(self.center, (len(phi), 1))
+        return pos, focal, up
+
+class OrbitPath(SphericalPath):
+    """
+    Circles the camera around center at a fixed elevation, theta, in
+    response to phi alone.
+    """
+    kind = 'orbit'
+
+    def __init__(self, center, distance, theta=0, offset=0):
+        super(OrbitPath, self).__init__(center, distance, offset)
+        self.parameters = ['phi']
+        self.theta = theta
+
+    def compute(self, phi):
+        theta = numpy.empty_like(phi)
+        theta.fill(self.theta)
+        return super(OrbitPath, self).compute(phi, theta)
+
+class FlightPath(CameraPath):
+    """
+    Moves the camera along a set of key frames. The parameter's values are
+    times, and each pose is linearly interpolated between the key frames
+    that surround it.
+    """
+    kind = 'flight'
+
+    def __init__(self, parameter, times, positions, focal_points, view_ups):
+        super(FlightPath, self).__init__([parameter])
+        self.times = numpy.asarray(times, dtype=float)
+        self.key_positions = numpy.asarray(positions, dtype=float)
+        self.key_focal_points = numpy.asarray(focal_points, dtype=float)
+        self.key_view_ups = numpy.asarray(view_ups, dtype=float)
+        if not (len(self.times) == len(self.key_positions) ==
+                len(self.key_focal_points) == len(self.key_view_ups)):
+            raise RuntimeError("Each key frame needs a time, position, focal point and view up")
+
+    def _interpolate(self, t, keys):
+        return numpy.column_stack(
+            [numpy.interp(t, self.times, keys[:, c]) for c in range(3)])
+
+    def compute(self, t):
+        pos = self._interpolate(t, self.key_positions)
+        focal = self._interpolate(t, self.key_focal_points)
+        up = _normalize(self._interpolate(t, self.key_view_ups))
+        return pos, focal, up
+
+def obtain_angles(angular_steps=[10,15]):
+    """
+    Returns matching lists of thetas and phis that cover the sphere with
+    the given phi and theta steps, in degrees, avoiding the poles.
+    """
+    phi_step, theta_step = angular_steps
+    theta_offset = 90 % theta_step
+    if theta_offset == 0:
+        theta_offset += theta_step
+    thetas = numpy.arange(-90 + theta_offset, 90 - theta_offset + 1, theta_step)
+    phis = numpy.arange(0, 360, phi_step)
+    tt, pp = numpy.meshgrid(thetas, phis, indexing='ij')
+    return tt.ravel().tolist(), pp.ravel().tolist()
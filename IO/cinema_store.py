@@ -3,11 +3,19 @@
 """
 
 import sys
+import copy
 import json
 import os.path
 import re
 import itertools
 import weakref
+import collections
+import threading
+try:
+    import fcntl
+except ImportError:
+    #not on windows, where writers can't share a store
+    fcntl = None
 
 class Document(object):
     """
@@ -73,12 +81,27 @@ class Store(object):
     Users insert documents in the store using 'insert'. One can find
     document(s) using 'find' which returns a generator (or cursor) allow users
     to iterate over all match documents.
+
+    Results of 'find' can be memoized with 'enable_find_cache'. The cache is
+    emptied whenever the store changes through 'insert', 'add_parameter' or
+    'save'.
     """
 
     def __init__(self):
         self.__metadata = None #better name is view hints
         self.__parameter_list = {}
         self.__loaded = False
+        self.__find_cache = None
+        self.__find_cache_size = 0
+        self.__data_cache = None
+        self.__data_cache_bytes = 0
+        self.__data_cache_max_bytes = 0
+        self.__find_cache_lock = threading.Lock()
+        self.find_cache_keep_data = False
+        self.find_cache_hits = 0
+        self.find_cache_misses = 0
+        self.data_cache_hits = 0
+        self.data_cache_misses = 0
 
     @property
     def parameter_list(self):
@@ -87,6 +110,105 @@ class Store(object):
     def _set_parameter_list(self, val):
         """For use by subclasses alone"""
         self.__parameter_list = val
+        self.invalidate_find_cache()
+
+    def enable_find_cache(self, max_entries=128, keep_data=False,
+                          max_bytes=64 * 1024 ** 2):
+        """
+        Remembers the results of up to max_entries recent queries. Only the
+        matching documents' locations are kept unless keep_data is set, in
+        which case the data of the most recently read documents is kept
+        too, up to max_bytes of it. Query results and data are dropped
+        least recently used first, each within its own bound, and counted
+        in find_cache_hits/misses and data_cache_hits/misses respectively.
+        """
+        with self.__find_cache_lock:
+            self.__find_cache = collections.OrderedDict()
+            self.__find_cache_size = max_entries
+            self.__data_cache = collections.OrderedDict() if keep_data else None
+            self.__data_cache_bytes = 0
+            self.__data_cache_max_bytes = max_bytes
+            self.find_cache_keep_data = keep_data
+
+    def disable_find_cache(self):
+        with self.__find_cache_lock:
+            self.__find_cache = None
+            self.__data_cache = None
+            self.__data_cache_bytes = 0
+            self.find_cache_keep_data = False
+
+    def invalidate_find_cache(self):
+        """Forgets all memoized query results."""
+        with self.__find_cache_lock:
+            if self.__find_cache is not None:
+                self.__find_cache.clear()
+            if self.__data_cache is not None:
+                self.__data_cache.clear()
+                self.__data_cache_bytes = 0
+
+    def _find_cache_key(self, kind, q):
+        """For use by subclasses alone, a hashable key for a query"""
+        q = q if q else dict()
+        return (kind, tuple(sorted((k, str(v)) for k, v in q.items())))
+
+    def _find_cache_get(self, key):
+        """For use by subclasses alone, None when the key is not cached"""
+        with self.__find_cache_lock:
+            if self.__find_cache is None:
+                return None
+            entry = self.__find_cache.pop(key, None)
+            if entry is None:
+                self.find_cache_misses += 1
+                return None
+            self.find_cache_hits += 1
+            self.__find_cache[key] = entry
+            return entry
+
+    def _find_cache_enabled(self):
+        """For use by subclasses alone"""
+        return self.__find_cache is not None
+
+    def _find_cache_put(self, key, entry):
+        """For use by subclasses alone"""
+        with self.__find_cache_lock:
+            if self.__find_cache is None:
+                return
+            self.__find_cache[key] = entry
+            while len(self.__find_cache) > self.__find_cache_size:
+                self.__find_cache.popitem(last=False)
+
+    def _data_cache_get(self, key):
+        """For use by subclasses alone, None when the data is not cached"""
+        with self.__find_cache_lock:
+            if self.__data_cache is None:
+                return None
+            data = self.__data_cache.pop(key, None)
+            if data is None:
+                self.data_cache_misses += 1
+                return None
+            self.data_cache_hits += 1
+            self.__data_cache[key] = data
+            return data
+
+    def _data_cache_put(self, key, data):
+        """For use by subclasses alone, keeps data within max_bytes"""
+        with self.__find_cache_lock:
+            if self.__data_cache is None or \
+                    len(data) > self.__data_cache_max_bytes:
+                return
+            old = self.__data_cache.pop(key, None)
+            if old is not None:
+                self.__data_cache_bytes -= len(old)
+            self.__data_cache[key] = data
+            self.__data_cache_bytes += len(data)
+            while self.__data_cache_bytes > self.__data_cache_max_bytes:
+                key, old = self.__data_cache.popitem(last=False)
+                self.__data_cache_bytes -= len(old)
+
+    @property
+    def data_cache_bytes(self):
+        """bytes of document data the find cache holds"""
+        return self.__data_cache_bytes
 
     @property
     def metadata(self):
@@ -123,6 +245,7 @@ class Store(object):
         # probably can only add safely to outermost parameter (loop)
         properties = self.validate_parameter(name, properties)
         self.__parameter_list[name] = properties
+        self.invalidate_find_cache()
 
     def get_parameter(self, name):
         return self.__parameter_list[name]
@@ -137,6 +260,7 @@ class Store(object):
         """Inserts a new document"""
         if not self.__loaded:
             self.create()
+        self.invalidate_find_cache()
 
     def load(self):
         assert not self.__loaded
@@ -149,21 +273,111 @@ class Store(object):
     def find(self, q=None):
         raise RuntimeError("Subclasses must define this method")
 
+    def get(self, descriptor):
+        """
+        Returns the document with the given (possibly partial, defaults fill
+        in the rest) descriptor, or None if there is none.
+        """
+        for doc in self.find(self.get_complete_descriptor(descriptor)):
+            return doc
+        return None
+
     def get_image_type(self):
         return None
 
+    def _extract_definitions(self, q, dest):
+        """For use by subclasses alone, gives dest this store's parameters,
+        trimmed to the values the query selects, a value or a list of
+        them, and metadata"""
+        q = q if q else dict()
+        for name, properties in self.parameter_list.items():
+            properties = copy.deepcopy(properties)
+            if name in q:
+                values = q[name]
+                if not isinstance(values, (list, tuple)):
+                    values = [values]
+                properties['values'] = list(values)
+                properties['default'] = values[0]
+            dest.add_parameter(name, properties)
+        dest.metadata = copy.deepcopy(self.metadata)
+
+    def extract(self, q, dest):
+        """
+        Fills dest, a new empty store, with the documents matching the query
+        and returns it. Parameters the query fixes keep only that value in
+        dest's parameter_list.
+        """
+        self._extract_definitions(q, dest)
+        dest.create()
+        for doc in self.find(q):
+            dest.insert(doc)
+        return dest
+
 class FileStore(Store):
-    """Implementation of a store based on files and directories"""
+    """Implementation of a store based on files and directories
+
+    With log_inserts set, insert also appends a line naming each new
+    document to an insert log next to info.json, so that readers can
+    follow a store while it is being written without walking it again.
+    With log_accesses set, every document read is appended, as its file
+    name relative to info.json, to an access log that store_stats reports
+    on.
+
+    Documents and info.json are written under temporary names and renamed
+    into place, so readers never see them half written. Several processes
+    can write to one store when each is given its own writer name. Each
+    then logs its inserts to its own journal, and save merges the
+    parameter values and metadata of the process with those already in
+    info.json, under a lock, instead of overwriting them.
+    """
 
-    def __init__(self, dbfilename=None):
+    def __init__(self, dbfilename=None, log_inserts=False, writer=None,
+                 log_accesses=False):
         super(FileStore, self).__init__()
         self.__filename_pattern = None
         self.__dbfilename = dbfilename if dbfilename \
                 else os.path.join(os.getcwd(), "info.json")
+        self.__info_mtime = None
+        self.log_inserts = log_inserts or writer is not None
+        self.log_accesses = log_accesses
+        self.writer = writer
+
+    @property
+    def dbfilename(self):
+        """The store's info.json, documents are stored next to it."""
+        return self.__dbfilename
+
+    @property
+    def insert_log_filename(self):
+        """The log of inserted documents, one json line each."""
+        name = "inserts.%s.log" % self.writer if self.writer else "inserts.log"
+        return os.path.join(os.path.dirname(self.__dbfilename), name)
+
+    @property
+    def access_log_filename(self):
+        """The log of documents read, one file name each."""
+        return os.path.join(os.path.dirname(self.__dbfilename), "access.log")
+
+    def _log_access(self, doc_file):
+        if self.log_accesses:
+            line = os.path.relpath(doc_file, os.path.dirname(self.__dbfilename))
+            with open(self.access_log_filename, mode='a') as file:
+                file.write(line + "\n")
+
+    def insert_log_filenames(self):
+        """The insert logs of all of the store's writers."""
+        import glob
+        dirname = os.path.dirname(self.__dbfilename)
+        return sorted(glob.glob(os.path.join(dirname, "inserts.log")) +
+                      glob.glob(os.path.join(dirname, "inserts.*.log")))
 
     def load(self):
         """loads an existing filestore"""
         super(FileStore, self).load()
+        self.__read_info()
+
+    def __read_info(self):
+        self.__info_mtime = os.path.getmtime(self.__dbfilename)
         with open(self.__dbfilename, mode="rb") as file:
             info_json = json.load(file)
             #for legacy reasons, the parameters are called
@@ -172,18 +386,69 @@ class FileStore(Store):
             self.metadata = info_json['metadata']
             self.filename_pattern = info_json['name_pattern']
 
+    def refresh(self):
+        """
+        Reloads the parameter list and metadata of a loaded store if
+        another process has saved them since. Returns True if it did.
+        """
+        try:
+            mtime = os.path.getmtime(self.__dbfilename)
+        except OSError:
+            return False
+        if mtime == self.__info_mtime:
+            return False
+        self.__read_info()
+        return True
+
     def save(self):
         """ writes out a modified file store """
+        _makedirs(os.path.dirname(self.__dbfilename))
+        if not self.writer:
+            self.__write_info()
+            return
+        dirname, basename = os.path.split(self.__dbfilename)
+        with open(os.path.join(dirname, "." + basename + ".lock"), mode="a") as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                if os.path.exists(self.__dbfilename):
+                    with open(self.__dbfilename, mode="rb") as file:
+                        theirs = json.load(file)
+                    self.__merge_info(theirs)
+                self.__write_info()
+            finally:
+                if fcntl:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def __merge_info(self, theirs):
+        """adds what other writers saved to our parameter list and metadata"""
+        for name, properties in theirs['arguments'].items():
+            if not name in self.parameter_list:
+                self.parameter_list[name] = properties
+                continue
+            values = self.parameter_list[name]['values']
+            new = [v for v in properties['values'] if not v in values]
+            if new:
+                values.extend(new)
+                if self.parameter_list[name]['type'] == 'range':
+                    values.sort()
+        if theirs['metadata']:
+            metadata = dict(theirs['metadata'])
+            metadata.update(self.metadata if self.metadata else {})
+            self.metadata = metadata
+
+    def __write_info(self):
         info_json = dict(
                 arguments = self.parameter_list,
                 name_pattern = self.filename_pattern,
                 metadata = self.metadata
                 )
-        dirname = os.path.dirname(self.__dbfilename)
-        if not os.path.exists(dirname):
-            os.makedirs(dirname)
-        with open(self.__dbfilename, mode="wb") as file:
+        tmp = _temporary_name(self.__dbfilename)
+        with open(tmp, mode="wb") as file:
             json.dump(info_json, file)
+        os.rename(tmp, self.__dbfilename)
+        self.__info_mtime = os.path.getmtime(self.__dbfilename)
+        self.invalidate_find_cache()
 
     def create(self):
         """creates a new file store"""
@@ -205,6 +470,7 @@ class FileStore(Store):
     @filename_pattern.setter
     def filename_pattern(self, val):
         self.__filename_pattern = val
+        self.invalidate_find_cache()
         #Now set up to be able to convert filenames into descriptors automatically
         #break filename pattern up into an ordered list of parameter names
         cp = re.sub("{[^}]+}", "(\S+)", self.__filename_pattern) #convert to a RE
@@ -221,12 +487,20 @@ class FileStore(Store):
         super(FileStore, self).insert(document)
 
         fname = self.get_filename(document)
-        dirname = os.path.dirname(fname)
-        if not os.path.exists(dirname):
-            os.makedirs(dirname)
+        _makedirs(os.path.dirname(fname))
         if not document.data == None:
-            with open(fname, mode='w') as file:
+            tmp = _temporary_name(fname)
+            with open(tmp, mode='w') as file:
                 file.write(document.data)
+            os.rename(tmp, fname)
+        self.invalidate_find_cache()
+        if self.log_inserts:
+            #readers ignore a line until its newline has been written
+            desc = self.get_complete_descriptor(document.descriptor)
+            line = json.dumps(dict(descriptor = desc,
+                                   file = self.filename_pattern.format(**desc)))
+            with open(self.insert_log_filename, mode='a') as file:
+                file.write(line + "\n")
 
         #with open(fname + ".__data__", mode="w") as file:
         #    info_json = dict(
@@ -241,6 +515,16 @@ class FileStore(Store):
         dirname = os.path.dirname(self.__dbfilename)
         return os.path.join(dirname, suffix)
 
+    def get(self, descriptor):
+        """
+        Reads the document for a descriptor straight from the file its
+        name resolves to, without searching.
+        """
+        fname = self.get_filename(Document(descriptor))
+        if not os.path.exists(fname):
+            return None
+        return self.load_image(fname)
+
     def find(self, q=None):
         """
         Currently support empty query or direct values queries e.g.
@@ -248,26 +532,57 @@ class FileStore(Store):
             print doc.data
         for doc in store.find({'phi': 0, 'theta': 100}):
             print doc.data
+        or lists of values
+        for doc in store.find({'phi': [0, 90]}):
+            print doc.data
         """
-        q = q if q else dict()
-        p = q
+        for doc_file in self.find_files(q):
+            yield self.load_image(doc_file)
 
-        # build a file name match pattern based on the query.
+    def find_files(self, q=None):
+        """
+        Like find, but yields the names of the matching files rather than
+        reading them.
+        """
+        key = self._find_cache_key('files', q)
+        files = self._find_cache_get(key)
+        if files is None:
+            files = self._match_files(q)
+            if self._find_cache_enabled():
+                files = list(files)
+                self._find_cache_put(key, files)
+        return iter(files)
+
+    def _match_files(self, q=None):
+        p = dict(q) if q else dict()
+
+        # build a file name match pattern based on the query, one for each
+        # combination of the values of parameters given lists of them.
         for name, properties in self.parameter_list.items():
-            if not name in q:
+            if not name in p:
                 p[name] = "*"
+        listed = [name for name, value in p.items()
+                  if isinstance(value, (list, tuple))]
         dirname = os.path.dirname(self.__dbfilename)
-        match_pattern = os.path.join(dirname, self.filename_pattern.format(**p))
+        match_patterns = []
+        for element in itertools.product(*[p[name] for name in listed]):
+            p.update(zip(listed, element))
+            match_patterns.append(
+                os.path.join(dirname, self.filename_pattern.format(**p)))
 
         from fnmatch import fnmatch
         from os import walk
         for root, dirs, files in walk(os.path.dirname(self.__dbfilename)):
             for fn in files:
+                if fn.startswith("."):
+                    #not a document, maybe one being written
+                    continue
                 doc_file = os.path.join(root, fn)
                 #if file.find("__data__") == -1 and fnmatch(doc_file, match_pattern):
                 #    yield self.load_document(doc_file)
-                if fnmatch(doc_file, match_pattern):
-                    yield self.load_image(doc_file)
+                if any(fnmatch(doc_file, match_pattern)
+                       for match_pattern in match_patterns):
+                    yield doc_file
 
     # def load_document(self, doc_file):
     #    with open(doc_file + ".__data__", "r") as file:
@@ -278,19 +593,86 @@ class FileStore(Store):
     #    doc.attributes = info_json["attributes"]
     #    return doc
 
+    def extract(self, q, dest, link=True, workers=8):
+        """
+        Makes a new FileStore holding the documents matching the query and
+        returns it. dest is the new store's info.json, or a FileStore. The
+        documents are hard linked into it when the file system allows, so
+        that extraction takes no space, and are otherwise copied by a pool
+        of workers threads. Since linked documents share their contents with
+        this store, pass link=False if either store's documents will be
+        modified in place by anything other than insert.
+        """
+        if not isinstance(dest, FileStore):
+            dest = FileStore(dest)
+        dest.filename_pattern = self.filename_pattern
+        self._extract_definitions(q, dest)
+        dest.create()
+
+        src_dir = os.path.dirname(self.__dbfilename)
+        dest_dir = os.path.dirname(dest.dbfilename)
+        tasks = [(doc_file, os.path.join(dest_dir, os.path.relpath(doc_file, src_dir)))
+                 for doc_file in self.find_files(q)]
+        copy_task = lambda task: _link_or_copy(task[0], task[1], link)
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(workers)
+        try:
+            pool.map(copy_task, tasks)
+        finally:
+            pool.close()
+            pool.join()
+        dest.invalidate_find_cache()
+        return dest
+
+    def get_descriptor(self, doc_file):
+        """
+        Converts a document's file name into its descriptor. The values
+        are strings, as they appear in the name.
+        """
+        vals = re.match(self.__fn_vals_RE, doc_file).groups()[1:]
+        return dict(zip(self.__fn_keys, vals))
+
     def load_image(self, doc_file):
         #with open(doc_file + ".__data__", "r") as file:
         #    info_json = json.load(file)
-        with open(doc_file, "r") as file:
-            data = file.read()
-        # convert filename into a list of values
-        vals = re.match(self.__fn_vals_RE, doc_file).groups()[1:]
-        descriptor = dict(zip(self.__fn_keys, vals))
-        doc = Document(descriptor, data)
+        data = self._data_cache_get(doc_file)
+        if data is None:
+            with open(doc_file, "r") as file:
+                data = file.read()
+            self._data_cache_put(doc_file, data)
+        self._log_access(doc_file)
+        doc = Document(self.get_descriptor(doc_file), data)
         doc.attributes = None
         return doc
 
 
+def _makedirs(dirname):
+    if dirname and not os.path.isdir(dirname):
+        try:
+            os.makedirs(dirname)
+        except OSError:
+            #another writer may have made it first
+            if not os.path.isdir(dirname):
+                raise
+
+def _temporary_name(fname):
+    """a hidden name, unique to this thread, to write fname under first"""
+    dirname, basename = os.path.split(fname)
+    return os.path.join(dirname, ".%s.%d.%d.partial" %
+                        (basename, os.getpid(), threading.current_thread().ident))
+
+def _link_or_copy(src, dest, link=True):
+    _makedirs(os.path.dirname(dest))
+    if link:
+        try:
+            os.link(src, dest)
+            return
+        except OSError:
+            #across devices, or on a file system without links
+            pass
+    import shutil
+    shutil.copy2(src, dest)
+
 def make_parameter(name, values, **kwargs):
     default = kwargs['default'] if 'default' in kwargs else values[0]
     typechoice = kwargs['typechoice'] if 'typechoice' in kwargs else 'range'
@@ -0,0 +1,63 @@
+"""
+    Module for combining independently rendered layers with their depth
+    buffers. Layered stores (see explorers.LayeredExplorer) keep one
+    document per layer sample holding its color image and depth buffer, and
+    any subset of layers is composited here at query time.
+"""
+
+import numpy
+from StringIO import StringIO
+
+def encode_layer(rgb, depth):
+    """
+    Packs a color image (H,W,C) and its depth buffer (H,W) into the bytes
+    stored as a layer document's data.
+    """
+    buf = StringIO()
+    numpy.savez_compressed(buf, rgb=rgb, depth=depth)
+    return buf.getvalue()
+
+def decode_layer(data):
+    """ Inverse of encode_layer, returns (rgb, depth) """
+    npz = numpy.load(StringIO(data))
+    return npz['rgb'], npz['depth']
+
+def composite(layers, background=None, far=1.0):
+    """
+    Combines a list of (rgb, depth) layers by keeping, for every pixel,
+    the color of the layer closest to the camera. Pixels that no layer
+    covers (depth at the far plane) are set to background, which defaults
+    to black.
+    """
+    if not layers:
+        return None
+    depths = numpy.array([depth for rgb, depth in layers])
+    rgbs = numpy.array([rgb for rgb, depth in layers])
+
+    nearest = depths.argmin(axis=0)
+    rows, cols = numpy.indices(nearest.shape)
+    result = rgbs[nearest, rows, cols]
+
+    empty = depths.min(axis=0) >= far
+    result[empty] = background if background is not None else 0
+    return result
+
+def find_composite(store, query, layers, background=None):
+    """
+    Composites the requested layers of a layered store.
+
+    :param query: values for the parameters the layers share, the camera
+    for instance.
+
+    :param layers: a dict from layer name to the values of that layer's own
+    parameters. Only the layers named are combined.
+    """
+    found = []
+    for name, values in layers.items():
+        q = dict(query)
+        q.update(values)
+        q['layer'] = name
+        for doc in store.find(q):
+            found.append(decode_layer(doc.data))
+            break
+    return composite(found, background)
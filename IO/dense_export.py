@@ -0,0 +1,169 @@
+"""
+    Exports the images of a file store into one dense numpy array on disk,
+    so that whole store analyses can run as vectorized numpy operations on
+    a memory map rather than reading files one by one.
+
+    The array has shape (len(values_1), ..., len(values_n), H, W, C), one
+    axis per parameter in the order given. A json file next to it names
+    the axes and their values, and a boolean mask array records which
+    entries had a document.
+
+    usage: python dense_export.py src/info.json out.npy [--parameters a b ...]
+"""
+
+import json
+from multiprocessing import Pool
+
+import numpy
+from numpy.lib.format import open_memmap
+import PIL.Image
+
+import cinema_store
+import image_compaction
+
+_MODES = {'L': 1, 'RGB': 3, 'RGBA': 4}
+
+def _sidecar(fname):
+    return fname + ".json"
+
+def _mask_name(fname):
+    base = fname[:-4] if fname.endswith(".npy") else fname
+    return base + ".mask.npy"
+
+def _decode(doc_file, mode):
+    img = image_compaction.open_expanded(doc_file)
+    if img.mode != mode:
+        img = img.convert(mode)
+    arr = numpy.asarray(img)
+    return arr.reshape(arr.shape[:2] + (_MODES[mode],))
+
+_target = None
+_mode = None
+
+def _open_target(fname, mode):
+    global _target, _mode
+    _target = open_memmap(fname, mode='r+')
+    _mode = mode
+
+def _export_one(task):
+    doc_file, index = task
+    _target[index] = _decode(doc_file, _mode)
+    return index
+
+def export(store, fname, parameters=None, q=None, workers=None):
+    """
+    Decodes the documents of a loaded FileStore that match the query into
+    a new .npy file and returns it as a DenseArray.
+
+    :param parameters: the parameters that become axes, in order. By
+    default every parameter not fixed by the query, sorted by name.
+    """
+    q = q if q else dict()
+    if parameters is None:
+        parameters = sorted(n for n in store.parameter_list if not n in q)
+    values = [store.get_parameter(n)['values'] for n in parameters]
+    #file names give values as strings
+    lookups = [dict((str(v), i) for i, v in enumerate(vals)) for vals in values]
+
+    tasks = []
+    for doc_file in store.find_files(q):
+        desc = store.get_descriptor(doc_file)
+        try:
+            index = tuple(lookups[a][desc[n]] for a, n in enumerate(parameters))
+        except KeyError:
+            #a value that the parameter list doesn't declare
+            continue
+        tasks.append((doc_file, index))
+    if not tasks:
+        raise RuntimeError("No documents match %s" % str(q))
+
+    first = image_compaction.open_expanded(tasks[0][0])
+    mode = first.mode if first.mode in _MODES else 'RGBA'
+    width, height = first.size
+    shape = tuple(len(v) for v in values) + (height, width, _MODES[mode])
+    target = open_memmap(fname, mode='w+', dtype=numpy.uint8, shape=shape)
+    del target
+
+    pool = Pool(workers, _open_target, (fname, mode))
+    mask = numpy.zeros(shape[:len(parameters)], dtype=bool)
+    try:
+        for index in pool.imap_unordered(_export_one, tasks, 16):
+            mask[index] = True
+    finally:
+        pool.close()
+        pool.join()
+    numpy.save(_mask_name(fname), mask)
+
+    with open(_sidecar(fname), "w") as file:
+        json.dump(dict(
+            parameters = parameters,
+            values = values,
+            labels = [store.get_parameter(n).get('label', n) for n in parameters],
+            query = q,
+            mode = mode), file)
+    return load(fname)
+
+class DenseArray(object):
+    """
+    A store exported by export. array is a read only memory map, so
+    nothing is read from disk until it is used.
+    """
+    def __init__(self, array, mask, parameters, values, labels, mode):
+        self.array = array
+        self.mask = mask
+        self.parameters = parameters
+        self.values = values
+        self.labels = labels
+        self.mode = mode
+        self.__lookups = [dict((str(v), i) for i, v in enumerate(vals))
+                          for vals in values]
+
+    def index(self, descriptor):
+        """
+        The index into array for a descriptor. Parameters the descriptor
+        leaves out select the whole axis.
+        """
+        index = []
+        for a, name in enumerate(self.parameters):
+            if name in descriptor:
+                index.append(self.__lookups[a][str(descriptor[name])])
+            else:
+                index.append(slice(None))
+        return tuple(index)
+
+    def get(self, descriptor):
+        """ the image(s) for a (partial) descriptor """
+        return self.array[self.index(descriptor)]
+
+def load(fname, mode='r'):
+    """ maps an exported store back without reading it """
+    with open(_sidecar(fname), "r") as file:
+        info = json.load(file)
+    return DenseArray(numpy.load(fname, mmap_mode=mode),
+                      numpy.load(_mask_name(fname)),
+                      info['parameters'], info['values'], info['labels'],
+                      info['mode'])
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description=
+        "Export a cinema file store into one dense numpy array.")
+    parser.add_argument("src", help="the store's info.json")
+    parser.add_argument("dest", help="the .npy file to write")
+    parser.add_argument("--parameters", nargs="+", default=None,
+                        help="parameters to make axes of, in order")
+    parser.add_argument("--query", default=None,
+                        help="json query fixing the other parameters")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of processes, all cores by default")
+    args = parser.parse_args(argv)
+
+    store = cinema_store.FileStore(args.src)
+    store.load()
+    dense = export(store, args.dest, args.parameters,
+                   json.loads(args.query) if args.query else None, args.workers)
+    print "wrote %s of shape %s, %d of %d entries filled" % (
+        args.dest, str(dense.array.shape), dense.mask.sum(), dense.mask.size)
+
+if __name__ == "__main__":
+    main()
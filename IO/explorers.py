@@ -1,5 +1,10 @@
 import cinema_store
+import copy
 import itertools
+import collections
+import math
+import os.path
+import time
 
 class Explorer(object):
     """
@@ -18,6 +23,11 @@ class Explorer(object):
         self.__cinema_store = cinema_store
         self.parameters = parameters
         self.tracks = tracks
+        #when False documents only go to the sinks
+        self.write_to_store = True
+        self.sinks = []
+        self.transforms = []
+        self.__inserted = []
 
     @property
     def cinema_store(self):
@@ -31,45 +41,579 @@ class Explorer(object):
 
     def prepare(self):
         """ Give tracks a chance to get ready for a run """
+        self.__inserted = []
         if self.tracks:
             for e in self.tracks:
                 res = e.prepare(self)
 
-    def execute(self, desc):
+    def execute(self, desc, tracks=None):
         # Create the document/data product for this sample.
         doc = cinema_store.Document(desc)
-        for e in self.tracks:
+        for e in (self.tracks if tracks is None else tracks):
             e.execute(doc)
         self.insert(doc)
+        return doc
 
     def explore(self, fixedargs=None):
         """Explore the problem space to populate the store"""
-        self.prepare()
+        for doc in self.stream(fixedargs):
+            pass
 
-        ordered = self.list_parameters()
-        args = []
-        values = []
-        for name in ordered:
-            vals = self.cinema_store.get_parameter(name)['values']
-            args.append(name)
-            values.append(vals)
+    def stream(self, fixedargs=None):
+        """
+        Explore the problem space, yielding each document as soon as it
+        has been inserted, which explorers that insert asynchronously may
+        do some samples later.
+        """
+        self.prepare()
 
-        for element in itertools.product(*values):
-            desc = dict(itertools.izip(args, element))
-            if fixedargs != None:
-                desc.update(fixedargs)
-            self.execute(desc)
+        for inner, tracks, fixed in self._passes():
+            args = self.list_parameters() + inner
+            values = [self.cinema_store.get_parameter(name)['values']
+                      for name in args]
+            for element in itertools.product(*values):
+                desc = dict(itertools.izip(args, element))
+                desc.update(fixed)
+                if fixedargs != None:
+                    desc.update(fixedargs)
+                self.execute(desc, tracks)
+                for doc in self.inserted():
+                    yield doc
 
         self.finish()
+        for doc in self.inserted():
+            yield doc
+
+    def inserted(self):
+        """
+        Returns, oldest first, the documents that have reached the store
+        and the sinks since the last call.
+        """
+        docs, self.__inserted = self.__inserted, []
+        return docs
+
+    def drain(self):
+        """
+        Waits for the documents still being inserted. Explorers that
+        insert asynchronously define this.
+        """
+        pass
 
     def finish(self):
         """ Give tracks a chance to clean up after a run """
+        self.drain()
         if self.tracks:
             for e in self.tracks:
                 res = e.finish()
+        for sink in self.sinks:
+            sink.flush()
+
+    def add_sink(self, sink):
+        """
+        Registers a sinks.Sink that every document is handed to after it
+        has been inserted in the store.
+        """
+        self.sinks.append(sink)
+
+    def add_transform(self, transform):
+        """
+        Registers a function that is called with every document before it
+        is inserted, and that may change its data and attributes, for
+        instance an image_compaction.Compactor.
+        """
+        self.transforms.append(transform)
+
+    def estimate(self, samples=3, fixedargs=None, seed=None, clock=time.time):
+        """
+        Dry runs a few samples, without writing to the store or the sinks,
+        and returns an ExplorePlan of what exploring everything would take.
+        The store's parameter_list and metadata are left as they were.
+
+        Each of samples rounds renders a random sample, then changes the
+        parameters one at a time and renders again, which measures what
+        changing each parameter costs. Pipelines that keep their results
+        while their inputs don't change make inner parameters cheaper, and
+        the plan uses this to compare parameter orders. Explorers that make
+        several passes, one per layer for instance, are sampled in each.
+        """
+        import random
+        import shutil
+        import tempfile
+        rng = random.Random(seed)
+        store = self.cinema_store
+        values = [store.get_parameter(name)['values'] for name in self.parameters]
+        saved = (copy.deepcopy(store.parameter_list), copy.deepcopy(store.metadata))
+        dirname = os.path.dirname(getattr(store, 'dbfilename', ''))
+        scratch = tempfile.mkdtemp(dir=dirname if os.path.isdir(dirname) else None)
+        write_to_store, sinks = self.write_to_store, self.sinks
+        self.write_to_store, self.sinks = False, []
+        plan = ExplorePlan(self.parameters, [len(v) for v in values])
+        track_names = {}
+        docs = []
+
+        def run(args, element, tracks, fixed):
+            desc = dict(itertools.izip(args, element))
+            desc.update(fixed)
+            if fixedargs != None:
+                desc.update(fixedargs)
+            doc = cinema_store.Document(desc)
+            start = clock()
+            for e in tracks:
+                name = track_names.setdefault(
+                    id(e), "%d:%s" % (len(track_names), type(e).__name__))
+                begin = clock()
+                e.execute(doc)
+                plan.add_track_time(name, clock() - begin)
+            begin = clock()
+            self.insert(doc)
+            for done in self.inserted():
+                if done.data is not None:
+                    #what writing it out costs
+                    with open(os.path.join(scratch, "sample"), "wb") as file:
+                        file.write(done.data)
+                docs.append(done)
+            plan.insert_times.append(clock() - begin)
+            return clock() - start
+
+        try:
+            self.prepare()
+            for inner, tracks, fixed in self._passes():
+                args = self.parameters + inner
+                pass_values = values + [store.get_parameter(n)['values'] for n in inner]
+                plan.add_pass(inner, [len(v) for v in pass_values[len(values):]])
+                for trial in range(samples):
+                    element = [rng.choice(v) for v in pass_values]
+                    plan.full_times.append(run(args, element, tracks, fixed))
+                    for a, name in enumerate(args):
+                        others = [v for v in pass_values[a] if v != element[a]]
+                        if not others:
+                            continue
+                        element[a] = rng.choice(others)
+                        plan.change_times.setdefault(name, []).append(
+                            run(args, element, tracks, fixed))
+            self.finish()
+            docs.extend(self.inserted())
+        finally:
+            self.write_to_store, self.sinks = write_to_store, sinks
+            store.parameter_list.clear()
+            store.parameter_list.update(saved[0])
+            store.metadata = saved[1]
+            store.invalidate_find_cache()
+            shutil.rmtree(scratch, ignore_errors=True)
+        for doc in docs:
+            if doc.data is not None:
+                plan.sizes.append(getattr(doc.data, 'nbytes', None) or len(doc.data))
+        return plan
+
+    def _passes(self):
+        """
+        Yields, for each pass an explore makes over the parameters, the
+        parameters explored inside self.parameters, the tracks that run
+        and the values that every descriptor of the pass has. Explorers
+        that make several passes get each one ready as it is yielded.
+        """
+        yield [], self.tracks or [], {}
 
     def insert(self, doc):
-        self.cinema_store.insert(doc)
+        self._insert(doc, self.cinema_store)
+
+    def _insert(self, doc, store):
+        """ transforms doc, then hands it to store and the sinks """
+        for transform in self.transforms:
+            transform(doc)
+        if self.write_to_store:
+            store.insert(doc)
+        for sink in self.sinks:
+            sink.put(doc)
+        self.__inserted.append(doc)
+
+class MultiViewExplorer(Explorer):
+    """
+    An Explorer that captures several views of the same pipeline for each
+    sample. The tracks execute once per sample, then every view is
+    captured, so the pipeline's cost is shared by all the views.
+
+    views is a list of (name, view) pairs. Each view's image goes into the
+    store as a document with a 'view' parameter set to the view's name,
+    which the store's filename_pattern must include. Alternatively, stores
+    maps view names to separate stores, which must all define the same
+    parameters as cinema_store, and which are given the metadata the
+    tracks set on cinema_store. Subclasses define how to capture a view.
+    stream yields the documents of every view.
+    """
+
+    def __init__(self,
+        cinema_store,
+        parameters,
+        tracks,
+        views, #(name, view) pairs
+        stores=None #view name to store, to keep views in separate stores
+        ):
+        super(MultiViewExplorer, self).__init__(cinema_store, parameters, tracks)
+        self.views = views
+        self.stores = stores
+
+    def prepare(self):
+        if not self.stores and not 'view' in self.cinema_store.parameter_list:
+            names = [name for name, view in self.views]
+            self.cinema_store.add_parameter('view',
+                cinema_store.make_parameter('view', names, typechoice='list'))
+        super(MultiViewExplorer, self).prepare()
+        if self.stores and self.cinema_store.metadata:
+            #the tracks describe their output, type, value_images and so
+            #on, in cinema_store alone
+            for store in self.stores.values():
+                if store is not self.cinema_store:
+                    store.add_metadata(copy.deepcopy(self.cinema_store.metadata))
+
+    def capture(self, view):
+        """ subclasses render a view and return its image's data here """
+        raise RuntimeError("Subclasses must define this method")
+
+    def insert(self, doc):
+        for name, view in self.views:
+            desc = dict(doc.descriptor)
+            if self.stores:
+                target = self.stores[name]
+            else:
+                target = self.cinema_store
+                desc['view'] = name
+            vdoc = cinema_store.Document(desc, self.capture(view))
+            vdoc.attributes = doc.attributes
+            self._insert(vdoc, target)
+
+class ExplorePlan(object):
+    """
+    What an explore would cost, extrapolated by Explorer.estimate from a
+    few samples. Times are in seconds. An explore makes one or more passes,
+    each over the parameters and the pass's own inner parameters.
+    """
+
+    def __init__(self, parameters, lengths):
+        self.parameters = parameters
+        self.lengths = dict(zip(parameters, lengths))
+        self.passes = []
+        self.track_times = collections.OrderedDict()
+        self.insert_times = []
+        self.full_times = []
+        self.change_times = {}
+        self.sizes = []
+
+    def add_pass(self, inner, lengths):
+        """ records a pass exploring the inner parameters innermost """
+        self.passes.append(list(inner))
+        self.lengths.update(zip(inner, lengths))
+
+    def add_track_time(self, name, seconds):
+        self.track_times.setdefault(name, []).append(seconds)
+
+    @property
+    def count(self):
+        """ the number of documents """
+        return sum(reduce(lambda a, n: a * self.lengths[n],
+                          self.parameters + inner, 1)
+                   for inner in self.passes or [[]])
+
+    @staticmethod
+    def _mean(times):
+        return sum(times) / len(times) if times else 0.0
+
+    def sample_time(self):
+        """ seconds to render a sample where every parameter changed """
+        return self._mean(self.full_times)
+
+    def bytes(self):
+        """ bytes of all documents """
+        return int(self._mean(self.sizes) * self.count)
+
+    def files(self):
+        return self.count
+
+    def time(self, order=None, workers=1):
+        """
+        Seconds to explore everything with the parameters in the given
+        order, outermost first, by default the explorer's. A sample costs
+        what changing its outermost changed parameter costs, or the
+        parameters inside it, whichever is more. With several workers,
+        each explores a share of the outermost parameter's values. The
+        passes are made one after another.
+        """
+        order = list(order) if order else self.parameters
+        return sum(self.__pass_time(order + inner, workers)
+                   for inner in self.passes or [[]])
+
+    def __pass_time(self, order, workers):
+        order = [n for n in order if self.lengths[n] > 1]
+        if not order:
+            return self.sample_time()
+        cost = [self._mean(self.change_times[n]) for n in order]
+        total = self.sample_time()
+        done = 1
+        for i, name in enumerate(order):
+            #samples in which name is the outermost parameter to change
+            samples = done * (self.lengths[name] - 1)
+            done *= self.lengths[name]
+            total += samples * max(cost[i:])
+        outer = self.lengths[order[0]]
+        return total * math.ceil(float(outer) / max(1, workers)) / outer
+
+    def orders(self, workers=1):
+        """ (seconds, order) for every parameter order, fastest first """
+        return sorted((self.time(list(order), workers), list(order))
+                      for order in itertools.permutations(self.parameters))
+
+    def report(self):
+        lines = ["%d documents, %d bytes" % (self.count, self.bytes()),
+                 "explore time %.1f s" % self.time()]
+        for name, times in self.track_times.items():
+            lines.append("  track %s %.4f s per sample" % (name, self._mean(times)))
+        lines.append("  insert %.4f s per sample" % self._mean(self.insert_times))
+        seconds, order = self.orders()[0]
+        lines.append("fastest order %s, %.1f s" % (", ".join(order), seconds))
+        return "\n".join(lines)
+
+class AdaptiveExplorer(Explorer):
+    """
+    An Explorer that spends its renders where the images change. The
+    values listed for the adaptive parameters are a coarse start. After
+    they have all been explored, the interval between the neighbouring
+    values whose images differ the most is split in two and its midpoint
+    explored, for all combinations of the other parameters, until no
+    interval differs by more than threshold or budget renders have been
+    made. The values explored are then written back to the store's
+    parameter_list, which is saved if the explorer writes to the store.
+
+    Documents are compared once they have been inserted, so their data
+    may be set by insert, synchronously or not, as the image explorers
+    do. Their data is compared by difference, which defaults to the mean
+    absolute difference of the images' pixels, scaled to between 0 and 1.
+    Only the data of documents at the ends of intervals that may still be
+    split is kept in memory.
+    """
+
+    def __init__(self,
+        cinema_store,
+        parameters,
+        tracks,
+        adaptive, #names of the numeric parameters to refine
+        threshold=0.02, #differences at or below this are left alone
+        budget=1000, #the most documents to render, coarse ones included
+        min_step=0, #intervals this narrow are not split
+        difference=None, #function of two documents' data to a number
+        **kwargs #for the explorer this is mixed into
+        ):
+        super(AdaptiveExplorer, self).__init__(cinema_store, parameters, tracks,
+                                               **kwargs)
+        self.adaptive = adaptive
+        self.threshold = threshold
+        self.budget = budget
+        self.min_step = min_step
+        self.difference = difference if difference else self.image_difference
+        self.samples = 0
+        self.__kept = {}
+
+    @staticmethod
+    def image_difference(a, b):
+        import numpy
+        import PIL.Image
+        import image_compaction
+        from StringIO import StringIO
+        def decode(data):
+            #the full frame, if a transform compacted it
+            data = image_compaction.expand_document(cinema_store.Document({}, data)).data
+            if isinstance(data, numpy.ndarray):
+                img = PIL.Image.fromarray(data)
+            else:
+                img = PIL.Image.open(StringIO(data))
+            return numpy.asarray(img.convert('RGB'), dtype=numpy.float32)
+        images = [decode(d) for d in (a, b)]
+        if images[0].shape != images[1].shape:
+            return 1.0
+        return float(numpy.abs(images[0] - images[1]).mean()) / 255.0
+
+    def __key(self, desc):
+        return tuple(desc[n] for n in self.parameters)
+
+    def __sample(self, desc, fixedargs):
+        desc = dict(desc)
+        if fixedargs != None:
+            desc.update(fixedargs)
+        self.execute(desc)
+        self.samples += 1
+
+    def __collect(self):
+        """ keeps the data of the documents inserted since the last call """
+        docs = self.inserted()
+        for doc in docs:
+            self.__kept[self.__key(doc.descriptor)] = doc.data
+        return docs
+
+    def __prune(self, intervals):
+        """ forgets the data that no open interval's ends need """
+        ends = dict((name, set()) for name in self.adaptive)
+        for diff, name, lo, hi in intervals:
+            ends[name].update((lo, hi))
+        positions = [(self.parameters.index(name), ends[name])
+                     for name in self.adaptive]
+        for key in self.__kept.keys():
+            if not any(key[i] in values for i, values in positions):
+                del self.__kept[key]
+
+    def __combinations(self, values, name, value):
+        """ descriptors for value of name with every value of the others """
+        others = [n for n in self.parameters if n != name]
+        for element in itertools.product(*[values[n] for n in others]):
+            desc = dict(itertools.izip(others, element))
+            desc[name] = value
+            yield desc
+
+    def __measure(self, values, name, lo, hi):
+        worst = 0
+        for desc in self.__combinations(values, name, lo):
+            a = self.__kept.get(self.__key(desc))
+            desc[name] = hi
+            b = self.__kept.get(self.__key(desc))
+            if a is not None and b is not None:
+                worst = max(worst, self.difference(a, b))
+        return worst
+
+    @staticmethod
+    def __midpoint(lo, hi):
+        if isinstance(lo, int) and isinstance(hi, int):
+            return (lo + hi) // 2
+        return (lo + hi) / 2.0
+
+    def stream(self, fixedargs=None):
+        """
+        Explore the coarse values, then refine, yielding each document as
+        soon as it has been inserted.
+        """
+        import heapq
+        self.prepare()
+        self.samples = 0
+        self.__kept = {}
+
+        values = dict((name, sorted(self.cinema_store.get_parameter(name)['values']))
+                      if name in self.adaptive else
+                      (name, list(self.cinema_store.get_parameter(name)['values']))
+                      for name in self.parameters)
+        for element in itertools.product(*[values[n] for n in self.parameters]):
+            self.__sample(dict(itertools.izip(self.parameters, element)),
+                          fixedargs)
+            for doc in self.__collect():
+                yield doc
+        self.drain()
+        for doc in self.__collect():
+            yield doc
+
+        #largest difference first
+        intervals = []
+        def push(name, lo, hi):
+            mid = self.__midpoint(lo, hi)
+            if mid == lo or mid == hi or hi - lo <= self.min_step:
+                return
+            diff = self.__measure(values, name, lo, hi)
+            if diff > self.threshold:
+                heapq.heappush(intervals, (-diff, name, lo, hi))
+        for name in self.adaptive:
+            for lo, hi in zip(values[name][:-1], values[name][1:]):
+                push(name, lo, hi)
+        self.__prune(intervals)
+
+        while intervals:
+            diff, name, lo, hi = heapq.heappop(intervals)
+            mid = self.__midpoint(lo, hi)
+            cost = len(list(self.__combinations(values, name, mid)))
+            if self.samples + cost <= self.budget:
+                for desc in list(self.__combinations(values, name, mid)):
+                    self.__sample(desc, fixedargs)
+                    for doc in self.__collect():
+                        yield doc
+                self.drain()
+                for doc in self.__collect():
+                    yield doc
+                values[name].append(mid)
+                values[name].sort()
+                push(name, lo, mid)
+                push(name, mid, hi)
+            self.__prune(intervals)
+
+        for name in self.adaptive:
+            self.cinema_store.get_parameter(name)['values'] = values[name]
+        if self.write_to_store:
+            self.cinema_store.save()
+        self.__kept = {}
+        self.finish()
+        for doc in self.inserted():
+            yield doc
+
+class Layer(object):
+    """
+    One independently rendered object in a layered explore. A layer has its
+    own parameters and tracks, and is made visible on its own while those
+    are explored. Subclasses toggle the visibility of the actual object.
+    """
+
+    def __init__(self, name, parameters, tracks):
+        self.name = name
+        self.parameters = parameters
+        self.tracks = tracks
+
+    def set_visible(self, visible):
+        """ subclasses show or hide the object here """
+        pass
+
+class LayeredExplorer(Explorer):
+    """
+    An Explorer that renders each layer alone rather than every combination
+    of all layers' parameters. The shared parameters (the camera for
+    instance) are explored for every layer, but each layer's own parameters
+    are only explored while that layer is the one shown. Documents are
+    tagged with a 'layer' parameter, which the store's filename_pattern must
+    include. The layers can then be combined at query time, see
+    compositing.find_composite. The cost of the run is the sum of the
+    layers' costs rather than their product.
+    """
+
+    def __init__(self,
+        cinema_store,
+        parameters, #shared by every layer
+        tracks, #operate on the shared parameters
+        layers #Layer instances, each rendered on its own
+        ):
+        super(LayeredExplorer, self).__init__(cinema_store, parameters, tracks)
+        self.layers = layers
+
+    def prepare(self):
+        names = [layer.name for layer in self.layers]
+        if not 'layer' in self.cinema_store.parameter_list:
+            self.cinema_store.add_parameter('layer',
+                cinema_store.make_parameter('layer', names, typechoice='list'))
+        super(LayeredExplorer, self).prepare()
+        for layer in self.layers:
+            for e in layer.tracks:
+                e.prepare(self)
+        #after the tracks, which may set a type of their own
+        self.cinema_store.add_metadata({
+            'type' : 'composite-image-stack',
+            'layers' : dict((layer.name, layer.parameters) for layer in self.layers)
+            })
+
+    def _passes(self):
+        """ one pass per layer, with the layer alone visible """
+        for layer in self.layers:
+            for other in self.layers:
+                other.set_visible(other is layer)
+            yield layer.parameters, (self.tracks or []) + layer.tracks, \
+                    {'layer': layer.name}
+        for layer in self.layers:
+            layer.set_visible(True)
+
+    def finish(self):
+        super(LayeredExplorer, self).finish()
+        for layer in self.layers:
+            for e in layer.tracks:
+                e.finish()
 
 class Track(object):
     """
@@ -78,19 +622,84 @@ class Track(object):
     to use this:
     caller should set up some visualization
     then tie a particular set of parameters to an action with a track
+
+    Tracks that keep their outputs for reuse set cache to an OutputCache,
+    which is cleared when an explore starts and ends.
     """
 
+    cache = None
+
     def __init__(self):
         pass
 
     def prepare(self, explorer):
         """ subclasses get ready to run here """
-        pass
+        if self.cache:
+            #the data upstream may have changed since the last explore
+            self.cache.clear()
 
     def finish(self):
         """ subclasses cleanup after running here """
-        pass
+        if self.cache:
+            self.cache.clear()
 
     def execute(self, document):
         """ subclasses operate on parameters here"""
         pass
+
+class OutputCache(object):
+    """
+    Remembers a filter's output for each value of a track's parameter, so
+    that when the value comes around again during an explore the filter
+    need not run again. Outputs are kept up to max_bytes, least recently
+    used first out. The cached outputs are only valid as long as nothing
+    upstream of the filter changes, so the tracks that use one clear it
+    when an explore starts and ends; call clear() if upstream changes
+    during an explore.
+
+    Backends define how to copy the current output (snapshot) and how to
+    hand a copy downstream (show).
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.__entries = collections.OrderedDict()
+        self.__bytes = 0
+
+    def update(self, key, apply):
+        """
+        Shows the output for key, calling apply() to set the filter up for
+        it and running the filter only when it is not cached.
+        """
+        entry = self.__entries.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            apply()
+            entry = self.snapshot()
+            if entry[1] <= self.max_bytes:
+                self.__bytes += entry[1]
+                while self.__bytes > self.max_bytes:
+                    old, (data, size) = self.__entries.popitem(last=False)
+                    self.__bytes -= size
+            else:
+                #too big to keep at all
+                self.show(entry[0])
+                return
+        else:
+            self.hits += 1
+        self.__entries[key] = entry
+        self.show(entry[0])
+
+    def clear(self):
+        self.__entries.clear()
+        self.__bytes = 0
+
+    def snapshot(self):
+        """ subclasses return (copy of the filter's output, its size in bytes) """
+        raise RuntimeError("Subclasses must define this method")
+
+    def show(self, data):
+        """ subclasses pass a copy made by snapshot downstream """
+        raise RuntimeError("Subclasses must define this method")
@@ -0,0 +1,71 @@
+"""
+    Module for encoding captured frames into image files off the render
+    thread.
+"""
+
+import collections
+from multiprocessing.pool import ThreadPool
+from StringIO import StringIO
+
+import PIL.Image
+
+_FORMATS = {'.png': 'PNG', '.jpg': 'JPEG', '.jpeg': 'JPEG'}
+
+def encode_frame(frame, image_type='.png'):
+    """
+    Encodes an (H,W,C) uint8 numpy frame into the bytes of an image file of
+    the given type, a store's get_image_type().
+    """
+    if frame.ndim == 3 and frame.shape[2] == 1:
+        frame = frame[:, :, 0]
+    buf = StringIO()
+    PIL.Image.fromarray(frame).save(buf, _FORMATS.get(image_type, 'PNG'))
+    return buf.getvalue()
+
+class FrameEncoder(object):
+    """
+    Encodes frames on a pool of threads, which run in parallel because the
+    image codecs release the GIL while compressing. At most max_in_flight
+    frames wait or are being encoded at once; submitting another one first
+    waits for the oldest. Documents come back in the order they were
+    submitted, with their data set to the encoded image.
+    """
+
+    def __init__(self, image_type='.png', workers=2, max_in_flight=8):
+        self.image_type = image_type
+        self.max_in_flight = max_in_flight
+        self.__pool = ThreadPool(workers) if workers else None
+        self.__pending = collections.deque()
+
+    def __complete_oldest(self):
+        document, result = self.__pending.popleft()
+        document.data = result.get()
+        return document
+
+    def submit(self, document, frame):
+        """
+        Queues a frame for encoding into document.data. Returns the
+        documents, oldest first, that are now complete.
+        """
+        if not self.__pool:
+            document.data = encode_frame(frame, self.image_type)
+            return [document]
+        self.__pending.append((document, self.__pool.apply_async(
+            encode_frame, (frame, self.image_type))))
+        done = []
+        while len(self.__pending) > self.max_in_flight or \
+                (self.__pending and self.__pending[0][1].ready()):
+            done.append(self.__complete_oldest())
+        return done
+
+    def drain(self):
+        """ waits for and returns every remaining document, in order """
+        done = []
+        while self.__pending:
+            done.append(self.__complete_oldest())
+        return done
+
+    def close(self):
+        if self.__pool:
+            self.__pool.close()
+            self.__pool.join()
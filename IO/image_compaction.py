@@ -0,0 +1,183 @@
+"""
+    Module for shrinking rendered images before they are stored.
+
+    Renders are mostly a small object on a uniform background, often in a
+    handful of solid colors. A compacted image is cropped to the box around
+    everything that is not background, and when it holds few enough colors,
+    kept as a palette image of one byte per pixel. How to rebuild the full
+    frame is recorded in the document's attributes and, so that stores
+    which don't keep attributes lose nothing, in a text chunk of the png.
+
+    Compact the documents of an explorer as they are inserted with:
+        e.add_transform(image_compaction.Compactor())
+    and rebuild them with expand_document, or open_expanded for files.
+"""
+
+import json
+from StringIO import StringIO
+
+import numpy
+import PIL.Image
+from PIL.PngImagePlugin import PngInfo
+
+_KEY = 'cinema_compaction'
+
+def _open(data):
+    try:
+        img = PIL.Image.open(StringIO(data))
+    except IOError:
+        return None
+    return img
+
+def _pack(arr):
+    """ one integer per pixel for an (H,W,C) uint8 array """
+    codes = numpy.zeros(arr.shape[:2], dtype=numpy.uint32)
+    for c in range(arr.shape[2]):
+        codes |= arr[..., c].astype(numpy.uint32) << (8 * c)
+    return codes
+
+def compact(data, background=None, max_colors=256):
+    """
+    Compacts the bytes of a png image. Returns the new bytes and the dict
+    needed to expand them, or data unchanged and None when it is not a png
+    or nothing would be saved.
+
+    :param background: the background color, by default that of the top
+    left pixel.
+
+    :param max_colors: the most colors to make a palette image for.
+    """
+    img = _open(data)
+    if img is None or img.format != 'PNG' or not img.mode in ('RGB', 'RGBA', 'L'):
+        return data, None
+    mode = img.mode
+    arr = numpy.asarray(img)
+    if arr.ndim == 2:
+        arr = arr[..., numpy.newaxis]
+    if mode == 'RGBA' and (arr[..., 3] == 255).all():
+        #opaque, the alpha channel carries nothing
+        arr = arr[..., :3]
+    if background is None:
+        background = arr[0, 0]
+    background = numpy.asarray(background, dtype=numpy.uint8)[:arr.shape[2]]
+
+    height, width = arr.shape[:2]
+    mask = (arr != background).any(axis=2)
+    rows = numpy.flatnonzero(mask.any(axis=1))
+    cols = numpy.flatnonzero(mask.any(axis=0))
+    if len(rows):
+        top, bottom, left, right = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+    else:
+        #nothing but background, keep a single pixel of it
+        top, bottom, left, right = 0, 1, 0, 1
+    arr = arr[top:bottom, left:right]
+
+    out = None
+    if arr.shape[2] == 3:
+        colors, indices = numpy.unique(_pack(arr), return_inverse=True)
+        if len(colors) <= max_colors:
+            out = PIL.Image.fromarray(
+                indices.reshape(arr.shape[:2]).astype(numpy.uint8), 'P')
+            palette = numpy.zeros((256, 3), dtype=numpy.uint8)
+            for c in range(3):
+                palette[:len(colors), c] = (colors >> (8 * c)) & 255
+            out.putpalette(palette.tostring())
+    if out is None:
+        if arr.shape[:2] == (height, width) and arr.shape[2] == len(mode):
+            return data, None
+        out = PIL.Image.fromarray(arr[..., 0] if mode == 'L' else arr)
+
+    info = dict(offset = [int(left), int(top)],
+                size = [width, height],
+                background = [int(v) for v in background],
+                mode = mode)
+    chunks = PngInfo()
+    chunks.add_text(_KEY, json.dumps(info))
+    buf = StringIO()
+    out.save(buf, 'PNG', pnginfo=chunks)
+    if len(buf.getvalue()) >= len(data):
+        return data, None
+    return buf.getvalue(), info
+
+def expand(data, info=None):
+    """
+    Rebuilds the full frame of compacted bytes as a numpy array, (H,W) for
+    grey images and (H,W,C) otherwise. info defaults to what the png
+    records.
+    """
+    img = PIL.Image.open(StringIO(data))
+    if info is None:
+        info = json.loads(img.info[_KEY])
+    return _expand_image(img, info)
+
+def _expand_image(img, info):
+    mode = info['mode']
+    arr = numpy.asarray(img.convert(mode))
+    if arr.ndim == 2:
+        arr = arr[..., numpy.newaxis]
+    width, height = info['size']
+    full = numpy.empty((height, width, arr.shape[2]), dtype=numpy.uint8)
+    background = list(info['background'])
+    if mode == 'RGBA' and len(background) == 3:
+        background.append(255)
+    full[...] = background
+    left, top = info['offset']
+    full[top:top + arr.shape[0], left:left + arr.shape[1]] = arr
+    return full[..., 0] if mode == 'L' else full
+
+def compaction_info(doc):
+    """ how a document was compacted, or None if it wasn't """
+    if doc.attributes and _KEY in doc.attributes:
+        return doc.attributes[_KEY]
+    if not isinstance(doc.data, str):
+        return None
+    img = _open(doc.data)
+    if img is None or not _KEY in img.info:
+        return None
+    return json.loads(img.info[_KEY])
+
+def expand_document(doc):
+    """
+    Returns a document holding the full frame of a compacted document as
+    a numpy array, or the document itself if it wasn't compacted.
+    """
+    info = compaction_info(doc)
+    if info is None:
+        return doc
+    from cinema_store import Document
+    full = Document(doc.descriptor, expand(doc.data, info))
+    full.attributes = doc.attributes
+    return full
+
+def open_expanded(doc_file):
+    """
+    Opens an image file as a PIL image of its full frame, expanded if it
+    was compacted.
+    """
+    img = PIL.Image.open(doc_file)
+    if img.format != 'PNG' or not _KEY in img.info:
+        return img
+    return PIL.Image.fromarray(_expand_image(img, json.loads(img.info[_KEY])))
+
+class Compactor(object):
+    """
+    A transform for Explorer.add_transform that compacts each document's
+    image as it is inserted, recording how in its attributes.
+    """
+    def __init__(self, background=None, max_colors=256):
+        self.background = background
+        self.max_colors = max_colors
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def __call__(self, doc):
+        if not isinstance(doc.data, str):
+            return
+        data, info = compact(doc.data, self.background, self.max_colors)
+        self.bytes_in += len(doc.data)
+        self.bytes_out += len(data)
+        if info is not None:
+            doc.data = data
+            attributes = dict(doc.attributes) if doc.attributes else {}
+            attributes[_KEY] = info
+            doc.attributes = attributes
@@ -0,0 +1,125 @@
+"""
+    Module for playing a path through a store's parameter space at a steady
+    frame rate, as an animation.
+"""
+
+import itertools
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+def parameter_path(store, query, axes, mode='loop'):
+    """
+    The descriptors of one cycle of playback: every combination of the
+    values of the axes, the last one changing fastest, with the other
+    parameters as in query. mode 'pingpong' goes back down the path after
+    going up it; 'loop' and 'once' only go up it.
+    """
+    values = [store.get_parameter(name)['values'] for name in axes]
+    frames = []
+    for element in itertools.product(*values):
+        desc = dict(query)
+        desc.update(zip(axes, element))
+        frames.append(desc)
+    if mode == 'pingpong':
+        frames = frames + frames[-2:0:-1]
+    return frames
+
+class Player(object):
+    """
+    Paces a list of frames, descriptors usually, at fps frames a second.
+    load turns a frame into what is displayed and runs on a pool of
+    threads, which keep up to lookahead frames ahead of the playhead loaded.
+
+    The caller asks for the frame to show whenever it can, e.g. from a GUI
+    timer. The playhead follows the clock rather than the number of calls,
+    so when loading or displaying falls behind, frames are skipped (and
+    counted as dropped) to keep the animation on time. While the frame due
+    has not been loaded yet, nothing new is shown. Without loop, the last
+    frame is held until it has been shown, and playback then finishes.
+    """
+
+    def __init__(self, frames, load, fps=30.0, lookahead=16, workers=4,
+                 loop=True, clock=time.time):
+        self.frames = frames
+        self.load = load
+        self.fps = float(fps)
+        self.lookahead = lookahead
+        self.loop = loop
+        self.clock = clock
+        self.shown = 0
+        self.dropped = 0
+        self.finished = False
+        self.__pool = ThreadPool(workers)
+        self.__lock = threading.Lock()
+        self.__pending = {}
+        self.__position = -1
+        self.__start = None
+
+    def __frame(self, position):
+        if self.loop:
+            return position % len(self.frames)
+        return position if position < len(self.frames) else None
+
+    def __fill(self, position):
+        """ loads the frames from position on, dropping earlier ones """
+        for old in [p for p in self.__pending if p < position]:
+            del self.__pending[old]
+        for p in range(position, position + self.lookahead):
+            frame = self.__frame(p)
+            if frame is None:
+                break
+            if not p in self.__pending:
+                self.__pending[p] = self.__pool.apply_async(
+                    self.load, (self.frames[frame],))
+
+    def start(self, position=0):
+        """ starts playing from the position'th frame """
+        with self.__lock:
+            self.__position = position - 1
+            self.__start = self.clock() - position / self.fps
+            self.finished = False
+            self.__fill(position)
+
+    def due(self):
+        """ the position of the frame that the clock says is due """
+        return int((self.clock() - self.__start) * self.fps)
+
+    def poll(self):
+        """
+        Returns (frame index, loaded frame) if a new frame should be shown
+        now, else None.
+        """
+        with self.__lock:
+            if self.__start is None or self.finished:
+                return None
+            if not self.frames:
+                self.finished = True
+                return None
+            last = len(self.frames) - 1
+            position = self.due()
+            if not self.loop:
+                position = min(position, last)
+            if position <= self.__position:
+                return None
+            self.__fill(position)
+            result = self.__pending[position]
+            if not result.ready():
+                #late, try again on the next poll
+                return None
+            self.dropped += position - self.__position - 1
+            self.__position = position
+            self.shown += 1
+            if not self.loop and position == last:
+                self.finished = True
+            return self.__frame(position), result.get()
+
+    def stop(self):
+        with self.__lock:
+            self.__start = None
+            self.__pending.clear()
+
+    def close(self):
+        self.stop()
+        self.__pool.close()
+        self.__pool.join()
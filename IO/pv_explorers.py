@@ -4,6 +4,9 @@
 """
 
 import explorers
+import camera_paths
+import compositing
+import recoloring
 
 import paraview.simple as simple
 
@@ -32,13 +35,133 @@ class ImageExplorer(explorers.Explorer):
 
         super(ImageExplorer, self).insert(document)
 
+class AdaptiveImageExplorer(explorers.AdaptiveExplorer, ImageExplorer):
+    """
+    An ImageExplorer that refines its adaptive parameters where the images
+    change, see explorers.AdaptiveExplorer.
+    """
+    def __init__(self,
+                cinema_store, parameters, tracks, adaptive,
+                threshold=0.02, budget=1000, min_step=0, difference=None,
+                view=None):
+        super(AdaptiveImageExplorer, self).__init__(
+            cinema_store, parameters, tracks, adaptive,
+            threshold, budget, min_step, difference, view=view)
+
+class MultiViewImageExplorer(explorers.MultiViewExplorer):
+    """
+    An explorer that saves images of several of a paraview script's views
+    for each sample, running the pipeline only once per sample.
+    """
+    def capture(self, view):
+        extension = self.cinema_store.get_image_type()
+        simple.WriteImage("temporary"+extension, view=view)
+        with open("temporary"+extension, "rb") as file:
+            return file.read()
+
+class ValueImageExplorer(explorers.Explorer):
+    """
+    An explorer that stores the values of one of a representation's arrays,
+    and the surface lighting, instead of a colored image. Colors are
+    applied at view time, see recoloring.find_recolored. colors maps color
+    names to ColorList style entries, with RGBPoints as the content of luts.
+    """
+    def __init__(self,
+                cinema_store, parameters, tracks,
+                view, rep, array, value_range, colors=None):
+        super(ValueImageExplorer, self).__init__(cinema_store, parameters, tracks)
+        self.view = view
+        self.rep = rep
+        self.array = array
+        self.value_range = value_range
+        self.colors = colors if colors else {}
+        self.capture = None
+        self.encoder = simple.CreateLookupTable(
+            RGBPoints=recoloring.value_encoding_points(value_range),
+            ColorSpace='RGB')
+
+    def prepare(self):
+        recoloring.set_value_images(self.cinema_store, self.array, self.value_range)
+        for name, spec in self.colors.items():
+            recoloring.add_color(self.cinema_store, name, spec)
+        super(ValueImageExplorer, self).prepare()
+
+    def insert(self, document):
+        import vtk_explorers
+        if not self.capture:
+            self.capture = vtk_explorers.WindowCapture(self.view.GetRenderWindow())
+        rep = self.rep
+        saved = (rep.ColorArrayName, rep.LookupTable, rep.DiffuseColor,
+                 rep.Ambient, rep.Diffuse, rep.Specular)
+
+        #lighting pass, a white surface not colored by any array
+        rep.ColorArrayName = None
+        rep.DiffuseColor = [1, 1, 1]
+        simple.Render(self.view)
+        rgb, depth = self.capture.capture()
+        luminance = rgb[:, :, 0] / 255.0
+
+        #value pass, scalars encoded in colors without lighting
+        rep.LookupTable = self.encoder
+        rep.ColorArrayName = self.array
+        rep.Ambient = 1.0
+        rep.Diffuse = 0.0
+        rep.Specular = 0.0
+        simple.Render(self.view)
+        rgb, depth = self.capture.capture()
+        values = recoloring.decode_values(rgb, self.value_range, depth)
+
+        (rep.ColorArrayName, rep.LookupTable, rep.DiffuseColor,
+         rep.Ambient, rep.Diffuse, rep.Specular) = saved
+
+        document.data = recoloring.encode_value_image(values, luminance)
+        super(ValueImageExplorer, self).insert(document)
+
+class LayeredImageExplorer(explorers.LayeredExplorer):
+    """
+    An explorer that renders each layer of a paraview script's view alone
+    and stores its color and depth buffers, for compositing at query time.
+    """
+    def __init__(self,
+                cinema_store, parameters, tracks, layers,
+                view=None):
+        super(LayeredImageExplorer, self).__init__(
+            cinema_store, parameters, tracks, layers)
+        self.view = view
+        self.capture = None
+
+    def insert(self, document):
+        import vtk_explorers
+        simple.Render(self.view)
+        if not self.capture:
+            self.capture = vtk_explorers.WindowCapture(self.view.GetRenderWindow())
+        rgb, depth = self.capture.capture()
+        document.data = compositing.encode_layer(rgb, depth)
+        super(LayeredImageExplorer, self).insert(document)
+
+class RepresentationLayer(explorers.Layer):
+    """
+    A layer made up of one or more paraview representations.
+    """
+    def __init__(self, name, parameters, tracks, reps):
+        super(RepresentationLayer, self).__init__(name, parameters, tracks)
+        self.reps = reps
+
+    def set_visible(self, visible):
+        for rep in self.reps:
+            rep.Visibility = 1 if visible else 0
+
 class Camera(explorers.Track):
     """
     A track that connects a paraview script's camera to the phi and theta tracks.
     This allows the creation of spherical camera stores where the user can
     view the data from many points around it.
+
+    Poses come from a camera_paths.CameraPath, which computes all of them
+    once in prepare. By default that is a spherical path around center
+    whose pole is the given axis.
     """
-    def __init__(self, center, axis, distance, view):
+    def __init__(self, center, axis, distance, view, path=None):
         super(Camera, self).__init__()
         try:
             # Z => 0 | Y => 2 | X => 1
@@ -48,55 +171,63 @@ class Camera(explorers.Track):
         self.center = center
         self.distance = distance
         self.view = view
+        self.path = path if path else \
+                camera_paths.SphericalPath(center, distance, self.offset)
+
+    def prepare(self, explorer):
+        super(Camera, self).prepare(explorer)
+        self.path.prepare(explorer.cinema_store)
+        explorer.cinema_store.add_metadata(
+            {'camera_path' : self.path.get_metadata()})
 
     def execute(self, document):
-        import math
-        theta = document.descriptor['theta']
-        phi = document.descriptor['phi']
-
-        theta_rad = float(theta) / 180.0 * math.pi
-        phi_rad = float(phi) / 180.0 * math.pi
-        pos = [
-            float(self.center[0]) - math.cos(phi_rad)   * self.distance * math.cos(theta_rad),
-            float(self.center[1]) + math.sin(phi_rad)   * self.distance * math.cos(theta_rad),
-            float(self.center[2]) + math.sin(theta_rad) * self.distance
-            ]
-        up = [
-            + math.cos(phi_rad) * math.sin(theta_rad),
-            - math.sin(phi_rad) * math.sin(theta_rad),
-            + math.cos(theta_rad)
-            ]
+        pos, focal, up = self.path.get_pose(document.descriptor)
         self.view.CameraPosition = pos
         self.view.CameraViewUp = up
-        self.view.CameraFocalPoint = self.center
+        self.view.CameraFocalPoint = focal
 
     @staticmethod
     def obtain_angles(angular_steps=[10,15]):
-        import math
-        thetas = []
-        phis = []
-        theta_offset = 90 % angular_steps[1]
-        if theta_offset == 0:
-            theta_offset += angular_steps[1]
-        for theta in range(-90 + theta_offset,
-                           90 - theta_offset + 1, angular_steps[1]):
-            theta_rad = float(theta) / 180.0 * math.pi
-            for phi in range(0, 360, angular_steps[0]):
-                phi_rad = float(phi) / 180.0 * math.pi
-                thetas.append(theta)
-                phis.append(phi)
-        return thetas, phis
+        return camera_paths.obtain_angles(angular_steps)
+
+class ParaViewOutputCache(explorers.OutputCache):
+    """
+    An OutputCache for a paraview filter, in builtin (not client/server)
+    sessions. Cached outputs are handed on through a trivial producer,
+    'output', which must be shown in place of the filter.
+    """
+    def __init__(self, filt, max_bytes):
+        super(ParaViewOutputCache, self).__init__(max_bytes)
+        self.filt = filt
+        self.output = simple.PVTrivialProducer()
+
+    def snapshot(self):
+        simple.UpdatePipeline(proxy=self.filt)
+        output = self.filt.GetClientSideObject().GetOutputDataObject(0)
+        data = output.NewInstance()
+        data.ShallowCopy(output)
+        return data, data.GetActualMemorySize() * 1024
+
+    def show(self, data):
+        self.output.GetClientSideObject().SetOutput(data)
+        self.output.MarkModified(self.output)
+        simple.UpdatePipeline(proxy=self.output)
 
 class Slice(explorers.Track):
     """
     A track that connects slice filters to a scalar valued parameter.
+
+    When cache_bytes is given the slices are kept for reuse, and the
+    track's 'output' must be shown instead of the filter.
     """
 
-    def __init__(self, parameter, filt):
+    def __init__(self, parameter, filt, cache_bytes=None):
         super(Slice, self).__init__()
 
         self.parameter = parameter
         self.slice = filt
+        self.cache = ParaViewOutputCache(filt, cache_bytes) if cache_bytes else None
+        self.output = self.cache.output if self.cache else filt
 
     def prepare(self, explorer):
         super(Slice, self).prepare(explorer)
@@ -104,18 +235,26 @@ class Slice(explorers.Track):
 
     def execute(self, doc):
         o = doc.descriptor[self.parameter]
-        self.slice.SliceOffsetValues=[o]
+        if self.cache:
+            self.cache.update(o, lambda: setattr(self.slice, 'SliceOffsetValues', [o]))
+        else:
+            self.slice.SliceOffsetValues=[o]
 
 class Contour(explorers.Track):
     """
     A track that connects contour filters to a scalar valued parameter.
+
+    When cache_bytes is given the contours are kept for reuse, and the
+    track's 'output' must be shown instead of the filter.
     """
 
-    def __init__(self, parameter, filt):
+    def __init__(self, parameter, filt, cache_bytes=None):
         super(Contour, self).__init__()
         self.parameter = parameter
         self.contour = filt
         self.control = 'Isosurfaces'
+        self.cache = ParaViewOutputCache(filt, cache_bytes) if cache_bytes else None
+        self.output = self.cache.output if self.cache else filt
 
     def prepare(self, explorer):
         super(Contour, self).prepare(explorer)
@@ -123,24 +262,35 @@ class Contour(explorers.Track):
 
     def execute(self, doc):
         o = doc.descriptor[self.parameter]
-        self.contour.SetPropertyWithName(self.control,[o])
+        if self.cache:
+            self.cache.update(o, lambda: self.contour.SetPropertyWithName(self.control,[o]))
+        else:
+            self.contour.SetPropertyWithName(self.control,[o])
 
 class Templated(explorers.Track):
     """
     A track that connects any type of filter to a scalar valued
     'control' parameter.
+
+    When cache_bytes is given the filter's outputs are kept for reuse, and
+    the track's 'output' must be shown instead of the filter.
     """
 
-    def __init__(self, parameter, filt, control):
+    def __init__(self, parameter, filt, control, cache_bytes=None):
         explorers.Track.__init__(self)
 
         self.parameter = parameter
         self.filt = filt
         self.control = control
+        self.cache = ParaViewOutputCache(filt, cache_bytes) if cache_bytes else None
+        self.output = self.cache.output if self.cache else filt
 
     def execute(self, doc):
         o = doc.descriptor[self.parameter]
-        self.filt.SetPropertyWithName(self.control,[o])
+        if self.cache:
+            self.cache.update(o, lambda: self.filt.SetPropertyWithName(self.control,[o]))
+        else:
+            self.filt.SetPropertyWithName(self.control,[o])
 
 class ColorList():
     """
@@ -0,0 +1,157 @@
+"""
+    Module for coloring stored scalar value images at view time.
+
+    Instead of rendering and storing one image per color choice, a value
+    image store keeps, for every sample, the scalar value under each pixel
+    and the lighting (luminance) of the surface. Any solid color or color
+    map is then applied when the image is looked at, so adding a color
+    choice needs no new renders and the color parameter takes no space.
+"""
+
+import numpy
+from StringIO import StringIO
+
+import cinema_store
+
+#values are captured by rendering them through a color map that encodes
+#them into the red (coarse) and green (fine) channels
+_LEVELS = 256
+
+def value_encoding_points(value_range):
+    """
+    Returns RGBPoints (x, r, g, b, ...) for a color map that encodes values
+    in value_range into colors which decode_values can read back.
+    """
+    lo, hi = [float(v) for v in value_range]
+    width = (hi - lo) / _LEVELS
+    points = []
+    for k in range(_LEVELS):
+        coarse = k / float(_LEVELS - 1)
+        points.extend([lo + k * width, coarse, 0.0, 0.0])
+        points.extend([lo + (k + 1) * width - width * 1e-3, coarse, 1.0, 0.0])
+    return points
+
+def decode_values(rgb, value_range, depth=None, far=1.0):
+    """
+    Converts an image rendered through value_encoding_points back into
+    values. Pixels at the far plane of depth, if given, become NaN.
+    """
+    lo, hi = [float(v) for v in value_range]
+    coarse = rgb[..., 0].astype(numpy.float32)
+    fine = rgb[..., 1].astype(numpy.float32) / 255.0
+    values = lo + (coarse + fine) / _LEVELS * (hi - lo)
+    if depth is not None:
+        values[depth >= far] = numpy.nan
+    return values
+
+def encode_value_image(values, luminance):
+    """
+    Packs a float value image (H,W), NaN where nothing was drawn, and the
+    matching luminance image (H,W) into a document's data.
+    """
+    buf = StringIO()
+    numpy.savez_compressed(buf,
+                           values=values.astype(numpy.float32),
+                           luminance=luminance.astype(numpy.float32))
+    return buf.getvalue()
+
+def decode_value_image(data):
+    """ Inverse of encode_value_image, returns (values, luminance) """
+    npz = numpy.load(StringIO(data))
+    return npz['values'], npz['luminance']
+
+class LookupTable(object):
+    """
+    A color map given as ParaView style RGBPoints, [x, r, g, b, ...] with
+    color components between 0 and 1.
+    """
+    def __init__(self, rgb_points):
+        points = numpy.asarray(rgb_points, dtype=float).reshape(-1, 4)
+        self.rgb_points = list(rgb_points)
+        self.xs = points[:, 0]
+        self.colors = points[:, 1:]
+
+    def map(self, values):
+        """ returns an (...,3) array of colors for an array of values """
+        return numpy.dstack([numpy.interp(values, self.xs, self.colors[:, c])
+                             for c in range(3)]).reshape(values.shape + (3,))
+
+def recolor(values, luminance, spec, background=None):
+    """
+    Colors a value image. spec is a ColorList style entry, either
+    {'type':'rgb', 'content':[r,g,b]} or {'type':'lut', 'content':RGBPoints}.
+    Returns an (H,W,3) uint8 image.
+    """
+    if spec['type'] == 'rgb':
+        colors = numpy.empty(values.shape + (3,), dtype=numpy.float32)
+        colors[...] = spec['content']
+    elif spec['type'] == 'lut':
+        colors = LookupTable(spec['content']).map(values)
+    else:
+        raise RuntimeError("Unknown color type %s" % spec['type'])
+
+    shaded = colors * luminance[..., numpy.newaxis]
+    result = numpy.clip(shaded * 255.0, 0, 255).astype(numpy.uint8)
+    result[numpy.isnan(values)] = background if background is not None else 0
+    return result
+
+def set_value_images(store, array, value_range):
+    """
+    Makes store a value image store of array's values over value_range.
+    The color choices the store already has are kept.
+    """
+    md = store.metadata or {}
+    colors = md.get('value_images', {}).get('colors', {})
+    store.add_metadata({'value_images' : {
+        'array' : array,
+        'range' : list(value_range),
+        'colors' : colors
+        }})
+
+def add_color(store, name, spec):
+    """
+    Makes a new color choice available on a value image store. The store
+    must be saved afterwards to keep it.
+    """
+    md = store.metadata
+    md['value_images']['colors'][name] = spec
+    if 'color' in store.parameter_list:
+        values = store.get_parameter('color')['values']
+        if not name in values:
+            values.append(name)
+    else:
+        store.add_parameter('color',
+            cinema_store.make_parameter('color', [name], typechoice='list'))
+
+def is_value_image_store(store):
+    return bool(store.metadata) and 'value_images' in store.metadata
+
+def _color_name(store, q):
+    if q and 'color' in q:
+        return q['color']
+    return store.get_parameter('color')['default']
+
+def recolor_document(store, doc, q=None, background=None):
+    """
+    Colors a document read from a value image store, with the color the
+    query names or else the default one. Returns a new document whose data
+    is an (H,W,3) uint8 image.
+    """
+    name = _color_name(store, q)
+    spec = store.metadata['value_images']['colors'][name]
+    values, luminance = decode_value_image(doc.data)
+    desc = dict(doc.descriptor)
+    desc['color'] = name
+    return cinema_store.Document(desc, recolor(values, luminance, spec, background))
+
+def find_recolored(store, q=None, background=None):
+    """
+    Like store.find, but for value image stores. The 'color' entry of the
+    query (or the default color) selects the color applied, and the
+    documents found hold (H,W,3) uint8 images as their data.
+    """
+    q = dict(q) if q else dict()
+    name = _color_name(store, q)
+    q.pop('color', None)
+    for doc in store.find(q):
+        yield recolor_document(store, doc, {'color': name}, background)
@@ -0,0 +1,243 @@
+"""
+    Module for finding the images of a store that look alike.
+
+    Each image is reduced to a perceptual hash, a few bytes that change
+    little when the image changes little, and the hashes of the whole
+    store are kept in one numpy array. Looking for similar images is then
+    a vectorized Hamming distance over that array, with no image decoded.
+
+    An index is built over an existing file store with build, or while an
+    explorer runs with:
+        index = similarity_index.SimilarityIndex()
+        e.add_sink(sinks.CallbackSink(index.add_document))
+
+    usage: python similarity_index.py src/info.json index.npz
+"""
+
+import itertools
+import json
+from multiprocessing import Pool
+from StringIO import StringIO
+
+import numpy
+import PIL.Image
+
+import image_compaction
+
+#the number of bits set in each byte
+_POPCOUNT = numpy.array([bin(i).count('1') for i in range(256)], dtype=numpy.uint8)
+
+def image_hash(img, hash_size=8):
+    """
+    The difference hash of a PIL image, hash_size**2 bits saying whether
+    each pixel of a small grey version of it is brighter than its right
+    hand neighbour, packed into a uint8 array.
+    """
+    img.draft('L', (hash_size * 4, hash_size * 4))
+    small = img.convert('L').resize((hash_size + 1, hash_size), PIL.Image.ANTIALIAS)
+    pixels = numpy.asarray(small, dtype=numpy.int16)
+    return numpy.packbits(pixels[:, 1:] > pixels[:, :-1])
+
+def data_hash(data, hash_size=8):
+    """ image_hash of the bytes of an image file """
+    return image_hash(PIL.Image.open(StringIO(data)), hash_size)
+
+def _distances(hashes, hash):
+    return _POPCOUNT[numpy.bitwise_xor(hashes, hash)].sum(axis=1, dtype=numpy.int32)
+
+def _key(descriptor):
+    return tuple(sorted((k, str(v)) for k, v in descriptor.items()))
+
+class SimilarityIndex(object):
+    """
+    The perceptual hashes of a set of documents, one row of hashes per
+    entry of descriptors.
+    """
+
+    def __init__(self, hash_size=8, descriptors=None, hashes=None):
+        self.hash_size = hash_size
+        self.descriptors = descriptors if descriptors is not None else []
+        self.hashes = hashes if hashes is not None else \
+                numpy.zeros((0, (hash_size * hash_size + 7) // 8), dtype=numpy.uint8)
+        self.__rows = dict((_key(d), i) for i, d in enumerate(self.descriptors))
+        self.__pending = []
+
+    def add(self, descriptor, hash):
+        """ records a document's hash, replacing any it had """
+        key = _key(descriptor)
+        if key in self.__rows:
+            self.__rows_array()[self.__rows[key]] = hash
+            return
+        self.__rows[key] = len(self.descriptors)
+        self.descriptors.append(dict(descriptor))
+        self.__pending.append(hash)
+
+    def add_document(self, doc):
+        """
+        hashes a document's image, its full frame if it was compacted,
+        and records it, if it is one
+        """
+        data = image_compaction.expand_document(doc).data
+        if isinstance(data, numpy.ndarray):
+            hash = image_hash(PIL.Image.fromarray(data), self.hash_size)
+        elif isinstance(data, str):
+            try:
+                hash = data_hash(data, self.hash_size)
+            except IOError:
+                #not an image
+                return
+        else:
+            return
+        self.add(doc.descriptor, hash)
+
+    def __rows_array(self):
+        #rows added one at a time are stacked on first use
+        if self.__pending:
+            self.hashes = numpy.vstack([self.hashes] + self.__pending)
+            self.__pending = []
+        return self.hashes
+
+    def __len__(self):
+        return len(self.descriptors)
+
+    def hash_of(self, descriptor):
+        """ the hash recorded for a descriptor, None if there is none """
+        row = self.__rows.get(_key(descriptor))
+        return None if row is None else self.__rows_array()[row]
+
+    def distances(self, hash):
+        """ the Hamming distance from hash to every document's hash """
+        return _distances(self.__rows_array(), hash)
+
+    def search(self, hash, k=10, max_distance=None):
+        """
+        Returns up to k (distance, descriptor) pairs, closest first, of the
+        documents whose hashes are nearest to hash.
+        """
+        dists = self.distances(hash)
+        if max_distance is not None:
+            candidates = numpy.flatnonzero(dists <= max_distance)
+        else:
+            candidates = numpy.arange(len(dists))
+        if len(candidates) > k:
+            nearest = numpy.argpartition(dists[candidates], k - 1)[:k]
+            candidates = candidates[nearest]
+        order = candidates[numpy.argsort(dists[candidates], kind='mergesort')]
+        return [(int(dists[i]), self.descriptors[i]) for i in order]
+
+    def similar(self, descriptor, k=10, max_distance=None):
+        """ like search, for the document with the given descriptor """
+        hash = self.hash_of(descriptor)
+        if hash is None:
+            raise KeyError("No document %s in the index" % str(descriptor))
+        return self.search(hash, k, max_distance)
+
+    def __buckets(self, max_distance):
+        """
+        Splits the hashes' bits into max_distance + 1 bands and buckets the
+        documents by the bits they have in each band. Hashes within
+        max_distance of each other agree on at least one whole band, so
+        they share a bucket. Returns each document's buckets.
+        """
+        hashes = self.__rows_array()
+        bits = numpy.unpackbits(hashes, axis=1)[:, :self.hash_size ** 2]
+        if max_distance < bits.shape[1]:
+            bands = numpy.array_split(bits, max_distance + 1, axis=1)
+        else:
+            #everything is that close
+            bands = [bits[:, :0]]
+        buckets = [[] for row in range(len(hashes))]
+        for band in bands:
+            members = {}
+            keys = [key.tostring() for key in numpy.packbits(band, axis=1)]
+            for row, key in enumerate(keys):
+                members.setdefault(key, []).append(row)
+            for row, key in enumerate(keys):
+                buckets[row].append(members[key])
+        return buckets
+
+    def duplicates(self, max_distance=4):
+        """
+        Groups the documents whose hashes are within max_distance of the
+        first document of the group. Returns lists of descriptors, one per
+        group of two or more. Only documents sharing a bucket with the
+        first one are compared to it.
+        """
+        hashes = self.__rows_array()
+        buckets = self.__buckets(max_distance)
+        unassigned = numpy.ones(len(hashes), dtype=bool)
+        groups = []
+        for i in range(len(hashes)):
+            if not unassigned[i]:
+                continue
+            candidates = numpy.array(sorted(set(
+                itertools.chain.from_iterable(buckets[i]))))
+            candidates = candidates[unassigned[candidates]]
+            close = candidates[_distances(hashes[candidates], hashes[i]) <= max_distance]
+            unassigned[close] = False
+            if len(close) > 1:
+                groups.append([self.descriptors[j] for j in close])
+        return groups
+
+    def save(self, fname):
+        numpy.savez(fname, hashes=self.__rows_array(),
+                    descriptors=numpy.array(json.dumps(self.descriptors)),
+                    hash_size=numpy.array(self.hash_size))
+
+def load(fname):
+    """ reads an index written by SimilarityIndex.save """
+    npz = numpy.load(fname)
+    return SimilarityIndex(int(npz['hash_size']),
+                           json.loads(str(npz['descriptors'])),
+                           npz['hashes'])
+
+def _hash_file(task):
+    doc_file, hash_size = task
+    try:
+        return doc_file, image_hash(image_compaction.open_expanded(doc_file),
+                                    hash_size)
+    except IOError:
+        #not an image
+        return doc_file, None
+
+def build(store, q=None, hash_size=8, workers=None):
+    """
+    Hashes the images of a loaded FileStore that match the query with a
+    pool of processes and returns the index.
+    """
+    index = SimilarityIndex(hash_size)
+    tasks = ((doc_file, hash_size) for doc_file in store.find_files(q))
+    pool = Pool(workers)
+    try:
+        for doc_file, hash in pool.imap_unordered(_hash_file, tasks, 64):
+            if hash is not None:
+                index.add(store.get_descriptor(doc_file), hash)
+    finally:
+        pool.close()
+        pool.join()
+    return index
+
+def main(argv=None):
+    import argparse
+    import cinema_store
+    parser = argparse.ArgumentParser(description=
+        "Build a perceptual hash index of the images of a cinema file store.")
+    parser.add_argument("src", help="the store's info.json")
+    parser.add_argument("dest", help="the .npz file to write")
+    parser.add_argument("--hash-size", type=int, default=8,
+                        help="hashes have this squared bits")
+    parser.add_argument("--query", default=None,
+                        help="json query restricting the documents hashed")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of processes, all cores by default")
+    args = parser.parse_args(argv)
+
+    store = cinema_store.FileStore(args.src)
+    store.load()
+    index = build(store, json.loads(args.query) if args.query else None,
+                  args.hash_size, args.workers)
+    index.save(args.dest)
+    print "hashed %d documents into %s" % (len(index), args.dest)
+
+if __name__ == "__main__":
+    main()
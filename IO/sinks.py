@@ -0,0 +1,158 @@
+"""
+    Module defining sinks, the consumers that an Explorer hands its
+    documents to as they are produced, in addition to or instead of its
+    store. Sinks let in situ runs analyze or display results while a sweep
+    is still going, without going through the file system.
+"""
+
+import json
+import socket
+import struct
+import threading
+import Queue
+
+import cinema_store
+
+class Sink(object):
+    """
+    Abstract consumer of documents.
+    """
+
+    def put(self, document):
+        """ subclasses consume a document here """
+        pass
+
+    def flush(self):
+        """ returns once every document put so far has been consumed """
+        pass
+
+    def close(self):
+        """ subclasses release their resources here """
+        pass
+
+class StoreSink(Sink):
+    """
+    Inserts documents into a store.
+    """
+    def __init__(self, store):
+        self.store = store
+
+    def put(self, document):
+        self.store.insert(document)
+
+class CallbackSink(Sink):
+    """
+    Calls a function with each document, for instance to accumulate
+    statistics.
+    """
+    def __init__(self, callback):
+        self.callback = callback
+
+    def put(self, document):
+        self.callback(document)
+
+def _as_bytes(data):
+    if data is None:
+        return ''
+    if hasattr(data, 'tostring'):
+        #numpy arrays, as produced by vtk_explorers.ImageExplorer
+        return data.tostring()
+    return str(data)
+
+def _recv_exactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            raise EOFError("Connection closed")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return ''.join(chunks)
+
+def read_document(sock):
+    """
+    Reads one document sent by a SocketSink from a connected socket.
+    Raises EOFError once the sender is done.
+    """
+    size, = struct.unpack('!I', _recv_exactly(sock, 4))
+    header = json.loads(_recv_exactly(sock, size))
+    doc = cinema_store.Document(header['descriptor'],
+                                _recv_exactly(sock, header['size']))
+    doc.attributes = header['attributes']
+    return doc
+
+class SocketSink(Sink):
+    """
+    Sends documents over a connected stream socket. Each document is a
+    4 byte big endian header length, a json header with the descriptor,
+    attributes and data size, then the data. read_document decodes them.
+    """
+    def __init__(self, sock):
+        self.sock = sock
+
+    @classmethod
+    def connect(cls, host, port):
+        return cls(socket.create_connection((host, port)))
+
+    def put(self, document):
+        data = _as_bytes(document.data)
+        header = json.dumps(dict(
+            descriptor = document.descriptor,
+            attributes = document.attributes,
+            size = len(data)))
+        self.sock.sendall(struct.pack('!I', len(header)) + header + data)
+
+    def close(self):
+        self.sock.close()
+
+class BufferedSink(Sink):
+    """
+    Hands documents to another sink from a background thread so that a
+    slow consumer does not hold up rendering. At most maxsize documents
+    wait in the buffer. When it is full, put waits for room, or when
+    drop is set, discards the document and counts it in 'dropped'.
+    """
+    def __init__(self, sink, maxsize=8, drop=False):
+        self.sink = sink
+        self.drop = drop
+        self.dropped = 0
+        self.error = None
+        self.__queue = Queue.Queue(maxsize)
+        self.__thread = threading.Thread(target=self.__run)
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def __run(self):
+        while True:
+            document = self.__queue.get()
+            try:
+                if document is None:
+                    return
+                if self.error is None:
+                    self.sink.put(document)
+            except Exception, e:
+                self.error = e
+            finally:
+                self.__queue.task_done()
+
+    def put(self, document):
+        if self.error is not None:
+            raise self.error
+        if self.drop:
+            try:
+                self.__queue.put_nowait(document)
+            except Queue.Full:
+                self.dropped += 1
+        else:
+            self.__queue.put(document)
+
+    def flush(self):
+        self.__queue.join()
+        self.sink.flush()
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        self.__queue.put(None)
+        self.__thread.join()
+        self.sink.close()
@@ -0,0 +1,306 @@
+"""
+    Module defining a cinema store kept in a single SQLite database.
+"""
+
+import contextlib
+import json
+import os
+import os.path
+import sqlite3
+import threading
+
+import cinema_store
+
+def _column(name):
+    return '"p_%s"' % name.replace('"', '""')
+
+def _index(name):
+    return '"idx_%s"' % name.replace('"', '""')
+
+def _key(descriptor):
+    return json.dumps(sorted((k, str(v)) for k, v in descriptor.items()))
+
+class SQLiteStore(cinema_store.Store):
+    """
+    Implementation of a store based on an SQLite database. The parameter
+    list and metadata live in an 'info' table, and each document is a row
+    of a 'documents' table with one indexed column per parameter. Document
+    data is kept in the row, or when a filename_pattern is given, in files
+    next to the database as a FileStore would, with the row pointing to it.
+
+    The database is opened in write ahead logging mode, so any number of
+    readers, in other threads or processes, can query it while it is being
+    written. Each thread gets its own connection.
+
+    Besides direct values, find accepts lists of values and ranges, given
+    as a dict of comparisons:
+        store.find({'theta': [0, 30], 'phi': {'>=': 10, '<': 90}})
+
+    Each insert is committed on its own unless it happens in a batch:
+        with store.batch():
+            for doc in docs:
+                store.insert(doc)
+    A batch, schema changes made in it included, is committed as a whole
+    when it ends, or rolled back if it raises. Batches belong to the thread
+    that opens them, as connections do.
+    """
+
+    _OPERATORS = ['=', '<', '<=', '>', '>=', '!=']
+
+    def __init__(self, dbfilename=None):
+        super(SQLiteStore, self).__init__()
+        self.__dbfilename = dbfilename if dbfilename \
+                else os.path.join(os.getcwd(), "info.sqlite")
+        self.filename_pattern = None
+        self.image_type = None
+        self.__local = threading.local()
+
+    @property
+    def dbfilename(self):
+        return self.__dbfilename
+
+    def __connection(self):
+        conn = getattr(self.__local, 'conn', None)
+        if conn is None:
+            #transactions are begun and ended explicitly, see batch, as the
+            #module's own handling commits whenever the schema changes
+            conn = sqlite3.connect(self.__dbfilename, timeout=60,
+                                   isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self.__local.conn = conn
+            self.__local.batch_depth = 0
+            #what to do to the store's state if the batch is rolled back
+            self.__local.undo = []
+        return conn
+
+    def __ensure_schema(self):
+        conn = self.__connection()
+        conn.execute("CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT)")
+        conn.execute("CREATE TABLE IF NOT EXISTS documents ("
+                     "id INTEGER PRIMARY KEY, key TEXT UNIQUE, "
+                     "attributes TEXT, data BLOB, path TEXT)")
+        columns = set(row[1] for row in conn.execute("PRAGMA table_info(documents)"))
+        for name in self.parameter_list:
+            if not 'p_' + name in columns:
+                #numeric affinity so that '10' and 10 compare equal
+                conn.execute("ALTER TABLE documents ADD COLUMN %s NUMERIC" % _column(name))
+                conn.execute("CREATE INDEX IF NOT EXISTS %s ON documents(%s)" %
+                             (_index(name), _column(name)))
+
+    @contextlib.contextmanager
+    def batch(self):
+        """ groups the writes this thread makes within it into one transaction """
+        conn = self.__connection()
+        if self.__local.batch_depth == 0:
+            conn.execute("BEGIN")
+        self.__local.batch_depth += 1
+        done = False
+        try:
+            yield
+            done = True
+        finally:
+            self.__local.batch_depth -= 1
+            if self.__local.batch_depth == 0:
+                undo, self.__local.undo = self.__local.undo, []
+                committed = False
+                try:
+                    conn.execute("COMMIT" if done else "ROLLBACK")
+                    committed = done
+                finally:
+                    if not committed:
+                        for action in reversed(undo):
+                            action()
+
+    def load(self):
+        """loads an existing store"""
+        super(SQLiteStore, self).load()
+        if not os.path.exists(self.__dbfilename):
+            raise IOError("No such store %s" % self.__dbfilename)
+        info = dict((k, json.loads(v)) for k, v in
+                    self.__connection().execute("SELECT key, value FROM info"))
+        self._set_parameter_list(info['arguments'])
+        self.metadata = info['metadata']
+        self.filename_pattern = info.get('name_pattern')
+        self.image_type = info.get('image_type')
+
+    def save(self):
+        """ writes out the parameter list and metadata """
+        dirname = os.path.dirname(os.path.abspath(self.__dbfilename))
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        info = dict(
+                arguments = self.parameter_list,
+                name_pattern = self.filename_pattern,
+                image_type = self.image_type,
+                metadata = self.metadata
+                )
+        with self.batch():
+            self.__ensure_schema()
+            self.__connection().executemany(
+                "INSERT OR REPLACE INTO info (key, value) VALUES (?, ?)",
+                [(k, json.dumps(v)) for k, v in info.items()])
+        self.invalidate_find_cache()
+
+    def create(self):
+        """creates a new store"""
+        super(SQLiteStore, self).create()
+        self.save()
+
+    def add_parameter(self, name, properties):
+        """
+        Adds a parameter, and its column if the database exists. Within a
+        batch the parameter is visible at once, but forgotten again if the
+        batch is rolled back, as its column is.
+        """
+        if not os.path.exists(self.__dbfilename):
+            super(SQLiteStore, self).add_parameter(name, properties)
+            return
+        with self.batch():
+            previous = self.parameter_list.get(name)
+            super(SQLiteStore, self).add_parameter(name, properties)
+            self.__local.undo.append(lambda: self.__restore_parameter(name, previous))
+            self.__ensure_schema()
+
+    def __restore_parameter(self, name, properties):
+        if properties is None:
+            del self.parameter_list[name]
+        else:
+            self.parameter_list[name] = properties
+        self.invalidate_find_cache()
+
+    def get_image_type(self):
+        if self.filename_pattern:
+            return self.filename_pattern[self.filename_pattern.rfind("."):]
+        return self.image_type
+
+    def get_filename(self, document):
+        """ where the document's data goes when kept outside the database """
+        desc = self.get_complete_descriptor(document.descriptor)
+        dirname = os.path.dirname(os.path.abspath(self.__dbfilename))
+        return os.path.join(dirname, self.filename_pattern.format(**desc))
+
+    def insert(self, document):
+        super(SQLiteStore, self).insert(document)
+        desc = self.get_complete_descriptor(document.descriptor)
+        names = [n for n in self.parameter_list if n in desc]
+
+        data = None
+        path = None
+        if document.data is not None:
+            if self.filename_pattern:
+                fname = self.get_filename(document)
+                dirname = os.path.dirname(fname)
+                if not os.path.exists(dirname):
+                    os.makedirs(dirname)
+                with open(fname, mode='wb') as file:
+                    file.write(document.data)
+                path = os.path.relpath(fname, os.path.dirname(
+                    os.path.abspath(self.__dbfilename)))
+            else:
+                data = sqlite3.Binary(document.data)
+        attributes = json.dumps(document.attributes) \
+                if document.attributes is not None else None
+
+        sql = "INSERT OR REPLACE INTO documents (key, attributes, data, path%s) " \
+              "VALUES (?, ?, ?, ?%s)" % (
+                  "".join(", " + _column(n) for n in names),
+                  ", ?" * len(names))
+        self.__connection().execute(
+            sql, [_key(dict((n, desc[n]) for n in names)), attributes, data, path] +
+                 [desc[n] for n in names])
+        self.invalidate_find_cache()
+
+    def __where(self, q):
+        clauses = []
+        args = []
+        for name, value in (q if q else {}).items():
+            if not name in self.parameter_list:
+                continue
+            col = _column(name)
+            if isinstance(value, dict):
+                for op, bound in value.items():
+                    if not op in self._OPERATORS:
+                        raise RuntimeError("Invalid comparison %s, must be one of %s" %
+                                           (op, str(self._OPERATORS)))
+                    clauses.append("%s %s ?" % (col, op))
+                    args.append(bound)
+            elif isinstance(value, (list, tuple)):
+                clauses.append("%s IN (%s)" % (col, ", ".join("?" * len(value))))
+                args.extend(value)
+            else:
+                clauses.append("%s = ?" % col)
+                args.append(value)
+        where = " WHERE " + " AND ".join(clauses) if clauses else ""
+        return where, args
+
+    def find(self, q=None):
+        """
+        Yields the documents matching the query, in insertion order.
+        """
+        names = list(self.parameter_list)
+        where, args = self.__where(q)
+        sql = "SELECT attributes, data, path%s FROM documents%s ORDER BY id" % (
+            "".join(", " + _column(n) for n in names), where)
+        dirname = os.path.dirname(os.path.abspath(self.__dbfilename))
+        for row in self.__connection().execute(sql, args):
+            attributes, data, path = row[:3]
+            descriptor = dict((n, v) for n, v in zip(names, row[3:]) if v is not None)
+            if path is not None:
+                with open(os.path.join(dirname, path), mode='rb') as file:
+                    data = file.read()
+            elif data is not None:
+                data = str(data)
+            doc = cinema_store.Document(descriptor, data)
+            doc.attributes = json.loads(attributes) if attributes else None
+            yield doc
+
+    def count(self, q=None):
+        """ the number of documents matching the query """
+        where, args = self.__where(q)
+        return self.__connection().execute(
+            "SELECT COUNT(*) FROM documents" + where, args).fetchone()[0]
+
+    def close(self):
+        """ closes this thread's connection """
+        conn = getattr(self.__local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self.__local.conn = None
+
+def _copy_definitions(src, dest):
+    for name, properties in src.parameter_list.items():
+        dest.add_parameter(name, json.loads(json.dumps(properties)))
+    dest.metadata = json.loads(json.dumps(src.metadata)) if src.metadata else None
+
+def from_file_store(fs, dbfilename, external=False):
+    """
+    Copies a loaded FileStore into a new SQLiteStore. The documents' data
+    goes into the database, or with external, into files next to it laid
+    out with the same filename_pattern.
+    """
+    store = SQLiteStore(dbfilename)
+    _copy_definitions(fs, store)
+    store.image_type = fs.get_image_type()
+    if external:
+        store.filename_pattern = fs.filename_pattern
+    store.create()
+    with store.batch():
+        for doc in fs.find():
+            store.insert(doc)
+    return store
+
+def to_file_store(store, dbfilename, filename_pattern=None):
+    """
+    Copies an SQLiteStore into a new FileStore, which uses the given
+    filename_pattern or else the store's own.
+    """
+    fs = cinema_store.FileStore(dbfilename)
+    fs.filename_pattern = filename_pattern if filename_pattern \
+            else store.filename_pattern
+    if not fs.filename_pattern:
+        raise RuntimeError("A filename_pattern is needed to make a FileStore")
+    _copy_definitions(store, fs)
+    fs.create()
+    for doc in store.find():
+        fs.insert(doc)
+    return fs
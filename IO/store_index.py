@@ -0,0 +1,113 @@
+"""
+    Module for indexing a file store's documents in the background, so that
+    an application can start using the store right away, and for following
+    the documents added to it afterwards.
+"""
+
+import json
+import os.path
+import threading
+
+import cinema_store
+
+class StoreIndex(object):
+    """
+    The set of a FileStore's document files, gathered by a background
+    thread. Until it is complete, lookups resolve the document's file name
+    from its descriptor and check the file system directly. Once ready,
+    documents that don't exist are known without touching the disk.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.count = 0
+        self.ready = False
+        self.__files = set()
+        self.__lock = threading.Lock()
+        self.__thread = None
+        #documents logged from now on are picked up by poll, older ones
+        #by the walk
+        self.__log_offsets = dict((log, os.path.getsize(log))
+                                  for log in store.insert_log_filenames())
+        names = [n for n in store.parameter_list
+                 if '{%s}' % n in store.filename_pattern]
+        self.expected = reduce(lambda a, n: a * len(store.get_parameter(n)['values']),
+                               names, 1)
+
+    def start(self):
+        """ starts indexing in a background thread """
+        self.__thread = threading.Thread(target=self.__build)
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def join(self, timeout=None):
+        if self.__thread:
+            self.__thread.join(timeout)
+
+    def __add(self, doc_file):
+        with self.__lock:
+            if doc_file in self.__files:
+                return False
+            self.__files.add(doc_file)
+            self.count += 1
+            return True
+
+    def __build(self):
+        for doc_file in self.store.find_files():
+            self.__add(doc_file)
+        self.ready = True
+
+    def poll(self):
+        """
+        Adds the documents that the store's insert logs record since the
+        last poll, which costs the same however large the store is. Returns
+        the descriptors of the documents that are new to the index.
+        """
+        dirname = os.path.dirname(self.store.dbfilename)
+        added = []
+        for log in self.store.insert_log_filenames():
+            offset = self.__log_offsets.get(log, 0)
+            with open(log, "rb") as file:
+                file.seek(offset)
+                text = file.read()
+            #leave a line that is still being written for the next poll
+            text = text[:text.rfind("\n") + 1]
+            self.__log_offsets[log] = offset + len(text)
+            for line in text.splitlines():
+                entry = json.loads(line)
+                if self.__add(os.path.join(dirname, entry['file'])):
+                    added.append(entry['descriptor'])
+        return added
+
+    def progress(self):
+        """ fraction, between 0 and 1, of the expected documents indexed """
+        if self.ready:
+            return 1.0
+        return min(1.0, float(self.count) / self.expected) if self.expected else 0.0
+
+    def __contains__(self, doc_file):
+        return doc_file in self.__files
+
+    def __remove(self, doc_file):
+        with self.__lock:
+            if doc_file in self.__files:
+                self.__files.remove(doc_file)
+                self.count -= 1
+
+    def get(self, descriptor):
+        """
+        Reads the document for a (possibly partial, defaults fill in the
+        rest) descriptor, or returns None if there is none. A document
+        whose file has gone since it was indexed is dropped from the index.
+        """
+        fname = self.store.get_filename(cinema_store.Document(descriptor))
+        if self.ready:
+            if not fname in self.__files:
+                return None
+        elif not os.path.exists(fname):
+            return None
+        try:
+            return self.store.load_image(fname)
+        except (IOError, OSError):
+            self.__remove(fname)
+            return None
@@ -0,0 +1,187 @@
+"""
+    Reports on the size of a file store's documents and how they are used,
+    to help decide which parameters are worth compressing, deduplicating or
+    pruning.
+
+    usage: python store_stats.py path/to/info.json [--access-log FILE] ...
+
+    Access logs are text files with one accessed document per line, given
+    either as a json descriptor ({"phi": 10, "theta": 20}) or as a file name
+    relative to the store. When no log is given, the access.log that a
+    FileStore with log_accesses set writes next to info.json is read.
+"""
+
+import json
+import os.path
+import sys
+from multiprocessing.pool import ThreadPool
+
+import cinema_store
+
+def stat_documents(store, q=None, workers=8):
+    """
+    Returns a list of (descriptor, file name, size in bytes) for the
+    documents matching the query. The files are stat'ed in parallel.
+    """
+    files = list(store.find_files(q))
+    pool = ThreadPool(workers)
+    try:
+        sizes = pool.map(os.path.getsize, files)
+    finally:
+        pool.close()
+        pool.join()
+    return [(store.get_descriptor(f), f, size) for f, size in zip(files, sizes)]
+
+def _summary(sizes):
+    n = len(sizes)
+    total = sum(sizes)
+    return dict(count = n, bytes = total,
+                min = min(sizes) if n else 0,
+                max = max(sizes) if n else 0,
+                mean = float(total) / n if n else 0.0)
+
+def size_report(store, q=None, workers=8, top=10):
+    """
+    Summarizes document sizes overall, per parameter value, and ranks the
+    parameters by the share of the size variance their values explain.
+    """
+    docs = stat_documents(store, q, workers)
+    sizes = [size for desc, f, size in docs]
+    overall = _summary(sizes)
+    mean = overall['mean']
+    variance = sum((s - mean) ** 2 for s in sizes)
+
+    per_value = {}
+    drivers = {}
+    names = set()
+    for desc, f, size in docs:
+        names.update(desc.keys())
+    for name in names:
+        groups = {}
+        for desc, f, size in docs:
+            groups.setdefault(desc.get(name), []).append(size)
+        per_value[name] = dict((value, _summary(group))
+                               for value, group in groups.items())
+        #between group sum of squares over the total, eta squared
+        between = sum(len(group) * (float(sum(group)) / len(group) - mean) ** 2
+                      for group in groups.values())
+        drivers[name] = between / variance if variance else 0.0
+
+    ranked = sorted(docs, key=lambda d: d[2])
+    as_list = lambda entries: [dict(descriptor = desc, file = f, bytes = size)
+                               for desc, f, size in entries]
+    return dict(
+        overall = overall,
+        per_value = per_value,
+        drivers = sorted(drivers.items(), key=lambda kv: -kv[1]),
+        largest = as_list(reversed(ranked[-top:])),
+        smallest = as_list(ranked[:top]))
+
+def _read_access_log(store, log):
+    root = os.path.dirname(store.dbfilename)
+    with open(log, "r") as file:
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('{'):
+                desc = json.loads(line)
+                yield dict((k, str(v)) for k, v in desc.items())
+            else:
+                yield store.get_descriptor(os.path.join(root, line))
+
+def access_report(store, logs, top=10):
+    """
+    Counts accesses per parameter value and finds the most requested
+    documents in a set of access logs.
+    """
+    per_value = {}
+    per_doc = {}
+    total = 0
+    for log in logs:
+        for desc in _read_access_log(store, log):
+            total += 1
+            for name, value in desc.items():
+                counts = per_value.setdefault(name, {})
+                counts[value] = counts.get(value, 0) + 1
+            key = tuple(sorted(desc.items()))
+            per_doc[key] = per_doc.get(key, 0) + 1
+    hottest = sorted(per_doc.items(), key=lambda kv: -kv[1])[:top]
+    return dict(
+        accesses = total,
+        per_value = per_value,
+        hottest = [dict(descriptor = dict(k), count = c) for k, c in hottest])
+
+def _format_bytes(n):
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if abs(n) < 1024.0:
+            return "%.1f %s" % (n, unit)
+        n /= 1024.0
+    return "%.1f TB" % n
+
+def print_report(sizes, accesses=None, out=sys.stdout):
+    o = sizes['overall']
+    out.write("%d documents, %s (mean %s, min %s, max %s)\n" % (
+        o['count'], _format_bytes(o['bytes']), _format_bytes(o['mean']),
+        _format_bytes(o['min']), _format_bytes(o['max'])))
+
+    out.write("\nshare of size variance explained by each parameter\n")
+    for name, share in sizes['drivers']:
+        out.write("  %-20s %5.1f%%\n" % (name, share * 100))
+
+    for name in sorted(sizes['per_value']):
+        out.write("\n%s\n" % name)
+        for value, s in sorted(sizes['per_value'][name].items()):
+            out.write("  %-20s %6d files %12s  mean %10s  min %10s  max %10s\n" % (
+                value, s['count'], _format_bytes(s['bytes']),
+                _format_bytes(s['mean']), _format_bytes(s['min']),
+                _format_bytes(s['max'])))
+
+    for title in ['largest', 'smallest']:
+        out.write("\n%s documents\n" % title)
+        for d in sizes[title]:
+            out.write("  %12s  %s\n" % (_format_bytes(d['bytes']), d['file']))
+
+    if accesses:
+        out.write("\n%d accesses\n" % accesses['accesses'])
+        for name in sorted(accesses['per_value']):
+            counts = accesses['per_value'][name]
+            out.write("  %s: %s\n" % (name, ", ".join(
+                "%s=%d" % kv for kv in sorted(counts.items(), key=lambda kv: -kv[1]))))
+        out.write("\nmost accessed documents\n")
+        for d in accesses['hottest']:
+            out.write("  %6d  %s\n" % (d['count'], d['descriptor']))
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description=
+        "Report document sizes and access hotspots of a cinema file store.")
+    parser.add_argument("store", help="the store's info.json")
+    parser.add_argument("--query", default=None,
+                        help="json query restricting the documents considered")
+    parser.add_argument("--access-log", action="append", default=[],
+                        help="access log to analyze, may be repeated")
+    parser.add_argument("--top", type=int, default=10,
+                        help="number of largest/smallest/hottest documents to list")
+    parser.add_argument("--workers", type=int, default=8,
+                        help="number of parallel stat calls")
+    parser.add_argument("--json", action="store_true",
+                        help="print the report as json")
+    args = parser.parse_args(argv)
+
+    store = cinema_store.FileStore(args.store)
+    store.load()
+    q = json.loads(args.query) if args.query else None
+    sizes = size_report(store, q, args.workers, args.top)
+    logs = args.access_log if args.access_log else \
+            [store.access_log_filename]
+    logs = [l for l in logs if os.path.exists(l)]
+    accesses = access_report(store, logs, args.top) if logs else None
+    if args.json:
+        json.dump(dict(sizes = sizes, accesses = accesses), sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    else:
+        print_report(sizes, accesses)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""
+    Brings a copy of a file store up to date with the original, moving only
+    the documents that the copy lacks or that have changed since.
+
+    usage: python store_sync.py src/info.json dest/info.json [--checksum] ...
+
+    Documents are compared by size and modification time, or with
+    --checksum by the md5 of their contents. They are copied by a pool of
+    threads, each under a temporary name that is renamed once complete, so
+    an interrupted sync leaves no partial documents behind and picks up
+    where it stopped when run again. Parameter values found in the source
+    but not the copy, such as newly appended time steps, are merged into
+    the copy's parameter_list.
+"""
+
+import copy
+import hashlib
+import os
+import os.path
+import shutil
+from multiprocessing.pool import ThreadPool
+
+import cinema_store
+from cached_store import _MTIME_RESOLUTION
+
+def _checksum(doc_file):
+    md5 = hashlib.md5()
+    with open(doc_file, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), ""):
+            md5.update(block)
+    return md5.hexdigest()
+
+def _same(a, b, checksum):
+    """ whether document files a and b hold the same document """
+    if checksum:
+        return _checksum(a) == _checksum(b)
+    sa = os.stat(a)
+    sb = os.stat(b)
+    #a rewrite within the same second must not look unchanged
+    return (sa.st_size == sb.st_size and
+            abs(sa.st_mtime - sb.st_mtime) < _MTIME_RESOLUTION)
+
+def _documents(store, q=None):
+    """ the store's document files that match q, keyed by relative path """
+    dirname = os.path.dirname(store.dbfilename)
+    return dict((os.path.relpath(f, dirname), f) for f in store.find_files(q))
+
+def diff(src, dest, checksum=False, q=None):
+    """
+    Compares the documents of two loaded FileStores that match q. Returns a
+    dict of lists of paths, relative to the stores' directories, of the
+    documents 'missing' from dest, 'changed' in src since they were copied,
+    'unchanged' since then and 'extra' in dest.
+    """
+    if src.filename_pattern != dest.filename_pattern:
+        raise RuntimeError("Stores lay out documents differently, %s and %s" %
+                           (src.filename_pattern, dest.filename_pattern))
+    theirs = _documents(src, q)
+    ours = _documents(dest, q)
+    result = dict(missing = [], changed = [], unchanged = [], extra = [])
+    for path in sorted(theirs):
+        if not path in ours:
+            result['missing'].append(path)
+        elif not _same(theirs[path], ours[path], checksum):
+            result['changed'].append(path)
+        else:
+            result['unchanged'].append(path)
+    result['extra'] = sorted(p for p in ours if not p in theirs)
+    return result
+
+def merge_parameters(src, dest):
+    """
+    Adds the parameters, parameter values and metadata entries of src that
+    dest lacks to dest. Returns True if dest changed.
+    """
+    changed = False
+    for name, properties in src.parameter_list.items():
+        if not name in dest.parameter_list:
+            dest.add_parameter(name, copy.deepcopy(properties))
+            changed = True
+            continue
+        values = dest.get_parameter(name)['values']
+        new = [v for v in properties['values'] if not v in values]
+        if new:
+            values.extend(new)
+            if dest.get_parameter(name)['type'] == 'range':
+                values.sort()
+            changed = True
+    if src.metadata:
+        if dest.metadata is None:
+            dest.metadata = {}
+        for key, value in src.metadata.items():
+            if not key in dest.metadata:
+                dest.metadata[key] = copy.deepcopy(value)
+                changed = True
+    if changed:
+        dest.invalidate_find_cache()
+    return changed
+
+def _copy_file(task):
+    """ copies one document, returns the number of bytes copied """
+    src, dest = task
+    cinema_store._makedirs(os.path.dirname(dest))
+    tmp = cinema_store._temporary_name(dest)
+    #copy2 keeps the modification time, which the next diff compares
+    shutil.copy2(src, tmp)
+    os.rename(tmp, dest)
+    return os.path.getsize(dest)
+
+def sync(src, dest_fname, checksum=False, workers=8, q=None, delete=False):
+    """
+    Updates the store at dest_fname, creating it if needed, with the
+    documents of src (a loaded FileStore) that match q. Returns a dict
+    with the number of documents copied, left unchanged and deleted, and
+    the bytes copied.
+
+    :param checksum: compare contents rather than sizes and times.
+
+    :param workers: threads copying documents.
+
+    :param delete: remove documents that are in dest but not in src.
+    """
+    dest = cinema_store.FileStore(dest_fname)
+    if os.path.exists(dest_fname):
+        dest.load()
+    else:
+        dest.filename_pattern = src.filename_pattern
+    merge_parameters(src, dest)
+
+    changes = diff(src, dest, checksum, q)
+    src_dir = os.path.dirname(src.dbfilename)
+    dest_dir = os.path.dirname(dest.dbfilename)
+    tasks = [(os.path.join(src_dir, p), os.path.join(dest_dir, p))
+             for p in changes['missing'] + changes['changed']]
+    stats = dict(copied = 0, bytes = 0, deleted = 0,
+                 unchanged = len(changes['unchanged']))
+
+    pool = ThreadPool(workers)
+    try:
+        for copied in pool.imap_unordered(_copy_file, tasks):
+            stats['copied'] += 1
+            stats['bytes'] += copied
+    finally:
+        pool.close()
+        pool.join()
+
+    if delete:
+        for path in changes['extra']:
+            os.remove(os.path.join(dest_dir, path))
+            stats['deleted'] += 1
+    #only now that the documents are in place does the copy list them
+    dest.save()
+    return stats
+
+def main(argv=None):
+    import argparse
+    import json
+    parser = argparse.ArgumentParser(description=
+        "Copy the new and changed documents of a cinema file store into another.")
+    parser.add_argument("src", help="the source store's info.json")
+    parser.add_argument("dest", help="the copy's info.json")
+    parser.add_argument("--checksum", action="store_true",
+                        help="compare contents instead of sizes and times")
+    parser.add_argument("--workers", type=int, default=8,
+                        help="number of copying threads")
+    parser.add_argument("--query", default=None,
+                        help="json query restricting the documents synced")
+    parser.add_argument("--delete", action="store_true",
+                        help="remove documents the source doesn't have")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="only list the differences")
+    args = parser.parse_args(argv)
+
+    src = cinema_store.FileStore(args.src)
+    src.load()
+    q = json.loads(args.query) if args.query else None
+    if args.dry_run:
+        dest = cinema_store.FileStore(args.dest)
+        dest.load()
+        changes = diff(src, dest, args.checksum, q)
+        for kind in ['missing', 'changed', 'extra']:
+            for path in changes[kind]:
+                print kind, path
+        return
+    stats = sync(src, args.dest, args.checksum, args.workers, q, args.delete)
+    print "copied %(copied)d documents (%(bytes)d bytes), " \
+          "%(unchanged)d unchanged, %(deleted)d deleted" % stats
+
+if __name__ == "__main__":
+    main()
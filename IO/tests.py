@@ -27,6 +27,14 @@ def demonstrate_manual_populate(fname="/tmp/demonstrate_manual_populate/info.jso
 
     cs.save()
 
+def _fresh_manual_populate(fname):
+    """demonstrate_manual_populate into an empty directory"""
+    import os
+    import shutil
+    if os.path.exists(os.path.dirname(fname)):
+        shutil.rmtree(os.path.dirname(fname))
+    demonstrate_manual_populate(fname)
+
 def demonstrate_populate(fname="/tmp/demonstrate_populate/info.json"):
     """Demonstrates how to setup a basic cinema store filling the data up with text"""
     import explorers
@@ -158,6 +166,1330 @@ def test_store():
     doc = Document({"phi": 10}, "Hello World")
     fs.insert(doc)
 
+def test_camera_paths():
+    import math
+    import camera_paths
+
+    cs = FileStore()
+    cs.filename_pattern = "{phi}/{theta}/data.raw"
+    cs.add_parameter("phi", make_parameter('phi', [0, 90, 180, 270]))
+    cs.add_parameter("theta", make_parameter('theta', [-45, 0, 45]))
+
+    path = camera_paths.SphericalPath([1, 2, 3], 10.0)
+    path.prepare(cs)
+    assert len(path.positions) == 12
+
+    #every precomputed pose must match the direct computation
+    for phi in [0, 90, 180, 270]:
+        for theta in [-45, 0, 45]:
+            pos, focal, up = path.get_pose({'phi': phi, 'theta': theta})
+            p = math.radians(phi)
+            t = math.radians(theta)
+            expected = [1 - math.cos(p) * 10.0 * math.cos(t),
+                        2 + math.sin(p) * 10.0 * math.cos(t),
+                        3 + math.sin(t) * 10.0]
+            assert max(abs(a - b) for a, b in zip(pos, expected)) < 1e-9
+            assert focal == [1, 2, 3]
+            assert abs(sum(u * u for u in up) - 1.0) < 1e-9
+
+    #values outside of the store are computed on demand
+    pos, focal, up = path.get_pose({'phi': 45, 'theta': 0})
+    assert abs(pos[2] - 3) < 1e-9
+
+    md = path.get_metadata()
+    assert md['wrap'] == ['phi']
+    assert len(md['view_ups']) == 12
+
+    thetas, phis = camera_paths.obtain_angles([90, 45])
+    assert thetas == [-45, -45, -45, -45, 0, 0, 0, 0, 45, 45, 45, 45]
+    assert phis == [0, 90, 180, 270] * 3
+
+def test_layered_composite(fname="/tmp/layered_composite/info.json"):
+    import numpy
+    import explorers
+    import compositing
+
+    cs = FileStore(fname)
+    cs.filename_pattern = "{phi}/{layer}/{offset}_{contour}.npz"
+    cs.add_parameter("phi", make_parameter('phi', [0, 90]))
+    cs.add_parameter("offset", make_parameter('offset', [1, 2, 3]))
+    cs.add_parameter("contour", make_parameter('contour', [4, 5]))
+
+    class Draw(explorers.Track):
+        """ fills a fake framebuffer with a square at a given depth """
+        def __init__(self, parameter, depth, rows):
+            super(Draw, self).__init__()
+            self.parameter = parameter
+            self.depth = depth
+            self.rows = rows
+
+        def prepare(self, explorer):
+            #as the pv and vtk slice and contour tracks do
+            explorer.cinema_store.add_metadata({'type': 'parametric-image-stack'})
+
+        def execute(self, doc):
+            rgb = numpy.zeros((4, 4, 3), dtype=numpy.uint8)
+            depth = numpy.ones((4, 4), dtype=numpy.float32)
+            rgb[self.rows] = doc.descriptor[self.parameter]
+            depth[self.rows] = self.depth
+            doc.data = compositing.encode_layer(rgb, depth)
+
+    layers = [explorers.Layer('slice', ['offset'], [Draw('offset', 0.5, slice(0, 3))]),
+              explorers.Layer('contour', ['contour'], [Draw('contour', 0.2, slice(2, 4))])]
+    e = explorers.LayeredExplorer(cs, ['phi'], [], layers)
+    e.explore()
+
+    #additive rather than multiplicative: 2 * (3 + 2) documents
+    assert cs.parameter_list['layer']['values'] == ['slice', 'contour']
+    assert len(list(cs.find())) == 10
+    assert cs.metadata['type'] == 'composite-image-stack'
+
+    #streaming makes the same passes
+    assert len(list(e.stream())) == 10
+
+    img = compositing.find_composite(cs, {'phi': 90},
+                                     {'slice': {'offset': 2}, 'contour': {'contour': 5}})
+    assert (img[0:2] == 2).all()
+    assert (img[2:4] == 5).all()
+
+    img = compositing.find_composite(cs, {'phi': 0}, {'slice': {'offset': 3}},
+                                     background=[9, 9, 9])
+    assert (img[0:3] == 3).all()
+    assert (img[3] == 9).all()
+
+def test_recoloring(fname="/tmp/recoloring/info.json"):
+    import numpy
+    import recoloring
+
+    #values survive being rendered through the encoding color map
+    vrange = [-10.0, 30.0]
+    values = numpy.linspace(-10.0, 29.9, 500).reshape(20, 25)
+    encoder = recoloring.LookupTable(recoloring.value_encoding_points(vrange))
+    rgb = numpy.round(encoder.map(values) * 255).astype(numpy.uint8)
+    decoded = recoloring.decode_values(rgb, vrange)
+    assert numpy.abs(decoded - values).max() < (vrange[1] - vrange[0]) / 256.0 / 128.0
+
+    cs = FileStore(fname)
+    cs.filename_pattern = "{phi}.npz"
+    cs.add_parameter("phi", make_parameter('phi', [0, 1]))
+    recoloring.set_value_images(cs, 'RTData', vrange)
+    recoloring.add_color(cs, 'white', {'type': 'rgb', 'content': [1, 1, 1]})
+    #a store that is explored again keeps its colors
+    recoloring.set_value_images(cs, 'RTData', vrange)
+    assert cs.metadata['value_images']['colors'].keys() == ['white']
+
+    luminance = numpy.ones((20, 25)) * 0.5
+    values[0, 0] = numpy.nan
+    for phi in [0, 1]:
+        cs.insert(Document({'phi': phi},
+                           recoloring.encode_value_image(values, luminance)))
+
+    #a color map added after the fact needs no re-render
+    recoloring.add_color(cs, 'ramp', {'type': 'lut',
+                                      'content': [-10, 0, 0, 0, 30, 1, 0, 0]})
+    assert cs.get_parameter('color')['values'] == ['white', 'ramp']
+
+    docs = list(recoloring.find_recolored(cs, {'phi': 1}))
+    assert len(docs) == 1
+    assert docs[0].descriptor['color'] == 'white'
+    assert (docs[0].data[0, 0] == 0).all()
+    assert (docs[0].data[1:] == 127).all()
+
+    img = recoloring.find_recolored(cs, {'phi': 0, 'color': 'ramp'}).next().data
+    assert img[-1, -1, 0] == 127 and img[0, 1, 0] == 0
+    assert (img[..., 1:] == 0).all()
+
+def test_streaming(fname="/tmp/streaming/info.json"):
+    import os
+    import shutil
+    import socket
+    import explorers
+    import sinks
+
+    if os.path.exists(os.path.dirname(fname)):
+        shutil.rmtree(os.path.dirname(fname))
+
+    cs = FileStore(fname)
+    cs.filename_pattern = "{theta}/{phi}"
+    cs.add_parameter("theta", make_parameter('theta', [0,10,20]))
+    cs.add_parameter("phi", make_parameter('phi', [0,10]))
+
+    class Track(explorers.Track):
+        def execute(self, doc):
+            doc.data = str(doc.descriptor)
+
+    seen = []
+    sender, receiver = socket.socketpair()
+    e = explorers.Explorer(cs, ['theta', 'phi'], [Track()])
+    e.write_to_store = False
+    e.add_sink(sinks.BufferedSink(sinks.CallbackSink(seen.append), maxsize=2))
+    e.add_sink(sinks.SocketSink(sender))
+
+    streamed = [doc.descriptor for doc in e.stream()]
+    assert len(streamed) == 6
+    #finish flushed the buffered sink
+    assert [doc.descriptor for doc in seen] == streamed
+    for desc in streamed:
+        doc = sinks.read_document(receiver)
+        assert doc.descriptor == desc
+        assert doc.data == str(desc)
+    #nothing was written to disk
+    assert not os.path.exists(os.path.dirname(fname))
+
+    for sink in e.sinks:
+        sink.close()
+    receiver.close()
+
+def test_async_store(fname="/tmp/demonstrate_manual_populate/info.json"):
+    import threading
+    import async_store
+
+    _fresh_manual_populate(fname)
+    cs = FileStore(fname)
+    cs.load()
+
+    key = lambda doc: sorted(doc.descriptor.items())
+    reader = async_store.AsyncStore(cs, workers=2, max_in_flight=3)
+
+    done = threading.Event()
+    pending = [reader.find({'theta': t}) for t in [0, 10, 20, 30, 40]]
+    last = reader.find({'phi': 10}, callback=lambda docs: done.set())
+    for t, result in zip([0, 10, 20, 30, 40], pending):
+        expected = sorted(cs.find({'theta': t}), key=key)
+        found = sorted(result.get(), key=key)
+        assert [d.descriptor for d in found] == [d.descriptor for d in expected]
+        assert [d.data for d in found] == [d.data for d in expected]
+    assert len(last.get()) == 5
+    assert done.wait(5)
+
+    doc = reader.get({'theta': 20, 'phi': 10}).get()
+    assert doc.data == str({'theta': 20, 'phi': 10})
+    assert reader.get({'theta': 25, 'phi': 10}).get() is None
+
+    streamed = [d.descriptor for d in reader.iterate({'phi': 20}, prefetch=2)]
+    assert streamed == [d.descriptor for d in cs.find({'phi': 20})]
+    reader.close()
+
+    #reads beyond max_in_flight are queued rather than waited for
+    gate = threading.Event()
+    class Slow(object):
+        def get(self, descriptor):
+            gate.wait(5)
+            return cs.get(descriptor)
+    reader = async_store.AsyncStore(Slow(), workers=1, max_in_flight=1)
+    pending = [reader.get({'theta': t, 'phi': 10}) for t in [0, 10, 20]]
+    assert not any(result.ready() for result in pending)
+    gate.set()
+    assert [result.get().data for result in pending] == \
+        [str({'theta': t, 'phi': 10}) for t in [0, 10, 20]]
+    reader.close()
+
+def test_store_stats(fname="/tmp/store_stats/info.json"):
+    import json
+    import os
+    import shutil
+    import store_stats
+
+    if os.path.exists(os.path.dirname(fname)):
+        shutil.rmtree(os.path.dirname(fname))
+
+    cs = FileStore(fname)
+    cs.filename_pattern = "{theta}/{phi}.txt"
+    cs.add_parameter("theta", make_parameter('theta', [0,10,20]))
+    cs.add_parameter("phi", make_parameter('phi', [0,10]))
+    #size depends on theta alone
+    for t in [0,10,20]:
+        for p in [0,10]:
+            cs.insert(Document({'theta': t, 'phi': p}, 'x' * (100 * (t + 1))))
+    cs.save()
+
+    report = store_stats.size_report(cs, top=2)
+    assert report['overall']['count'] == 6
+    assert report['overall']['bytes'] == 2 * (100 + 1100 + 2100)
+    assert report['per_value']['theta']['20']['bytes'] == 4200
+    assert report['per_value']['phi']['0']['count'] == 3
+    assert report['drivers'][0][0] == 'theta'
+    assert abs(report['drivers'][0][1] - 1.0) < 1e-9
+    assert report['drivers'][1] == ('phi', 0.0)
+    assert report['largest'][0]['bytes'] == 2100
+    assert report['smallest'][0]['bytes'] == 100
+
+    reader = FileStore(fname, log_accesses=True)
+    reader.load()
+    reader.get({'theta': 10, 'phi': 0})
+    reader.get({'theta': 20, 'phi': 10})
+    log = reader.access_log_filename
+    with open(log, "a") as file:
+        file.write(json.dumps({'theta': 10, 'phi': 0}) + "\n")
+    accesses = store_stats.access_report(cs, [log])
+    assert accesses['accesses'] == 3
+    assert accesses['per_value']['theta'] == {'10': 2, '20': 1}
+    assert accesses['hottest'][0] == {'descriptor': {'theta': '10', 'phi': '0'},
+                                      'count': 2}
+
+def test_transcode(fname="/tmp/transcode_src/info.json",
+                   dest="/tmp/transcode_dest/info.json",
+                   dest2="/tmp/transcode_dest2/info.json"):
+    import os
+    import shutil
+    import numpy
+    from StringIO import StringIO
+    import PIL.Image
+    import transcode
+
+    for d in [fname, dest, dest2]:
+        if os.path.exists(os.path.dirname(d)):
+            shutil.rmtree(os.path.dirname(d))
+
+    cs = FileStore(fname)
+    cs.filename_pattern = "{theta}/{phi}.png"
+    cs.add_parameter("theta", make_parameter('theta', [0,10]))
+    cs.add_parameter("phi", make_parameter('phi', [0,10,20]))
+    for t in [0,10]:
+        for p in [0,10,20]:
+            buf = StringIO()
+            PIL.Image.new('RGBA', (40, 20), (t, p, 0, 255)).save(buf, 'PNG')
+            cs.insert(Document({'theta': t, 'phi': p}, buf.getvalue()))
+    cs.save()
+    #a raw buffer has no encoding to convert
+    with open(cs.get_filename(Document({'theta': 10, 'phi': 0})), "wb") as f:
+        f.write('\0' * 64)
+
+    stats = transcode.transcode(cs, dest, format='jpg', quality=80,
+                                scale=0.5, workers=2)
+    assert stats['converted'] == 5 and stats['skipped'] == 0
+    assert stats['unsupported'] == 1
+
+    out = FileStore(dest)
+    out.load()
+    assert out.filename_pattern == "{theta}/{phi}.jpg"
+    assert out.metadata['transcoded']['format'] == 'jpg'
+    img = PIL.Image.open(out.get_filename(Document({'theta': 10, 'phi': 20})))
+    assert img.format == 'JPEG' and img.size == (20, 10)
+    assert not os.path.exists(out.get_filename(Document({'theta': 10, 'phi': 0})))
+    assert not [f for f in os.listdir(os.path.join(os.path.dirname(dest), '0'))
+                if f.startswith('.')]
+
+    #a second run only redoes what is missing
+    os.remove(out.get_filename(Document({'theta': 0, 'phi': 10})))
+    stats = transcode.transcode(cs, dest, format='jpg', quality=80,
+                                scale=0.5, workers=2)
+    assert stats['converted'] == 1 and stats['skipped'] == 4
+
+    #only the values with documents are listed
+    stats = transcode.transcode(cs, dest2, format='png', workers=2,
+                                q={'phi': 20})
+    assert stats['converted'] == 2
+    out = FileStore(dest2)
+    out.load()
+    assert out.get_parameter('phi')['values'] == [20]
+    assert out.get_parameter('phi')['default'] == 20
+    assert out.get_parameter('theta')['values'] == [0, 10]
+
+    #numpy archives are recompressed
+    for d in [fname, dest2]:
+        shutil.rmtree(os.path.dirname(d))
+    cs = FileStore(fname)
+    cs.filename_pattern = "{theta}.npz"
+    cs.add_parameter("theta", make_parameter('theta', [0,10]))
+    for t in [0,10]:
+        buf = StringIO()
+        numpy.savez(buf, values=numpy.zeros((64, 64), dtype=numpy.float32) + t)
+        cs.insert(Document({'theta': t}, buf.getvalue()))
+    cs.save()
+    stats = transcode.transcode(cs, dest2, format='npz', workers=2)
+    assert stats['converted'] == 2
+    assert stats['bytes'] < len(buf.getvalue())
+    out = FileStore(dest2)
+    out.load()
+    npz = numpy.load(StringIO(out.get({'theta': 10}).data))
+    assert (npz['values'] == 10).all()
+
+def test_cached_store(fname="/tmp/demonstrate_manual_populate/info.json",
+                      cache_dir="/tmp/cinema_cache"):
+    import os
+    import shutil
+    import cached_store
+
+    if os.path.exists(cache_dir):
+        shutil.rmtree(cache_dir)
+    _fresh_manual_populate(fname)
+
+    cs = cached_store.CachedFileStore(fname, cache_dir)
+    cs.load()
+    key = lambda doc: sorted(doc.descriptor.items())
+    first = [(d.descriptor, d.data) for d in cs.find({'theta': 10})]
+    assert cs.misses == 3 and cs.hits == 0
+    second = [(d.descriptor, d.data) for d in cs.find({'theta': 10})]
+    assert cs.hits == 3
+    assert first == second
+
+    #a new session finds the copies left by the previous one
+    cs = cached_store.CachedFileStore(fname, cache_dir)
+    cs.load()
+    assert cs.cached_bytes > 0
+    assert cs.warm({'phi': 0}) == 5
+    assert cs.misses == 4 and cs.hits == 1
+
+    #modified documents are read again
+    doc = Document({'theta': 10, 'phi': 0}, "changed")
+    with open(cs.get_filename(doc), "w") as file:
+        file.write(doc.data)
+    assert cs.get({'theta': 10, 'phi': 0}).data == "changed"
+    assert cs.misses == 5
+    #even within the same second and at the same size
+    with open(cs.get_filename(doc), "w") as file:
+        file.write("CHANGED")
+    assert cs.get({'theta': 10, 'phi': 0}).data == "CHANGED"
+    assert cs.misses == 6
+
+    #copies left half made are not taken for cached documents
+    cached = cached_store.CachedFileStore(fname, cache_dir).cached_bytes
+    with open(os.path.join(cs.cache_dir, ".0.0.1234.5.partial"), "w") as file:
+        file.write("half")
+    assert cached_store.CachedFileStore(fname, cache_dir).cached_bytes == cached
+
+    #the cache stays within its budget
+    small = cached_store.CachedFileStore(fname, cache_dir, max_bytes=100)
+    small.load()
+    list(small.find())
+    assert small.cached_bytes <= 100
+    small.clear_cache()
+
+def test_find_cache(fname="/tmp/demonstrate_manual_populate/info.json"):
+    _fresh_manual_populate(fname)
+    cs = FileStore(fname)
+    cs.load()
+    cs.enable_find_cache(max_entries=2)
+
+    first = [d.descriptor for d in cs.find({'theta': 10, 'phi': 0})]
+    again = [d.descriptor for d in cs.find({'phi': '0', 'theta': '10'})]
+    assert first == again and len(first) == 1
+    assert cs.find_cache_misses == 1 and cs.find_cache_hits == 1
+
+    #bounded
+    list(cs.find({'theta': 20}))
+    list(cs.find({'theta': 30}))
+    list(cs.find({'theta': 10, 'phi': 0}))
+    assert cs.find_cache_misses == 4
+
+    #inserting forgets what was found before
+    cs.add_parameter("phi", make_parameter('phi', [0,10,20,30]))
+    assert len(list(cs.find({'theta': 20}))) == 3
+    cs.insert(Document({'theta': 20, 'phi': 30}, "new"))
+    assert len(list(cs.find({'theta': 20}))) == 4
+
+    cs.enable_find_cache(keep_data=True)
+    doc = cs.find({'theta': 20, 'phi': 30}).next()
+    doc.data = "altered"
+    assert cs.find({'theta': 20, 'phi': 30}).next().data == "new"
+    assert cs.find_cache_hits == 2
+
+    #data is bounded by its bytes, and counted apart from the queries
+    cs.enable_find_cache(max_entries=1, keep_data=True, max_bytes=200)
+    list(cs.find())
+    assert 0 < cs.data_cache_bytes <= 200
+    cs.invalidate_find_cache()
+    assert cs.data_cache_bytes == 0
+    queries, data = cs.find_cache_hits, cs.data_cache_hits
+    list(cs.find({'theta': 40, 'phi': 20}))
+    list(cs.find({'theta': 40}))
+    assert cs.find_cache_hits == queries
+    assert cs.data_cache_hits == data + 1
+
+def test_sqlite_store(fname="/tmp/demonstrate_manual_populate/info.json",
+                      dbname="/tmp/sqlite_store/info.sqlite"):
+    import os
+    import shutil
+    import threading
+    import sqlite_store
+
+    if os.path.exists(os.path.dirname(dbname)):
+        shutil.rmtree(os.path.dirname(dbname))
+    _fresh_manual_populate(fname)
+    fs = FileStore(fname)
+    fs.load()
+
+    db = sqlite_store.from_file_store(fs, dbname)
+    assert db.count() == 15
+
+    db = sqlite_store.SQLiteStore(dbname)
+    db.load()
+    assert db.parameter_list == fs.parameter_list
+    docs = list(db.find({'theta': '20', 'phi': 10}))
+    assert len(docs) == 1
+    assert docs[0].descriptor == {'theta': 20, 'phi': 10}
+    assert docs[0].data == str({'theta': 20, 'phi': 10})
+
+    #lists and ranges
+    assert db.count({'theta': [0, 40]}) == 6
+    found = db.find({'theta': {'>=': 10, '<': 30}, 'phi': {'>': 0}})
+    assert sorted((d.descriptor['theta'], d.descriptor['phi']) for d in found) == \
+        [(10, 10), (10, 20), (20, 10), (20, 20)]
+    sub = db.extract({'theta': [0, 40]},
+                     sqlite_store.SQLiteStore("/tmp/sqlite_store/sub.sqlite"))
+    assert sub.get_parameter('theta')['values'] == [0, 40]
+    assert sub.get_parameter('theta')['default'] == 0
+    assert sub.count() == 6
+
+    #readers in other threads see batched inserts once they are committed
+    counts = []
+    reader = lambda: counts.append(db.count({'theta': 50}))
+    with db.batch():
+        db.add_parameter("theta", make_parameter('theta', [0,10,20,30,40,50]))
+        for p in [0,10,20]:
+            doc = Document({'theta': 50, 'phi': p}, "new")
+            doc.attributes = {'p': p}
+            db.insert(doc)
+        t = threading.Thread(target=reader)
+        t.start()
+        t.join()
+    reader()
+    assert counts == [0, 3]
+    assert db.get({'theta': 50, 'phi': 20}).attributes == {'p': 20}
+
+    #a parameter added within a batch doesn't commit the batch early
+    counts = []
+    try:
+        with db.batch():
+            db.insert(Document({'theta': 60, 'phi': 0}, "abandoned"))
+            db.add_parameter("zoom", make_parameter('zoom', [1, 2]))
+            t = threading.Thread(target=lambda: counts.append(db.count()))
+            t.start()
+            t.join()
+            raise RuntimeError("abandoned")
+    except RuntimeError:
+        pass
+    assert counts == [18] and db.count() == 18
+    #nor is it kept once the batch is rolled back
+    assert not 'zoom' in db.parameter_list
+
+    #and back
+    out = sqlite_store.to_file_store(db, "/tmp/sqlite_store/files/info.json",
+                                     "{theta}/{phi}")
+    out = FileStore("/tmp/sqlite_store/files/info.json")
+    out.load()
+    assert len(list(out.find())) == 18
+    assert out.get({'theta': 50, 'phi': 10}).data == "new"
+
+    #documents kept next to the database
+    ext = sqlite_store.from_file_store(fs, "/tmp/sqlite_store/ext/info.sqlite",
+                                       external=True)
+    assert os.path.exists("/tmp/sqlite_store/ext/30/20")
+    assert ext.get({'theta': 30, 'phi': 20}).data == str({'theta': 30, 'phi': 20})
+
+def test_dense_export(fname="/tmp/dense_src/info.json", out="/tmp/dense_out/store.npy"):
+    import os
+    import shutil
+    from StringIO import StringIO
+    import numpy
+    import PIL.Image
+    import dense_export
+
+    for d in [fname, out]:
+        if os.path.exists(os.path.dirname(d)):
+            shutil.rmtree(os.path.dirname(d))
+    os.makedirs(os.path.dirname(out))
+
+    cs = FileStore(fname)
+    cs.filename_pattern = "{theta}/{phi}_{color}.png"
+    cs.add_parameter("theta", make_parameter('theta', [0,10,20]))
+    cs.add_parameter("phi", make_parameter('phi', [0.5,1.5]))
+    cs.add_parameter("color", make_parameter('color', ['a', 'b'], typechoice='list'))
+    for t in [0,10,20]:
+        for p in [0.5,1.5]:
+            if (t, p) == (20, 1.5):
+                continue
+            buf = StringIO()
+            PIL.Image.new('RGB', (5, 4), (t, int(p * 10), 7)).save(buf, 'PNG')
+            cs.insert(Document({'theta': t, 'phi': p, 'color': 'b'}, buf.getvalue()))
+    cs.save()
+
+    dense = dense_export.export(cs, out, ['theta', 'phi'], {'color': 'b'}, workers=2)
+    assert dense.array.shape == (3, 2, 4, 5, 3)
+    assert dense.mask.sum() == 5 and not dense.mask[2, 1]
+
+    dense = dense_export.load(out)
+    assert isinstance(dense.array, numpy.memmap)
+    assert dense.parameters == ['theta', 'phi']
+    assert (dense.get({'theta': 10, 'phi': 1.5}) == [10, 15, 7]).all()
+    assert (dense.get({'theta': '20', 'phi': '0.5'})[..., 0] == 20).all()
+    assert dense.get({'phi': 0.5}).shape == (3, 4, 5, 3)
+    #whole store analytics in one go
+    assert (dense.array[..., 0].mean(axis=(2, 3)) == [[0, 0], [10, 10], [20, 0]]).all()
+
+def test_frame_encoder():
+    from StringIO import StringIO
+    import numpy
+    import PIL.Image
+    import frame_encoder
+
+    encoder = frame_encoder.FrameEncoder('.png', workers=3, max_in_flight=2)
+    done = []
+    for i in range(10):
+        frame = numpy.zeros((6, 8, 3), dtype=numpy.uint8)
+        frame[:] = i
+        done.extend(encoder.submit(Document({'i': i}), frame))
+        #never more than max_in_flight outstanding
+        assert i + 1 - len(done) <= 2
+    done.extend(encoder.drain())
+    encoder.close()
+
+    assert [d.descriptor['i'] for d in done] == range(10)
+    for d in done:
+        img = PIL.Image.open(StringIO(d.data))
+        assert img.format == 'PNG' and img.size == (8, 6)
+        assert img.getpixel((0, 0)) == (d.descriptor['i'],) * 3
+
+    inline = frame_encoder.FrameEncoder('.jpg', workers=0)
+    doc, = inline.submit(Document({}), numpy.zeros((4, 4, 1), dtype=numpy.uint8))
+    assert PIL.Image.open(StringIO(doc.data)).format == 'JPEG'
+
+    #an explorer encoding as vtk_explorers.ImageExplorer does streams
+    #documents once they are encoded and inserted
+    import explorers
+    import sinks
+
+    class Encoding(explorers.Explorer):
+        def prepare(self):
+            super(Encoding, self).prepare()
+            self.encoder = frame_encoder.FrameEncoder('.png', 2, 2)
+        def insert(self, doc):
+            frame = numpy.zeros((4, 4, 3), dtype=numpy.uint8)
+            for done in self.encoder.submit(doc, frame):
+                super(Encoding, self).insert(done)
+        def drain(self):
+            for done in self.encoder.drain():
+                super(Encoding, self).insert(done)
+        def finish(self):
+            super(Encoding, self).finish()
+            self.encoder.close()
+
+    cs = FileStore()
+    cs.add_parameter("i", make_parameter('i', range(6)))
+    e = Encoding(cs, ['i'], [])
+    e.write_to_store = False
+    received = []
+    e.add_sink(sinks.CallbackSink(received.append))
+    streamed = list(e.stream())
+    assert [d.descriptor['i'] for d in streamed] == range(6)
+    assert [d.descriptor['i'] for d in received] == range(6)
+    assert all(d.data is not None for d in streamed + received)
+
+def test_output_cache():
+    import explorers
+
+    class Filter(object):
+        """ stands in for a filter, counting how often it runs """
+        def __init__(self):
+            self.value = None
+            self.runs = 0
+            self.shown = None
+
+    class Cache(explorers.OutputCache):
+        def __init__(self, filt, max_bytes):
+            super(Cache, self).__init__(max_bytes)
+            self.filt = filt
+        def snapshot(self):
+            self.filt.runs += 1
+            return ('output of %s' % self.filt.value, 10)
+        def show(self, data):
+            self.filt.shown = data
+
+    class Contour(explorers.Track):
+        def __init__(self, filt, cache):
+            super(Contour, self).__init__()
+            self.filt = filt
+            self.cache = cache
+        def execute(self, doc):
+            o = doc.descriptor['contour']
+            self.cache.update(o, lambda: setattr(self.filt, 'value', o))
+            doc.data = self.filt.shown
+
+    cs = FileStore()
+    cs.filename_pattern = "{phi}_{contour}"
+    cs.add_parameter("phi", make_parameter('phi', [0,10,20,30]))
+    cs.add_parameter("contour", make_parameter('contour', [1,2,3]))
+
+    filt = Filter()
+    cache = Cache(filt, 30)
+    e = explorers.Explorer(cs, ['phi', 'contour'], [Contour(filt, cache)])
+    e.write_to_store = False
+    docs = list(e.stream())
+    #contour varies fastest yet each value is computed once
+    assert filt.runs == 3
+    assert cache.hits == 9
+    assert all(d.data == 'output of %s' % d.descriptor['contour'] for d in docs)
+
+    #the next explore may see new data upstream, nothing is reused
+    list(e.stream())
+    assert filt.runs == 6
+
+    #bounded, the least recently used output goes first
+    cache = Cache(filt, 20)
+    for v in [1, 2, 3, 2, 1]:
+        cache.update(v, lambda: setattr(filt, 'value', v))
+    assert cache.misses == 4 and cache.hits == 1
+
+def test_store_index(fname="/tmp/demonstrate_manual_populate/info.json"):
+    import os
+    import store_index
+
+    _fresh_manual_populate(fname)
+    cs = FileStore(fname)
+    cs.load()
+
+    index = store_index.StoreIndex(cs)
+    assert index.expected == 15
+    #usable before indexing even starts
+    assert not index.ready and index.progress() == 0.0
+    assert index.get({'theta': 10, 'phi': 20}).data == str({'theta': 10, 'phi': 20})
+    assert index.get({'theta': 15, 'phi': 20}) is None
+
+    index.start()
+    index.join()
+    assert index.ready and index.count == 15 and index.progress() == 1.0
+    assert index.get({'theta': 40}).data == str({'theta': 40, 'phi': 0})
+
+    #once ready, missing documents are known without looking at the disk
+    os.remove(cs.get_filename(Document({'theta': 0, 'phi': 0})))
+    assert cs.get_filename(Document({'theta': 0, 'phi': 0})) in index
+    #and those removed since are dropped when read
+    assert index.get({'theta': 0, 'phi': 0}) is None
+    assert not cs.get_filename(Document({'theta': 0, 'phi': 0})) in index
+    assert index.count == 14
+
+def test_multi_view(fname="/tmp/multi_view/info.json"):
+    import os
+    import shutil
+    import explorers
+
+    if os.path.exists(os.path.dirname(fname)):
+        shutil.rmtree(os.path.dirname(fname))
+
+    runs = []
+    class Pipeline(explorers.Track):
+        def prepare(self, explorer):
+            explorer.cinema_store.add_metadata({'type': 'parametric-image-stack'})
+        def execute(self, doc):
+            runs.append(doc.descriptor['contour'])
+
+    class Explorer(explorers.MultiViewExplorer):
+        def capture(self, view):
+            return "%s of %s" % (view, runs[-1])
+
+    cs = FileStore(fname)
+    cs.filename_pattern = "{contour}/{view}.txt"
+    cs.add_parameter("contour", make_parameter('contour', [1,2,3]))
+    e = Explorer(cs, ['contour'], [Pipeline()], [('front', 'F'), ('side', 'S')])
+    streamed = [(d.descriptor['contour'], d.data) for d in e.stream()]
+    assert runs == [1, 2, 3]
+    assert streamed[:2] == [(1, "F of 1"), (1, "S of 1")] and len(streamed) == 6
+    assert cs.parameter_list['view']['values'] == ['front', 'side']
+    assert cs.get({'contour': 2, 'view': 'side'}).data == "S of 2"
+
+    #or one store per view
+    del runs[:]
+    stores = {}
+    for name in ['front', 'side']:
+        stores[name] = FileStore(os.path.join(os.path.dirname(fname), name, "info.json"))
+        stores[name].filename_pattern = "{contour}.txt"
+        stores[name].add_parameter("contour", make_parameter('contour', [1,2,3]))
+    e = Explorer(stores['front'], ['contour'], [Pipeline()],
+                 [('front', 'F'), ('side', 'S')], stores)
+    e.explore()
+    assert runs == [1, 2, 3]
+    assert stores['front'].get({'contour': 3}).data == "F of 3"
+    assert stores['side'].get({'contour': 1}).data == "S of 1"
+    assert stores['side'].metadata['type'] == 'parametric-image-stack'
+
+def test_store_sync(fname="/tmp/sync_src/info.json",
+                    dest="/tmp/sync_dest/info.json"):
+    import os
+    import shutil
+    import store_sync
+
+    for d in [fname, dest]:
+        if os.path.exists(os.path.dirname(d)):
+            shutil.rmtree(os.path.dirname(d))
+
+    cs = FileStore(fname)
+    cs.filename_pattern = "{time}/{theta}.txt"
+    cs.add_parameter("time", make_parameter('time', [0,1]))
+    cs.add_parameter("theta", make_parameter('theta', [0,10,20]))
+    for t in [0,1]:
+        for th in [0,10,20]:
+            cs.insert(Document({'time': t, 'theta': th}, "%d %d" % (t, th)))
+    cs.save()
+
+    stats = store_sync.sync(cs, dest, workers=2)
+    assert stats['copied'] == 6 and stats['unchanged'] == 0
+    stats = store_sync.sync(cs, dest, workers=2)
+    assert stats['copied'] == 0 and stats['unchanged'] == 6
+
+    #the run appends a time step and redoes one document
+    cs.get_parameter('time')['values'].append(2)
+    for th in [0,10,20]:
+        cs.insert(Document({'time': 2, 'theta': th}, "2 %d" % th))
+    cs.insert(Document({'time': 0, 'theta': 10}, "redone"))
+    cs.save()
+
+    copy = FileStore(dest)
+    copy.load()
+    changes = store_sync.diff(cs, copy, checksum=True)
+    assert len(changes['missing']) == 3
+    assert changes['changed'] == [os.path.join('0', '10.txt')]
+    assert len(changes['unchanged']) == 5
+    assert changes['extra'] == []
+
+    stats = store_sync.sync(cs, dest, checksum=True, workers=2)
+    assert stats['copied'] == 4 and stats['unchanged'] == 5
+    copy = FileStore(dest)
+    copy.load()
+    assert copy.get_parameter('time')['values'] == [0, 1, 2]
+    assert copy.get({'time': 0, 'theta': 10}).data == "redone"
+    assert copy.get({'time': 2, 'theta': 20}).data == "2 20"
+
+    #redone to the same size within the second the copy was made
+    doc_file = os.path.join(os.path.dirname(fname), '1', '20.txt')
+    st = os.stat(doc_file)
+    cs.insert(Document({'time': 1, 'theta': 20}, "1 21"))
+    os.utime(doc_file, (st.st_atime, int(st.st_mtime) + 0.5))
+    changes = store_sync.diff(cs, copy)
+    assert changes['changed'] == [os.path.join('1', '20.txt')]
+
+def test_extract(fname="/tmp/demonstrate_manual_populate/info.json",
+                 dest="/tmp/extract/info.json"):
+    import os
+    import shutil
+    _fresh_manual_populate(fname)
+    if os.path.exists(os.path.dirname(dest)):
+        shutil.rmtree(os.path.dirname(dest))
+
+    cs = FileStore(fname)
+    cs.load()
+    sub = cs.extract({'phi': 10}, dest)
+    assert sub.get_parameter('phi')['values'] == [10]
+    assert sub.get_parameter('theta')['values'] == cs.get_parameter('theta')['values']
+
+    sub = FileStore(dest)
+    sub.load()
+    docs = list(sub.find())
+    assert len(docs) == len(cs.get_parameter('theta')['values'])
+    for doc in docs:
+        assert doc.data == cs.get(doc.descriptor).data
+    #linked, not copied
+    f = sub.get_filename(Document({'theta': 20}))
+    assert os.stat(f).st_nlink == 2
+
+    #several values of a parameter
+    shutil.rmtree(os.path.dirname(dest))
+    sub = cs.extract({'theta': [0, 40]}, dest)
+    assert sub.get_parameter('theta')['values'] == [0, 40]
+    assert sorted((d.descriptor['theta'], d.descriptor['phi']) for d in sub.find()) == \
+        [('0', '0'), ('0', '10'), ('0', '20'), ('40', '0'), ('40', '10'), ('40', '20')]
+
+def test_insert_log(fname="/tmp/insert_log/info.json"):
+    import os
+    import shutil
+    import store_index
+
+    if os.path.exists(os.path.dirname(fname)):
+        shutil.rmtree(os.path.dirname(fname))
+
+    writer = FileStore(fname, log_inserts=True)
+    writer.filename_pattern = "{time}/{theta}.txt"
+    writer.add_parameter("time", make_parameter('time', [0]))
+    writer.add_parameter("theta", make_parameter('theta', [0,10]))
+    for th in [0,10]:
+        writer.insert(Document({'time': 0, 'theta': th}, "0 %d" % th))
+
+    reader = FileStore(fname)
+    reader.load()
+    index = store_index.StoreIndex(reader)
+    index.start()
+    index.join()
+    assert index.count == 2
+    assert index.poll() == []
+    assert not reader.refresh()
+
+    #the writer goes on to the next time step
+    writer.get_parameter('time')['values'].append(1)
+    writer.save()
+    #file systems with coarse times could see the same mtime
+    os.utime(fname, (0, 0))
+    for th in [0,10]:
+        writer.insert(Document({'time': 1, 'theta': th}, "1 %d" % th))
+    with open(writer.insert_log_filename, "a") as file:
+        file.write('{"descriptor": {"time": 2,')
+
+    assert reader.refresh()
+    assert reader.get_parameter('time')['values'] == [0, 1]
+    added = index.poll()
+    assert added == [{'time': 1, 'theta': 0}, {'time': 1, 'theta': 10}]
+    assert index.count == 4
+    assert index.get({'time': 1, 'theta': 10}).data == "1 10"
+    #the incomplete line waits for the rest of it
+    assert index.poll() == []
+
+def test_image_compaction(fname="/tmp/compaction/info.json"):
+    import os
+    import shutil
+    from StringIO import StringIO
+    import numpy
+    import PIL.Image
+    import explorers
+    import image_compaction
+
+    if os.path.exists(os.path.dirname(fname)):
+        shutil.rmtree(os.path.dirname(fname))
+
+    frames = {}
+    class Render(explorers.Track):
+        def execute(self, doc):
+            x = doc.descriptor['x']
+            arr = numpy.zeros((300, 400, 3), dtype=numpy.uint8)
+            arr[...] = (255, 255, 255)
+            #a few solid colors
+            palette = numpy.array([(200, 0, 0), (0, 0, 200), (0, 150, 0)],
+                                  dtype=numpy.uint8)
+            arr[100:130, x:x+40] = palette[numpy.random.randint(0, 3, (30, 40))]
+            frames[x] = arr
+            buf = StringIO()
+            PIL.Image.fromarray(arr).save(buf, 'PNG')
+            doc.data = buf.getvalue()
+
+    cs = FileStore(fname)
+    cs.filename_pattern = "{x}.png"
+    cs.add_parameter("x", make_parameter('x', [0, 150, 360]))
+    e = explorers.Explorer(cs, ['x'], [Render()])
+    compactor = image_compaction.Compactor()
+    e.add_transform(compactor)
+    e.explore()
+    assert compactor.bytes_out < compactor.bytes_in
+
+    for x in [0, 150, 360]:
+        doc = cs.get({'x': x})
+        img = PIL.Image.open(StringIO(doc.data))
+        assert img.mode == 'P' and img.size == (40, 30)
+        #the store kept no attributes, the png has what is needed
+        assert doc.attributes is None
+        full = image_compaction.expand_document(doc)
+        assert (full.data == frames[x]).all()
+
+    #the store's readers see the full frames
+    import dense_export
+    import similarity_index
+    import transcode
+    dirname = os.path.dirname(fname) + "_out"
+    if os.path.exists(dirname):
+        shutil.rmtree(dirname)
+    os.makedirs(dirname)
+    dense = dense_export.export(cs, os.path.join(dirname, "dense.npy"), workers=1)
+    assert dense.mode == 'RGB' and (dense.get({'x': 150}) == frames[150]).all()
+    stats = transcode.transcode(cs, os.path.join(dirname, "png", "info.json"),
+                                workers=1)
+    assert stats['converted'] == 3
+    img = PIL.Image.open(os.path.join(dirname, "png", "360.png"))
+    assert img.mode == 'RGB' and (numpy.asarray(img) == frames[360]).all()
+    index = similarity_index.build(cs, workers=1)
+    live = similarity_index.SimilarityIndex()
+    live.add_document(cs.get({'x': 0}))
+    expected = similarity_index.image_hash(PIL.Image.fromarray(frames[0]))
+    assert (index.hash_of({'x': 0}) == expected).all()
+    assert (live.hash_of({'x': 0}) == expected).all()
+
+    #images that can't be made smaller are left alone
+    noise = numpy.random.randint(0, 255, (20, 20, 3)).astype(numpy.uint8)
+    buf = StringIO()
+    PIL.Image.fromarray(noise).save(buf, 'PNG')
+    data, info = image_compaction.compact(buf.getvalue())
+    assert info is None and data == buf.getvalue()
+    doc = Document({}, data)
+    assert image_compaction.expand_document(doc) is doc
+
+def test_adaptive_explorer(fname="/tmp/adaptive/info.json"):
+    import os
+    import shutil
+    from StringIO import StringIO
+    import PIL.Image
+    import explorers
+
+    if os.path.exists(os.path.dirname(fname)):
+        shutil.rmtree(os.path.dirname(fname))
+
+    class Rendering(explorers.Explorer):
+        #renders in insert and hands documents over a few samples later,
+        #as the image explorers do
+        def __init__(self, cinema_store, parameters, tracks, size=8):
+            super(Rendering, self).__init__(cinema_store, parameters, tracks)
+            self.size = size
+            self.pending = []
+        def insert(self, doc):
+            #nothing changes but for a jump at x = 37
+            shade = 255 if doc.descriptor['x'] >= 37 else 0
+            buf = StringIO()
+            PIL.Image.new('RGB', (self.size, self.size),
+                          (shade, doc.descriptor['c'], 0)).save(buf, 'PNG')
+            doc.data = buf.getvalue()
+            self.pending.append(doc)
+            if len(self.pending) > 3:
+                super(Rendering, self).insert(self.pending.pop(0))
+        def drain(self):
+            for doc in self.pending:
+                super(Rendering, self).insert(doc)
+            self.pending = []
+
+    class Adaptive(explorers.AdaptiveExplorer, Rendering):
+        pass
+
+    cs = FileStore(fname)
+    cs.filename_pattern = "{c}/{x}.png"
+    cs.add_parameter("x", make_parameter('x', [0, 25, 50, 75, 100]))
+    cs.add_parameter("c", make_parameter('c', [0, 100]))
+    e = Adaptive(cs, ['c', 'x'], [], ['x'], threshold=0.1, budget=100, size=8)
+    streamed = list(e.stream())
+
+    xs = cs.get_parameter('x')['values']
+    #refined down to the jump, and nowhere else
+    assert 36 in xs and 37 in xs
+    assert [x for x in xs if not x in [0, 25, 50, 75, 100]] == [31, 34, 35, 36, 37]
+    assert e.samples == 2 * len(xs)
+    assert len(list(cs.find())) == e.samples
+    assert len(streamed) == e.samples and not e.pending
+
+    saved = FileStore(fname)
+    saved.load()
+    assert saved.get_parameter('x')['values'] == xs
+
+    #the budget stops refinement early
+    shutil.rmtree(os.path.dirname(fname))
+    cs = FileStore(fname)
+    cs.filename_pattern = "{c}/{x}.png"
+    cs.add_parameter("x", make_parameter('x', [0, 25, 50, 75, 100]))
+    cs.add_parameter("c", make_parameter('c', [0, 100]))
+    e = Adaptive(cs, ['c', 'x'], [], ['x'], threshold=0.1, budget=15)
+    e.explore()
+    assert e.samples == 14
+    assert len(cs.get_parameter('x')['values']) == 7
+
+    #nothing is saved for explorers that don't write to the store
+    shutil.rmtree(os.path.dirname(fname))
+    e = Adaptive(cs, ['c', 'x'], [], ['x'], threshold=0.1, budget=15)
+    e.write_to_store = False
+    e.explore()
+    assert not os.path.exists(fname)
+
+    #compacted images are compared as the frames they were rendered as
+    import numpy
+    import image_compaction
+    data = []
+    for shift in [0, 1]:
+        arr = numpy.zeros((300, 400, 3), dtype=numpy.uint8)
+        arr[100:140, 100 + shift:160] = (200, 0, 0)
+        buf = StringIO()
+        PIL.Image.fromarray(arr).save(buf, 'PNG')
+        data.append(image_compaction.compact(buf.getvalue())[0])
+    assert explorers.AdaptiveExplorer.image_difference(*data) < 0.01
+
+def test_similarity_index(fname="/tmp/similarity/info.json"):
+    import os
+    import shutil
+    from StringIO import StringIO
+    import numpy
+    import PIL.Image
+    import explorers
+    import sinks
+    import similarity_index
+
+    if os.path.exists(os.path.dirname(fname)):
+        shutil.rmtree(os.path.dirname(fname))
+
+    class Render(explorers.Track):
+        #a bar at x, brightened a little for the second shade
+        def execute(self, doc):
+            arr = numpy.zeros((64, 64), dtype=numpy.uint8)
+            x = doc.descriptor['x']
+            arr[:, x:x+8] = 200 + doc.descriptor['shade']
+            arr[:, :] += numpy.arange(64, dtype=numpy.uint8)[numpy.newaxis, :] // 4
+            buf = StringIO()
+            PIL.Image.fromarray(arr).save(buf, 'PNG')
+            doc.data = buf.getvalue()
+
+    cs = FileStore(fname)
+    cs.filename_pattern = "{x}/{shade}.png"
+    cs.add_parameter("x", make_parameter('x', [0, 16, 32, 48]))
+    cs.add_parameter("shade", make_parameter('shade', [0, 5]))
+    live = similarity_index.SimilarityIndex()
+    e = explorers.Explorer(cs, ['x', 'shade'], [Render()])
+    e.add_sink(sinks.CallbackSink(live.add_document))
+    e.explore()
+    assert len(live) == 8
+    #documents that aren't images are left out
+    live.add_document(Document({'x': 0, 'shade': 9}, "not an image"))
+    assert len(live) == 8
+
+    index = similarity_index.build(cs, workers=2)
+    assert len(index) == 8
+    for desc in live.descriptors:
+        assert (index.hash_of(desc) == live.hash_of(desc)).all()
+
+    found = index.similar({'x': 16, 'shade': 0}, k=2)
+    assert found[0] == (0, {'x': '16', 'shade': '0'})
+    assert found[1][1] == {'x': '16', 'shade': '5'}
+    groups = index.duplicates(max_distance=2)
+    assert sorted(sorted(d['shade'] for d in g) for g in groups) == [['0', '5']] * 4
+    #near duplicates are found whichever bits they differ in
+    hashes = similarity_index.SimilarityIndex()
+    for i, flipped in enumerate([[], [0], [63], [0, 9, 18, 27, 36], [5, 6]]):
+        bits = numpy.zeros(64, dtype=numpy.uint8)
+        bits[flipped] = 1
+        hashes.add({'i': i}, numpy.packbits(bits))
+    groups = hashes.duplicates(max_distance=2)
+    assert [[d['i'] for d in g] for g in groups] == [[0, 1, 2, 4]]
+    assert len(hashes.duplicates(max_distance=64)[0]) == 5
+
+    index.save("/tmp/similarity/index.npz")
+    again = similarity_index.load("/tmp/similarity/index.npz")
+    assert len(again) == 8
+    hash = index.hash_of({'x': 48, 'shade': 5})
+    assert (again.hash_of({'x': 48, 'shade': 5}) == hash).all()
+    assert again.search(hash, k=1)[0][0] == 0
+
+def _write_time_step(task):
+    fname, time = task
+    cs = FileStore(fname, writer="step%d" % time)
+    cs.filename_pattern = "{time}/{theta}.txt"
+    cs.add_parameter("time", make_parameter('time', [time]))
+    cs.add_parameter("theta", make_parameter('theta', [0,10,20]))
+    cs.add_metadata({'step%d' % time: True})
+    for th in [0,10,20]:
+        cs.insert(Document({'time': time, 'theta': th}, "%d %d" % (time, th)))
+    cs.save()
+
+def test_multiple_writers(fname="/tmp/multiple_writers/info.json"):
+    import os
+    import shutil
+    from multiprocessing import Pool
+    import store_index
+
+    if os.path.exists(os.path.dirname(fname)):
+        shutil.rmtree(os.path.dirname(fname))
+
+    #a producer per time step, all writing to the same store
+    pool = Pool(4)
+    pool.map(_write_time_step, [(fname, t) for t in range(8)])
+    pool.close()
+    pool.join()
+
+    cs = FileStore(fname)
+    cs.load()
+    assert cs.get_parameter('time')['values'] == range(8)
+    assert sorted(cs.metadata) == ['step%d' % t for t in range(8)]
+    assert len(list(cs.find())) == 24
+    assert len(cs.insert_log_filenames()) == 8
+
+    #files being written are not documents
+    with open(os.path.join(os.path.dirname(fname), "0", ".0.txt.1.2.partial"), "w") as f:
+        f.write("partial")
+    assert len(list(cs.find({'time': 0}))) == 3
+
+    index = store_index.StoreIndex(cs)
+    _write_time_step((fname, 8))
+    added = index.poll()
+    assert sorted(d['theta'] for d in added) == [0, 10, 20]
+
+def test_estimate(fname="/tmp/estimate/info.json"):
+    import copy
+    import os
+    import shutil
+    import explorers
+
+    if os.path.exists(os.path.dirname(fname)):
+        shutil.rmtree(os.path.dirname(fname))
+
+    #a clock that only the tracks advance
+    now = [0.0]
+    clock = lambda: now[0]
+
+    class Contour(explorers.Track):
+        #only recomputes when its value changes, as pipelines do
+        def __init__(self):
+            self.last = None
+        def execute(self, doc):
+            if doc.descriptor['contour'] != self.last:
+                now[0] += 0.02
+                self.last = doc.descriptor['contour']
+
+    class Render(explorers.Track):
+        def execute(self, doc):
+            doc.data = "x" * 100
+
+    cs = FileStore(fname)
+    cs.filename_pattern = "{contour}/{theta}.txt"
+    cs.add_parameter("theta", make_parameter('theta', range(0, 360, 10)))
+    cs.add_parameter("contour", make_parameter('contour', [1, 2, 3, 4]))
+    e = explorers.Explorer(cs, ['theta', 'contour'], [Contour(), Render()])
+    plan = e.estimate(samples=2, seed=0, clock=clock)
+    assert not os.path.exists(fname)
+
+    assert plan.count == 144 and plan.files() == 144
+    assert plan.bytes() == 14400
+    assert len(plan.track_times) == 2
+    #contour outermost recomputes it 4 times rather than 144
+    (fast, order), (slow, other) = plan.orders()
+    assert order == ['contour', 'theta']
+    assert abs(fast - plan.sample_time() - 3 * 0.02) < 1e-9
+    assert abs(slow - plan.sample_time() - (35 + 36 * 3) * 0.02) < 1e-9
+    assert plan.time(['theta', 'contour']) == slow
+    assert abs(plan.time(order, workers=2) - fast / 2) < 1e-9
+    assert "fastest order contour, theta" in plan.report()
+
+    #layers are sampled one at a time, and preparing leaves the store as it was
+    class Shade(explorers.Track):
+        def execute(self, doc):
+            now[0] += 0.01
+
+    cs.add_parameter("shade", make_parameter('shade', [1, 2]))
+    parameters, metadata = copy.deepcopy(cs.parameter_list), copy.deepcopy(cs.metadata)
+    layers = [explorers.Layer('a', ['shade'], [Shade()]),
+              explorers.Layer('b', [], [])]
+    e = explorers.LayeredExplorer(cs, ['theta', 'contour'],
+                                  [Contour(), Render()], layers)
+    plan = e.estimate(samples=1, seed=0, clock=clock)
+    assert cs.parameter_list == parameters and cs.metadata == metadata
+    assert plan.count == 144 * 2 + 144
+    assert len(plan.track_times) == 3
+    assert plan.time() > plan.time(['contour', 'theta'])
+
+def test_thumbnails(fname="/tmp/thumbnails/info.json"):
+    import os
+    import shutil
+    import threading
+    from StringIO import StringIO
+    import PIL.Image
+    import store_index
+    import thumbnails
+
+    if os.path.exists(os.path.dirname(fname)):
+        shutil.rmtree(os.path.dirname(fname))
+
+    cs = FileStore(fname)
+    cs.filename_pattern = "{a}/{b}.png"
+    cs.add_parameter("a", make_parameter('a', range(10)))
+    cs.add_parameter("b", make_parameter('b', range(5)))
+    for a in range(10):
+        for b in range(5):
+            buf = StringIO()
+            PIL.Image.new('RGB', (200, 100), (a * 20, b * 40, 0)).save(buf, 'PNG')
+            cs.insert(Document({'a': a, 'b': b}, buf.getvalue()))
+    index = store_index.StoreIndex(cs)
+
+    tiles = {}
+    lock = threading.Lock()
+    def ready(i, img):
+        with lock:
+            tiles[i] = img
+
+    loader = thumbnails.ThumbnailLoader(index.get, workers=4)
+    queries = [{'a': a, 'b': b} for a in range(10) for b in range(5)]
+    #one more with no document
+    queries.append({'a': 99, 'b': 0})
+    loader.request(queries, (40, 40), ready).wait()
+    assert len(tiles) == 51
+    assert tiles[50] is None
+    assert tiles[7].size == (40, 20)
+    assert tiles[7].getpixel((0, 0)) == (20, 80, 0)
+
+    #a newer request drops what is left of the older one
+    tiles.clear()
+    gate = threading.Event()
+    def slow(descriptor):
+        gate.wait()
+        return index.get(descriptor)
+    loader.lookup = slow
+    old = loader.request(queries, (40, 40), ready)
+    loader.lookup = index.get
+    new = loader.request(queries[:3], (40, 40), ready)
+    gate.set()
+    old.wait()
+    new.wait()
+    assert sorted(tiles) == [0, 1, 2]
+    loader.close()
+
+def test_playback(fname="/tmp/demonstrate_manual_populate/info.json"):
+    import threading
+    import playback
+
+    _fresh_manual_populate(fname)
+    cs = FileStore(fname)
+    cs.load()
+
+    frames = playback.parameter_path(cs, {'phi': 10, 'theta': 0},
+                                     ['theta', 'phi'], 'pingpong')
+    assert len(frames) == 15 + 13
+    assert frames[0] == {'theta': 0, 'phi': 0}
+    assert frames[15] == {'theta': 40, 'phi': 10}
+
+    now = [0.0]
+    loaded = []
+    gate = threading.Event()
+    gate.set()
+    def load(desc):
+        gate.wait()
+        loaded.append(desc)
+        return cs.get(desc).data
+    player = playback.Player(frames, load, fps=10, lookahead=4, workers=2,
+                             clock=lambda: now[0])
+    player.start()
+    while player.poll() is None:
+        pass
+    #nothing new until the next frame is due
+    assert player.poll() is None
+
+    now[0] = 0.1
+    frame = None
+    while frame is None:
+        frame = player.poll()
+    assert frame == (1, cs.get(frames[1]).data)
+
+    #falling behind skips frames rather than slowing down
+    now[0] = 0.55
+    frame = None
+    while frame is None:
+        frame = player.poll()
+    assert frame[0] == 5 and player.dropped == 3 and player.shown == 3
+
+    #frames that aren't loaded in time aren't shown
+    gate.clear()
+    now[0] = 1.25
+    assert player.poll() is None
+    gate.set()
+    frame = None
+    while frame is None:
+        frame = player.poll()
+    assert frame[0] == 12
+
+    #looping wraps around, once stops at the end
+    now[0] = 2.85
+    frame = None
+    while frame is None:
+        frame = player.poll()
+    assert frame[0] == 0
+    player.close()
+
+    player = playback.Player(frames[:3], load, fps=10, loop=False,
+                             clock=lambda: now[0])
+    player.start()
+    #the last frame is shown however late it is
+    now[0] = 10
+    frame = None
+    while frame is None:
+        frame = player.poll()
+    assert frame[0] == 2 and player.finished
+    assert player.poll() is None
+    player.close()
+
 def test_pv_contour(fname):
     import explorers
     import pv_explorers
@@ -258,6 +1590,31 @@ def test_NOP(fname):
 
 if __name__ == "__main__":
     test_store()
+    test_camera_paths()
+    test_layered_composite()
+    test_recoloring()
+    test_streaming()
+    test_async_store()
+    test_store_stats()
+    test_transcode()
+    test_cached_store()
+    test_find_cache()
+    test_sqlite_store()
+    test_dense_export()
+    test_frame_encoder()
+    test_output_cache()
+    test_store_index()
+    test_multi_view()
+    test_store_sync()
+    test_extract()
+    test_insert_log()
+    test_image_compaction()
+    test_adaptive_explorer()
+    test_similarity_index()
+    test_multiple_writers()
+    test_estimate()
+    test_thumbnails()
+    test_playback()
     demonstrate_populate()
     demonstrate_analyze()
     test_pv_slice("/tmp/pv_slice_data/info.json")
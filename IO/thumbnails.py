@@ -0,0 +1,71 @@
+"""
+    Module for loading many small images of a store at once, as a grid of
+    thumbnails needs.
+"""
+
+import threading
+from multiprocessing.pool import ThreadPool
+from StringIO import StringIO
+
+import PIL.Image
+
+def thumbnail(doc, size):
+    """
+    Decodes a document's image, encoded bytes or an already decoded numpy
+    array, into a PIL image no larger than size (width, height).
+    """
+    if isinstance(doc.data, str):
+        img = PIL.Image.open(StringIO(doc.data))
+        #jpeg decoders can skip most of the work for small sizes
+        img.draft('RGB', size)
+    else:
+        img = PIL.Image.fromarray(doc.data)
+    img.thumbnail(size, PIL.Image.ANTIALIAS)
+    return img
+
+class ThumbnailLoader(object):
+    """
+    Fetches and decodes batches of documents on a pool of threads. lookup
+    maps a descriptor to a document, or None, for instance a StoreIndex's
+    get. Each request replaces the one before it, whose images that have
+    not been decoded yet are dropped, so a grid that changes quickly only
+    waits for what it currently shows.
+    """
+
+    def __init__(self, lookup, workers=8):
+        self.lookup = lookup
+        self.__pool = ThreadPool(workers)
+        self.__lock = threading.Lock()
+        self.__generation = 0
+
+    def request(self, descriptors, size, callback):
+        """
+        Loads the thumbnails for a list of descriptors. callback(index, img)
+        is called on a worker thread as each one is ready, with img None
+        when there is no document. Returns a result whose wait() returns
+        once the whole batch is done or dropped.
+        """
+        with self.__lock:
+            self.__generation += 1
+            generation = self.__generation
+
+        def load(task):
+            index, descriptor = task
+            if generation != self.__generation:
+                return
+            doc = self.lookup(descriptor)
+            img = thumbnail(doc, size) if doc is not None else None
+            if generation == self.__generation:
+                callback(index, img)
+
+        return self.__pool.map_async(load, list(enumerate(descriptors)), 1)
+
+    def cancel(self):
+        """ drops whatever is still to be loaded """
+        with self.__lock:
+            self.__generation += 1
+
+    def close(self):
+        self.cancel()
+        self.__pool.close()
+        self.__pool.join()
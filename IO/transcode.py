@@ -0,0 +1,203 @@
+"""
+    Re-encodes or resizes every image of a file store into a new store,
+    using all cores, instead of rerunning the sweep that produced it.
+
+    usage: python transcode.py src/info.json dest/info.json --format jpg ...
+
+    Documents are converted file to file by a pool of processes, so memory
+    stays bounded by the images being worked on. Each output file is
+    written under a temporary name and renamed once complete, so an
+    interrupted run can be started again and only does the missing work.
+    Stores of numpy archives, such as value images and composite layers,
+    are recompressed with --format npz. Documents that have no encoding to
+    convert, raw buffers for instance, are left out of the new store.
+"""
+
+import copy
+import os
+import os.path
+from multiprocessing import Pool
+
+import numpy
+import PIL.Image
+
+import cinema_store
+import image_compaction
+
+_EXTENSIONS = {'png': '.png', 'jpg': '.jpg', 'jpeg': '.jpg', 'npz': '.npz'}
+
+def _resize(img, scale, size):
+    if scale:
+        w, h = img.size
+        return img.resize((max(1, int(round(w * scale))),
+                           max(1, int(round(h * scale)))), PIL.Image.ANTIALIAS)
+    if size:
+        img = img.copy()
+        img.thumbnail(size, PIL.Image.ANTIALIAS)
+    return img
+
+def _compress_file(src, dest):
+    """ rewrites a numpy archive compressed, returns False if it isn't one """
+    try:
+        npz = numpy.load(src)
+        if not isinstance(npz, numpy.lib.npyio.NpzFile):
+            return False
+        arrays = dict((name, npz[name]) for name in npz.files)
+    except (IOError, ValueError):
+        return False
+    cinema_store._makedirs(os.path.dirname(dest))
+    tmp = cinema_store._temporary_name(dest)
+    with open(tmp, "wb") as file:
+        numpy.savez_compressed(file, **arrays)
+    os.rename(tmp, dest)
+    return True
+
+def _transcode_file(task):
+    """
+    converts one file, returns its name and the number of bytes written,
+    or None if it has no encoding to convert
+    """
+    src, dest, options = task
+    if options['format'] == 'npz':
+        if not _compress_file(src, dest):
+            return src, None
+        return src, os.path.getsize(dest)
+    try:
+        img = image_compaction.open_expanded(src)
+        img.load()
+    except IOError:
+        return src, None
+
+    cinema_store._makedirs(os.path.dirname(dest))
+    tmp = cinema_store._temporary_name(dest)
+    img = _resize(img, options.get('scale'), options.get('size'))
+    fmt = options['format']
+    if fmt == 'jpg':
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        img.save(tmp, 'JPEG', quality=options.get('quality') or 90)
+    else:
+        if options.get('compress_level') is None:
+            img.save(tmp, 'PNG')
+        else:
+            img.save(tmp, 'PNG', compress_level=options['compress_level'])
+    os.rename(tmp, dest)
+    return src, os.path.getsize(dest)
+
+def _drop_missing_values(store, descriptors):
+    """
+    Removes the values that no document has from the store's parameters,
+    given the descriptors, read from file names, of its documents.
+    """
+    for name, properties in store.parameter_list.items():
+        found = set(desc[name] for desc in descriptors if name in desc)
+        if not found:
+            continue
+        values = [v for v in properties['values'] if "{0}".format(v) in found]
+        properties['values'] = values
+        if 'default' in properties and not properties['default'] in values:
+            properties['default'] = values[0]
+    store.invalidate_find_cache()
+
+def transcode(src, dest_fname, format='png', quality=None, compress_level=None,
+              scale=None, size=None, workers=None, q=None):
+    """
+    Converts the documents of src (a loaded FileStore) that match q into a
+    new store at dest_fname, and returns a dict with the number of
+    documents converted, skipped because they were already done, left out
+    because they have no encoding to convert (unsupported), and the bytes
+    written.
+
+    :param format: 'png', 'jpg', or 'npz' to recompress numpy archives.
+
+    :param quality: jpeg quality, 1 to 95.
+
+    :param compress_level: png zlib level, 0 to 9.
+
+    :param scale: factor to resize images by, or
+
+    :param size: (width, height) to shrink images to fit within.
+
+    The new store only lists the parameter values that its documents have.
+
+    :param workers: processes to use, all cores by default.
+    """
+    if not format in _EXTENSIONS:
+        raise RuntimeError("Invalid format, must be one of %s" % str(_EXTENSIONS.keys()))
+    format = 'jpg' if format == 'jpeg' else format
+    if format == 'npz' and (scale or size):
+        raise RuntimeError("Only images can be resized")
+
+    dest = cinema_store.FileStore(dest_fname)
+    base, ext = os.path.splitext(src.filename_pattern)
+    dest.filename_pattern = base + _EXTENSIONS[format]
+    for name, properties in src.parameter_list.items():
+        dest.add_parameter(name, copy.deepcopy(properties))
+    dest.metadata = copy.deepcopy(src.metadata) if src.metadata else {}
+    options = dict(format = format, quality = quality,
+                   compress_level = compress_level, scale = scale,
+                   size = size)
+    dest.add_metadata({'transcoded' : options})
+    dest.save()
+
+    stats = dict(converted = 0, skipped = 0, unsupported = 0, bytes = 0)
+    descriptors = []
+    def tasks():
+        for doc_file in src.find_files(q):
+            desc = src.get_descriptor(doc_file)
+            target = dest.get_filename(cinema_store.Document(desc))
+            if os.path.exists(target):
+                stats['skipped'] += 1
+                descriptors.append(desc)
+                continue
+            yield (doc_file, target, options)
+
+    pool = Pool(workers)
+    try:
+        for doc_file, written in pool.imap_unordered(_transcode_file, tasks(), 8):
+            if written is None:
+                stats['unsupported'] += 1
+                continue
+            stats['converted'] += 1
+            stats['bytes'] += written
+            descriptors.append(src.get_descriptor(doc_file))
+    finally:
+        pool.close()
+        pool.join()
+
+    _drop_missing_values(dest, descriptors)
+    dest.save()
+    return stats
+
+def main(argv=None):
+    import argparse
+    import json
+    parser = argparse.ArgumentParser(description=
+        "Re-encode and resize the images of a cinema file store into a new store.")
+    parser.add_argument("src", help="the source store's info.json")
+    parser.add_argument("dest", help="the new store's info.json")
+    parser.add_argument("--format", default="png", choices=sorted(_EXTENSIONS.keys()))
+    parser.add_argument("--quality", type=int, default=None, help="jpeg quality")
+    parser.add_argument("--compress-level", type=int, default=None,
+                        help="png compression level")
+    parser.add_argument("--scale", type=float, default=None,
+                        help="factor to resize images by")
+    parser.add_argument("--size", type=int, nargs=2, default=None,
+                        metavar=("WIDTH", "HEIGHT"),
+                        help="shrink images to fit within this size")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of processes, all cores by default")
+    parser.add_argument("--query", default=None,
+                        help="json query restricting the documents converted")
+    args = parser.parse_args(argv)
+
+    src = cinema_store.FileStore(args.src)
+    src.load()
+    stats = transcode(src, args.dest, args.format, args.quality,
+                      args.compress_level, args.scale, args.size, args.workers,
+                      json.loads(args.query) if args.query else None)
+    print "converted %(converted)d documents (%(bytes)d bytes), " \
+          "%(skipped)d already done, %(unsupported)d not convertible" % stats
+
+if __name__ == "__main__":
+    main()
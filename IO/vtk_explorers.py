@@ -4,6 +4,9 @@
 """
 
 import explorers
+import compositing
+import recoloring
+import frame_encoder
 import vtk
 from vtk.util import numpy_support
 
@@ -11,33 +14,275 @@ class ImageExplorer(explorers.Explorer):
     """
     An explorer that connects a VTK program's render window to a store
     and makes it save new images into the store.
+
+    Frames are copied out of the render window right after rendering and
+    encoded, in the store's image type, on worker threads while the next
+    samples render. At most max_in_flight frames are held at once.
+    Documents reach the store, the sinks and stream in order, all of them
+    by the time finish returns. With no workers frames are encoded before
+    insert returns.
     """
-    def __init__(self, cinema_store, parameters, engines, rw):
+    def __init__(self, cinema_store, parameters, engines, rw,
+                 workers=2, max_in_flight=8):
         super(ImageExplorer, self).__init__(cinema_store, parameters, engines)
         self.rw = rw
         self.w2i = vtk.vtkWindowToImageFilter()
         self.w2i.SetInput(self.rw)
-        #TODO: choice of writer should be based on store.get_image_type
-        self.pw = vtk.vtkPNGWriter()
-        self.pw.SetInputConnection(self.w2i.GetOutputPort())
-        self.pw.WriteToMemoryOn()
+        self.workers = workers
+        self.max_in_flight = max_in_flight
+        self.encoder = None
+
+    def prepare(self):
+        super(ImageExplorer, self).prepare()
+        self.encoder = frame_encoder.FrameEncoder(
+            self.cinema_store.get_image_type() or '.png',
+            self.workers, self.max_in_flight)
 
     def insert(self, document):
         self.rw.Render()
         self.w2i.Modified()
-        self.pw.Write()
-        document.data = numpy_support.vtk_to_numpy(self.pw.GetResult())
-        super(ImageExplorer, self).insert(document)
+        self.w2i.Update()
+        frame = image_to_numpy(self.w2i.GetOutput())
+        for doc in self.encoder.submit(document, frame):
+            super(ImageExplorer, self).insert(doc)
+
+    def drain(self):
+        for doc in self.encoder.drain():
+            super(ImageExplorer, self).insert(doc)
+
+    def finish(self):
+        super(ImageExplorer, self).finish()
+        self.encoder.close()
+        self.encoder = None
+
+class AdaptiveImageExplorer(explorers.AdaptiveExplorer, ImageExplorer):
+    """
+    An ImageExplorer that refines its adaptive parameters where the images
+    change, see explorers.AdaptiveExplorer. Frames are still encoded while
+    the next samples render, and compared once encoded.
+    """
+    def __init__(self, cinema_store, parameters, engines, rw, adaptive,
+                 threshold=0.02, budget=1000, min_step=0, difference=None,
+                 workers=2, max_in_flight=8):
+        super(AdaptiveImageExplorer, self).__init__(
+            cinema_store, parameters, engines, adaptive,
+            threshold, budget, min_step, difference,
+            rw=rw, workers=workers, max_in_flight=max_in_flight)
+
+def image_to_numpy(image):
+    """
+    Copies a vtkImageData's scalars into a (H,W,C) numpy array whose first
+    row is the top of the image.
+    """
+    w, h, _ = image.GetDimensions()
+    arr = numpy_support.vtk_to_numpy(image.GetPointData().GetScalars())
+    return arr.reshape(h, w, -1)[::-1].copy()
+
+class WindowCapture(object):
+    """
+    Reads back the color and depth buffers of a render window as numpy
+    arrays.
+    """
+    def __init__(self, rw):
+        self.rgb = vtk.vtkWindowToImageFilter()
+        self.rgb.SetInput(rw)
+        self.rgb.SetInputBufferTypeToRGB()
+        self.z = vtk.vtkWindowToImageFilter()
+        self.z.SetInput(rw)
+        self.z.SetInputBufferTypeToZBuffer()
+
+    def capture(self):
+        self.rgb.Modified()
+        self.rgb.Update()
+        self.z.Modified()
+        self.z.Update()
+        rgb = image_to_numpy(self.rgb.GetOutput())
+        depth = image_to_numpy(self.z.GetOutput())[:, :, 0]
+        return rgb, depth
+
+class MultiViewImageExplorer(explorers.MultiViewExplorer):
+    """
+    An explorer that saves images of several of a VTK program's render
+    windows for each sample, running the pipeline only once per sample.
+    """
+    def __init__(self, cinema_store, parameters, engines, views, stores=None):
+        super(MultiViewImageExplorer, self).__init__(
+            cinema_store, parameters, engines, views, stores)
+        self.w2is = {}
+        for name, rw in views:
+            w2i = vtk.vtkWindowToImageFilter()
+            w2i.SetInput(rw)
+            self.w2is[rw] = w2i
+
+    def capture(self, rw):
+        rw.Render()
+        w2i = self.w2is[rw]
+        w2i.Modified()
+        w2i.Update()
+        return frame_encoder.encode_frame(image_to_numpy(w2i.GetOutput()),
+                                          self.cinema_store.get_image_type() or '.png')
+
+class LayeredImageExplorer(explorers.LayeredExplorer):
+    """
+    An explorer that renders each layer of a VTK program alone and stores
+    its color and depth buffers, for compositing at query time.
+    """
+    def __init__(self, cinema_store, parameters, engines, layers, rw):
+        super(LayeredImageExplorer, self).__init__(
+            cinema_store, parameters, engines, layers)
+        self.rw = rw
+        self.capture = WindowCapture(self.rw)
+
+    def insert(self, document):
+        self.rw.Render()
+        rgb, depth = self.capture.capture()
+        document.data = compositing.encode_layer(rgb, depth)
+        super(LayeredImageExplorer, self).insert(document)
+
+class ValueImageExplorer(explorers.Explorer):
+    """
+    An explorer that stores the values of one of an actor's point arrays,
+    and the surface lighting, instead of a colored image. Colors are
+    applied at view time, see recoloring.find_recolored.
+    """
+    def __init__(self, cinema_store, parameters, engines, rw,
+                 actor, array, value_range, colors=None):
+        super(ValueImageExplorer, self).__init__(cinema_store, parameters, engines)
+        self.rw = rw
+        self.actor = actor
+        self.array = array
+        self.value_range = value_range
+        self.colors = colors if colors else {}
+        self.capture = WindowCapture(self.rw)
+        self.saved = None
+        points = recoloring.value_encoding_points(value_range)
+        self.encoder = vtk.vtkColorTransferFunction()
+        for i in range(0, len(points), 4):
+            self.encoder.AddRGBPoint(*points[i:i+4])
+
+    def prepare(self):
+        recoloring.set_value_images(self.cinema_store, self.array, self.value_range)
+        for name, spec in self.colors.items():
+            recoloring.add_color(self.cinema_store, name, spec)
+        self.saved = self.__save()
+        super(ValueImageExplorer, self).prepare()
+
+    def __save(self):
+        """ the actor's coloring, which the value pass changes """
+        mapper = self.actor.GetMapper()
+        prop = self.actor.GetProperty()
+        return (mapper.GetScalarVisibility(), mapper.GetScalarMode(),
+                mapper.GetArrayName(), mapper.GetArrayId(),
+                mapper.GetArrayAccessMode(),
+                mapper.GetLookupTable(),
+                mapper.GetUseLookupTableScalarRange(),
+                mapper.GetInterpolateScalarsBeforeMapping(),
+                prop.GetColor(), prop.GetLighting())
+
+    def __restore(self, saved):
+        mapper = self.actor.GetMapper()
+        prop = self.actor.GetProperty()
+        (visibility, mode, array, array_id, access, lut, use_range,
+         interpolate, color, lighting) = saved
+        mapper.SetScalarVisibility(visibility)
+        mapper.SetScalarMode(mode)
+        mapper.SelectColorArray(array if array else array_id)
+        mapper.SetArrayAccessMode(access)
+        mapper.SetLookupTable(lut)
+        mapper.SetUseLookupTableScalarRange(use_range)
+        mapper.SetInterpolateScalarsBeforeMapping(interpolate)
+        prop.SetColor(color)
+        prop.SetLighting(lighting)
+
+    def insert(self, document):
+        mapper = self.actor.GetMapper()
+        prop = self.actor.GetProperty()
+        saved = self.__save()
+
+        #lighting pass, a white unlit by scalars surface
+        mapper.ScalarVisibilityOff()
+        prop.SetColor(1, 1, 1)
+        self.rw.Render()
+        rgb, depth = self.capture.capture()
+        luminance = rgb[:, :, 0] / 255.0
+
+        #value pass, scalars encoded in colors without lighting
+        mapper.ScalarVisibilityOn()
+        mapper.SetScalarModeToUsePointFieldData()
+        mapper.SelectColorArray(self.array)
+        mapper.SetLookupTable(self.encoder)
+        mapper.UseLookupTableScalarRangeOn()
+        mapper.InterpolateScalarsBeforeMappingOn()
+        prop.LightingOff()
+        self.rw.Render()
+        rgb, depth = self.capture.capture()
+        values = recoloring.decode_values(rgb, self.value_range, depth)
+
+        self.__restore(saved)
+
+        document.data = recoloring.encode_value_image(values, luminance)
+        super(ValueImageExplorer, self).insert(document)
+
+    def finish(self):
+        super(ValueImageExplorer, self).finish()
+        self.__restore(self.saved)
+        self.saved = None
+
+class ActorLayer(explorers.Layer):
+    """
+    A layer made up of one or more vtkProps.
+    """
+    def __init__(self, name, parameters, tracks, props):
+        super(ActorLayer, self).__init__(name, parameters, tracks)
+        self.props = props
+
+    def set_visible(self, visible):
+        for prop in self.props:
+            prop.SetVisibility(visible)
+
+class VTKOutputCache(explorers.OutputCache):
+    """
+    An OutputCache for a vtkAlgorithm. Consumers must take their input from
+    this cache's GetOutputPort() rather than from the filter itself.
+    """
+    def __init__(self, filt, max_bytes):
+        super(VTKOutputCache, self).__init__(max_bytes)
+        self.filt = filt
+        self.producer = vtk.vtkTrivialProducer()
+
+    def GetOutputPort(self):
+        return self.producer.GetOutputPort()
+
+    def snapshot(self):
+        self.filt.Update()
+        output = self.filt.GetOutputDataObject(0)
+        data = output.NewInstance()
+        data.ShallowCopy(output)
+        return data, data.GetActualMemorySize() * 1024
+
+    def show(self, data):
+        self.producer.SetOutput(data)
+        self.producer.Modified()
 
 class Clip(explorers.Track):
     """
     A track that connects clip filters to a scalar valued parameter.
+
+    When cache_bytes is given the clip's outputs are kept for reuse, and
+    whatever consumes the clip must connect to the track's GetOutputPort()
+    instead.
     """
 
-    def __init__(self, argument, clip):
+    def __init__(self, argument, clip, cache_bytes=None):
         super(Clip, self).__init__()
         self.argument = argument
         self.clip = clip
+        self.cache = VTKOutputCache(clip, cache_bytes) if cache_bytes else None
+
+    def GetOutputPort(self):
+        if self.cache:
+            return self.cache.GetOutputPort()
+        return self.clip.GetOutputPort()
 
     def prepare(self, explorer):
         super(Clip, self).prepare(explorer)
@@ -45,7 +290,10 @@ class Clip(explorers.Track):
 
     def execute(self, doc):
         o = doc.descriptor[self.argument]
-        self.clip.SetValue(o) #<---- the most important thing!
+        if self.cache:
+            self.cache.update(o, lambda: self.clip.SetValue(o))
+        else:
+            self.clip.SetValue(o) #<---- the most important thing!
 
 #TODO: add templated classes so we don't end up with a track for each
 #vtkAlgorithm
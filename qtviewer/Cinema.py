@@ -16,6 +16,8 @@ import IO.cinema_store
 #open up a store
 cs = IO.cinema_store.FileStore(sys.argv[1])
 cs.load()
+#the viewer asks for the same few documents over and over
+cs.enable_find_cache(max_entries=256, keep_data=True, max_bytes=256 * 1024 ** 2)
 
 aselection = {}
 
@@ -0,0 +1,51 @@
+from PySide.QtCore import *
+from PySide.QtGui import *
+
+# Scrollable grid of captioned image tiles, used to show small multiples of
+# the store side by side. Tiles keep their image until a new one is set, so
+# the grid can be refreshed in place as images arrive.
+class GridView(QScrollArea):
+    def __init__(self, parent=None):
+        super(GridView, self).__init__(parent)
+        self.setWidgetResizable(True)
+        self._tiles = []
+        self._columns = 1
+
+    # Lay out one tile per caption, in rows of the given number of columns
+    def setTiles(self, captions, columns):
+        widget = QWidget(self)
+        layout = QGridLayout(widget)
+        layout.setSpacing(4)
+        self._tiles = []
+        self._columns = max(1, columns)
+        for index, caption in enumerate(captions):
+            cell = QWidget(widget)
+            cell.setLayout(QVBoxLayout())
+            cell.layout().setContentsMargins(0, 0, 0, 0)
+
+            tile = QLabel(cell)
+            tile.setAlignment(Qt.AlignCenter)
+            tile.setMinimumSize(QSize(32, 32))
+            cell.layout().addWidget(tile)
+
+            captionLabel = QLabel(caption, cell)
+            captionLabel.setAlignment(Qt.AlignCenter)
+            cell.layout().addWidget(captionLabel)
+
+            layout.addWidget(cell, index // self._columns, index % self._columns)
+            self._tiles.append(tile)
+        self.setWidget(widget)
+
+    # Largest thumbnail size that fits the columns in the visible width
+    def tileSize(self):
+        width = max(32, self.viewport().width() // self._columns - 8)
+        return (width, width)
+
+    # Show an image in a tile, or clear it if there is none
+    def setTile(self, index, pixmap):
+        if index >= len(self._tiles):
+            return
+        if pixmap:
+            self._tiles[index].setPixmap(pixmap)
+        else:
+            self._tiles[index].clear()
@@ -2,12 +2,27 @@ from PySide import QtCore
 from PySide.QtCore import *
 from PySide.QtGui import *
 
+import itertools
+import math
+
+import PIL.Image
 import PIL.ImageFile
 
+import IO.image_compaction
+import IO.playback
+import IO.recoloring
+import IO.store_index
+import IO.thumbnails
+
+from GridView import *
 from QRenderView import *
 from RenderViewMouseInteractor import *
 
 class MainWindow(QMainWindow):
+    # Emitted from the thumbnail loading threads with (grid generation,
+    # tile index, PIL image)
+    thumbnailReadySignal = Signal(int, int, object)
+
     def __init__(self, parent=None):
         super(MainWindow, self).__init__()
 
@@ -25,9 +40,28 @@ class MainWindow(QMainWindow):
         self._parametersWidget = QWidget(self)
         self._parametersWidget.setMinimumSize(QSize(200, 100))
         self._parametersWidget.setSizePolicy(QSizePolicy.Preferred, QSizePolicy.MinimumExpanding)
+        self._gridView = GridView(self)
+        self._gridView.hide()
         self._mainWidget.addWidget(self._displayWidget)
+        self._mainWidget.addWidget(self._gridView)
         self._mainWidget.addWidget(self._parametersWidget)
 
+        # Small multiples: the parameters laid out in the grid, and what the
+        # grid is currently showing
+        self._gridParameters = []
+        self._gridLayoutKey = None
+        self._gridGeneration = 0
+        self._thumbnails = None
+        self.thumbnailReadySignal.connect(self._onThumbnailReady)
+
+        # Playback: the parameters being played, outermost first, and the
+        # engine pacing them. The timer polls it several times a frame.
+        self._playAxes = []
+        self._player = None
+        self._playTileSize = None
+        self._playTimer = QTimer(self)
+        self._playTimer.timeout.connect(self.onPlayTimer)
+
         layout = QVBoxLayout()
         self._parametersWidget.setLayout(layout)
 
@@ -36,6 +70,24 @@ class MainWindow(QMainWindow):
         # Set up render view interactor
         self._mouseInteractor = RenderViewMouseInteractor()
 
+        # Show indexing progress in the status bar
+        self._index = None
+        self._indexProgress = QProgressBar(self)
+        self._indexProgress.setRange(0, 100)
+        self._indexProgress.setFormat('Indexing store %p%')
+        self._indexProgress.setMaximumWidth(200)
+        self._indexProgress.hide()
+        self.statusBar().addPermanentWidget(self._indexProgress)
+        self._indexTimer = QTimer(self)
+        self._indexTimer.setInterval(100)
+        self._indexTimer.timeout.connect(self._onIndexTimer)
+
+        # Follow documents and parameter values added while the store is
+        # being written
+        self._tailTimer = QTimer(self)
+        self._tailTimer.setInterval(500)
+        self._tailTimer.timeout.connect(self._onTailTimer)
+
     # Create the menu bars
     def createMenus(self):
         # File menu
@@ -49,6 +101,16 @@ class MainWindow(QMainWindow):
         self._store = store
         self._initializeCurrentQuery()
 
+        # Index the store in the background, lookups resolve file names
+        # directly until it is done
+        self._index = IO.store_index.StoreIndex(store)
+        self._index.start()
+        self._thumbnails = IO.thumbnails.ThumbnailLoader(self._getDocument)
+        self._indexProgress.setValue(0)
+        self._indexProgress.show()
+        self._indexTimer.start()
+        self._tailTimer.start()
+
         # Disconnect all mouse signals in case the store has no phi or theta values
         self._disconnectMouseSignals()
 
@@ -58,12 +120,16 @@ class MainWindow(QMainWindow):
         if ('theta' in store.parameter_list):
             self._mouseInteractor.setThetaValues(store.parameter_list['theta']['values'])
 
+        # Prefer the camera path recorded by the explorer, it knows which
+        # angles wrap around
+        if (store.metadata and 'camera_path' in store.metadata):
+            self._mouseInteractor.setCameraPath(store.metadata['camera_path'])
+
         if ('phi' in store.parameter_list or 'theta' in store.parameter_list):
             self._connectMouseSignals()
 
         # Display the default image
-        doc = self._store.find(dict(self._currentQuery)).next()
-        self.displayDocument(doc)
+        self.render()
 
         self._createParameterUI()
 
@@ -112,86 +178,171 @@ class MainWindow(QMainWindow):
     # Create property UI
     def _createParameterUI(self):
         keys = sorted(self._store.parameter_list)
+        self._createGridUI([name for name in keys
+                            if len(self._store.parameter_list[name]['values']) > 1])
+        self._createPlaybackUI()
+
+        # The sliders go in their own widget, so that parameters which gain
+        # values while the store is written can be added to it
+        self._slidersWidget = QWidget(self)
+        self._slidersWidget.setLayout(QVBoxLayout())
+        self._slidersWidget.layout().setContentsMargins(0, 0, 0, 0)
+        self._parametersWidget.layout().addWidget(self._slidersWidget)
+        self._sliderParameters = set()
         for name in keys:
-            properties = self._store.parameter_list[name]
-            if len(properties['values']) == 1:
-                #don't have widget if no choice possible
-                continue
-            labelValueWidget = QWidget(self)
-            labelValueWidget.setSizePolicy(QSizePolicy.MinimumExpanding, QSizePolicy.Fixed)
-            labelValueWidget.setLayout(QHBoxLayout())
-            labelValueWidget.layout().setContentsMargins(0, 0, 0, 0)
-            self._parametersWidget.layout().addWidget(labelValueWidget)
-
-            textLabel = QLabel(properties['label'], self)
-            labelValueWidget.layout().addWidget(textLabel)
-
-            valueLabel = QLabel('0', self)
-            valueLabel.setAlignment(Qt.AlignRight)
-            valueLabel.setObjectName(name + "ValueLabel")
-            labelValueWidget.layout().addWidget(valueLabel)
-
-            sliderControlsWidget = QWidget(self)
-            sliderControlsWidget.setSizePolicy(QSizePolicy.MinimumExpanding,
-                                               QSizePolicy.Fixed)
-            sliderControlsWidget.setLayout(QHBoxLayout())
-            sliderControlsWidget.layout().setContentsMargins(0, 0, 0, 0)
-            #sliderControlsWidget.setContentsMargins(0, 0, 0, 0)
-            self._parametersWidget.layout().addWidget(sliderControlsWidget)
-
-            flat = False
-            width = 25
-
-            skipBackwardIcon = self.style().standardIcon(QStyle.SP_MediaSkipBackward)
-            skipBackwardButton = QPushButton(skipBackwardIcon, '', self)
-            skipBackwardButton.setObjectName("SkipBackwardButton." + name)
-            skipBackwardButton.setFlat(flat)
-            skipBackwardButton.setMaximumWidth(width)
-            skipBackwardButton.clicked.connect(self.onSkipBackward)
-            sliderControlsWidget.layout().addWidget(skipBackwardButton)
-
-            seekBackwardIcon = self.style().standardIcon(QStyle.SP_MediaSeekBackward)
-            seekBackwardButton = QPushButton(seekBackwardIcon, '', self)
-            seekBackwardButton.setObjectName("SeekBackwardButton." + name)
-            seekBackwardButton.setFlat(flat)
-            seekBackwardButton.setMaximumWidth(width)
-            seekBackwardButton.clicked.connect(self.onSeekBackward)
-            sliderControlsWidget.layout().addWidget(seekBackwardButton)
-
-            slider = QSlider(Qt.Horizontal, self)
-            slider.setObjectName(name)
-            sliderControlsWidget.layout().addWidget(slider);
-
-            seekForwardIcon = self.style().standardIcon(QStyle.SP_MediaSeekForward)
-            seekForwardButton = QPushButton(seekForwardIcon, '', self)
-            seekForwardButton.setObjectName("SeekForwardButton." + name)
-            seekForwardButton.setFlat(flat)
-            seekForwardButton.setMaximumWidth(width)
-            seekForwardButton.clicked.connect(self.onSeekForward)
-            sliderControlsWidget.layout().addWidget(seekForwardButton)
-
-            skipForwardIcon = self.style().standardIcon(QStyle.SP_MediaSkipForward)
-            skipForwardButton = QPushButton(skipForwardIcon, '', self)
-            skipForwardButton.setObjectName("SkipForwardButton." + name)
-            skipForwardButton.setFlat(flat)
-            skipForwardButton.setMaximumWidth(width)
-            skipForwardButton.clicked.connect(self.onSkipForward)
-            sliderControlsWidget.layout().addWidget(skipForwardButton)
-
-            playIcon = self.style().standardIcon(QStyle.SP_MediaPlay)
-            playButton = QPushButton(playIcon, '', self)
-            playButton.setObjectName("PlayButton." + name)
-            playButton.setFlat(flat)
-            playButton.setMaximumWidth(width)
-            playButton.clicked.connect(self.onPlay)
-            sliderControlsWidget.layout().addWidget(playButton)
-
-            # Configure the slider
-            self.configureSlider(slider, properties)
-            self._updateSlider(properties['label'], properties['default'])
+            self._createParameterWidget(name)
 
         self._parametersWidget.layout().addStretch()
 
+    # Create the label, slider and buttons of a parameter
+    def _createParameterWidget(self, name):
+        properties = self._store.parameter_list[name]
+        if len(properties['values']) == 1:
+            #don't have widget if no choice possible
+            return
+        self._sliderParameters.add(name)
+        labelValueWidget = QWidget(self)
+        labelValueWidget.setSizePolicy(QSizePolicy.MinimumExpanding, QSizePolicy.Fixed)
+        labelValueWidget.setLayout(QHBoxLayout())
+        labelValueWidget.layout().setContentsMargins(0, 0, 0, 0)
+        self._slidersWidget.layout().addWidget(labelValueWidget)
+
+        textLabel = QLabel(properties['label'], self)
+        labelValueWidget.layout().addWidget(textLabel)
+
+        valueLabel = QLabel('0', self)
+        valueLabel.setAlignment(Qt.AlignRight)
+        valueLabel.setObjectName(name + "ValueLabel")
+        labelValueWidget.layout().addWidget(valueLabel)
+
+        sliderControlsWidget = QWidget(self)
+        sliderControlsWidget.setSizePolicy(QSizePolicy.MinimumExpanding,
+                                           QSizePolicy.Fixed)
+        sliderControlsWidget.setLayout(QHBoxLayout())
+        sliderControlsWidget.layout().setContentsMargins(0, 0, 0, 0)
+        #sliderControlsWidget.setContentsMargins(0, 0, 0, 0)
+        self._slidersWidget.layout().addWidget(sliderControlsWidget)
+
+        flat = False
+        width = 25
+
+        skipBackwardIcon = self.style().standardIcon(QStyle.SP_MediaSkipBackward)
+        skipBackwardButton = QPushButton(skipBackwardIcon, '', self)
+        skipBackwardButton.setObjectName("SkipBackwardButton." + name)
+        skipBackwardButton.setFlat(flat)
+        skipBackwardButton.setMaximumWidth(width)
+        skipBackwardButton.clicked.connect(self.onSkipBackward)
+        sliderControlsWidget.layout().addWidget(skipBackwardButton)
+
+        seekBackwardIcon = self.style().standardIcon(QStyle.SP_MediaSeekBackward)
+        seekBackwardButton = QPushButton(seekBackwardIcon, '', self)
+        seekBackwardButton.setObjectName("SeekBackwardButton." + name)
+        seekBackwardButton.setFlat(flat)
+        seekBackwardButton.setMaximumWidth(width)
+        seekBackwardButton.clicked.connect(self.onSeekBackward)
+        sliderControlsWidget.layout().addWidget(seekBackwardButton)
+
+        slider = QSlider(Qt.Horizontal, self)
+        slider.setObjectName(name)
+        sliderControlsWidget.layout().addWidget(slider);
+
+        seekForwardIcon = self.style().standardIcon(QStyle.SP_MediaSeekForward)
+        seekForwardButton = QPushButton(seekForwardIcon, '', self)
+        seekForwardButton.setObjectName("SeekForwardButton." + name)
+        seekForwardButton.setFlat(flat)
+        seekForwardButton.setMaximumWidth(width)
+        seekForwardButton.clicked.connect(self.onSeekForward)
+        sliderControlsWidget.layout().addWidget(seekForwardButton)
+
+        skipForwardIcon = self.style().standardIcon(QStyle.SP_MediaSkipForward)
+        skipForwardButton = QPushButton(skipForwardIcon, '', self)
+        skipForwardButton.setObjectName("SkipForwardButton." + name)
+        skipForwardButton.setFlat(flat)
+        skipForwardButton.setMaximumWidth(width)
+        skipForwardButton.clicked.connect(self.onSkipForward)
+        sliderControlsWidget.layout().addWidget(skipForwardButton)
+
+        playIcon = self.style().standardIcon(QStyle.SP_MediaPlay)
+        playButton = QPushButton(playIcon, '', self)
+        playButton.setObjectName("PlayButton." + name)
+        playButton.setFlat(flat)
+        playButton.setMaximumWidth(width)
+        playButton.clicked.connect(self.onPlay)
+        sliderControlsWidget.layout().addWidget(playButton)
+
+        # Configure the slider
+        self.configureSlider(slider, properties)
+        self._updateSlider(name, self._currentQuery[name])
+
+    # Create the choice of parameters to lay out as small multiples
+    def _createGridUI(self, names):
+        gridWidget = QWidget(self)
+        gridWidget.setSizePolicy(QSizePolicy.MinimumExpanding, QSizePolicy.Fixed)
+        gridWidget.setLayout(QFormLayout())
+        gridWidget.layout().setContentsMargins(0, 0, 0, 0)
+        self._parametersWidget.layout().addWidget(gridWidget)
+
+        self._gridCombos = []
+        for label in ['Grid of', 'by']:
+            combo = QComboBox(self)
+            combo.addItem('(none)')
+            for name in names:
+                combo.addItem(name)
+            combo.currentIndexChanged.connect(self.onGridChanged)
+            gridWidget.layout().addRow(label, combo)
+            self._gridCombos.append(combo)
+
+    # Offer the parameters that have gained values since the combos were made
+    def _updateGridCombos(self):
+        pl = self._store.parameter_list
+        for name in sorted(pl):
+            if len(pl[name]['values']) < 2:
+                continue
+            for combo in self._gridCombos:
+                if combo.findText(name) < 0:
+                    combo.addItem(name)
+
+    # Create the playback mode and rate controls
+    def _createPlaybackUI(self):
+        playbackWidget = QWidget(self)
+        playbackWidget.setSizePolicy(QSizePolicy.MinimumExpanding, QSizePolicy.Fixed)
+        playbackWidget.setLayout(QFormLayout())
+        playbackWidget.layout().setContentsMargins(0, 0, 0, 0)
+        self._parametersWidget.layout().addWidget(playbackWidget)
+
+        self._playModeCombo = QComboBox(self)
+        for mode in ['loop', 'pingpong', 'once']:
+            self._playModeCombo.addItem(mode)
+        playbackWidget.layout().addRow('Playback', self._playModeCombo)
+
+        self._playRateSpinBox = QSpinBox(self)
+        self._playRateSpinBox.setRange(1, 60)
+        self._playRateSpinBox.setValue(30)
+        self._playRateSpinBox.setSuffix(' fps')
+        playbackWidget.layout().addRow('Rate', self._playRateSpinBox)
+
+    # Switch between the single image and the grid of small multiples
+    def onGridChanged(self):
+        names = []
+        for combo in self._gridCombos:
+            name = combo.currentText()
+            if combo.currentIndex() > 0 and not name in names:
+                names.append(name)
+        self._gridParameters = names
+        self._gridLayoutKey = None
+        if names:
+            self._displayWidget.hide()
+            self._gridView.show()
+        else:
+            self._thumbnails.cancel()
+            self._gridView.hide()
+            self._displayWidget.show()
+        self.render()
+
+        # Frames already loaded are for the other view
+        if self._player:
+            self._startPlayback()
+
     # Convenience function for setting up a slider
     def configureSlider(self, slider, properties):
         default   = properties['default']
@@ -244,24 +395,99 @@ class MainWindow(QMainWindow):
         slider = self._parametersWidget.findChild(QSlider, parameterName)
         slider.setValue(slider.maximum())
 
-    # Play forward through the parameters
+    # Play through the parameters. Each play button pressed while playing
+    # adds its parameter, changing faster than those already playing;
+    # pressing the button of a playing parameter stops playback.
     def onPlay(self):
         parameterName = self.sender().objectName().replace("PlayButton.", "")
-        timer = QTimer(self)
-        timer.setObjectName("Timer." + parameterName)
-        timer.setInterval(200)
-        timer.timeout.connect(self.onPlayTimer)
-        timer.start()
-
+        if parameterName in self._playAxes:
+            self._stopPlayback()
+            return
+        self._playAxes.append(parameterName)
+        self._startPlayback()
+
+    def _startPlayback(self):
+        if self._player:
+            self._player.close()
+        mode = self._playModeCombo.currentText()
+        frames = IO.playback.parameter_path(self._store, self._currentQuery,
+                                            self._playAxes, mode)
+        fps = self._playRateSpinBox.value()
+        self._playTileSize = self._gridView.tileSize()
+        self._player = IO.playback.Player(frames, self._loadFrame, fps,
+                                          loop=(mode != 'once'))
+
+        # Start from the values currently shown
+        current = [str(self._currentQuery[name]) for name in self._playAxes]
+        start = 0
+        for index, frame in enumerate(frames):
+            if [str(frame[name]) for name in self._playAxes] == current:
+                start = index
+                break
+        self._player.start(start)
+        self._playTimer.setInterval(max(1, 250 // fps))
+        self._playTimer.start()
+
+    def _stopPlayback(self):
+        self._playTimer.stop()
+        self._playAxes = []
+        if self._player:
+            self._player.close()
+            self._player = None
+
+    # Runs on the playback engine's threads. In grid mode a frame is the
+    # thumbnails of all of its tiles, so that the grid is loaded ahead of
+    # time like single images are.
+    def _loadFrame(self, query):
+        if self._gridParameters:
+            queries, captions = self._gridQueries(query)
+            tiles = []
+            for tileQuery in queries:
+                doc = self._getDocument(tileQuery)
+                tiles.append(IO.thumbnails.thumbnail(doc, self._playTileSize)
+                             if doc else None)
+            return tiles
+        doc = self._getDocument(query)
+        return self._imageFromDocument(doc) if doc else None
+
+    # Show the frame that is due, if there is a new one
     def onPlayTimer(self):
-        parameterName = self.sender().objectName().replace("Timer.", "")
-
+        frame = self._player.poll()
+        finished = self._player.finished
+        if frame is not None:
+            index, loaded = frame
+            query = self._player.frames[index]
+            for name in self._playAxes:
+                self._currentQuery[name] = query[name]
+                self._showSliderValue(name, query[name])
+
+            if self._gridParameters:
+                self._showGridFrame(query, loaded)
+            elif loaded:
+                self._displayImage(loaded)
+            else:
+                self._displayWidget.setPixmap(None)
+        if finished:
+            self._stopPlayback()
+
+    # Put the prefetched tiles of a frame in the grid
+    def _showGridFrame(self, query, tiles):
+        queries, captions = self._gridQueries(query)
+        self._layoutGrid(captions)
+        # Tiles of an earlier render still loading would overwrite these
+        self._gridGeneration += 1
+        self._thumbnails.cancel()
+        for index, img in enumerate(tiles or []):
+            self._gridView.setTile(index, self._pixmapFromImage(img) if img else None)
+
+    # Move a slider to a value without rendering
+    def _showSliderValue(self, parameterName, value):
         slider = self._parametersWidget.findChild(QSlider, parameterName)
-        maximum = slider.maximum()
-        if (slider.value() == slider.maximum()):
-            self.sender().stop()
-        else:
-            slider.setValue(maximum if slider.value() == maximum else slider.value() + 1)
+        slider.blockSignals(True)
+        self._updateSlider(parameterName, value)
+        slider.blockSignals(False)
+        valueLabel = self._parametersWidget.findChild(QLabel, parameterName + "ValueLabel")
+        valueLabel.setText(self._formatText(value))
 
     # Format string from number
     def _formatText(self, value):
@@ -316,29 +542,163 @@ class MainWindow(QMainWindow):
 
     # Query the image store and display the retrieved image
     def render(self):
+        if self._gridParameters:
+            self._renderGrid()
+            return
+
         # Retrieve image from data store with the current query. Only
         # care about the first - there should be only one if we have
         # correctly specified all the properties.
-        docs = [doc for doc in self._store.find(self._currentQuery)]
-        if (len(docs) > 0):
-            self.displayDocument(docs[0])
+        doc = self._getDocument(self._currentQuery)
+        if doc:
+            self.displayDocument(doc)
         else:
             self._displayWidget.setPixmap(None)
             self._displayWidget.setAlignment(Qt.AlignCenter)
 
+    # Show every value of the grid parameters, with the others held at the
+    # current query. The tiles are loaded as one batch in worker threads and
+    # replaced in place as they arrive.
+    def _renderGrid(self):
+        queries, captions = self._gridQueries(self._currentQuery)
+        self._layoutGrid(captions)
+
+        self._gridGeneration += 1
+        generation = self._gridGeneration
+        self._thumbnails.request(queries, self._gridView.tileSize(),
+            lambda index, img: self.thumbnailReadySignal.emit(generation, index, img))
+
+    # The queries and captions of the grid's tiles: every value of the grid
+    # parameters, with the others held at query
+    def _gridQueries(self, query):
+        pl = self._store.parameter_list
+        values = [pl[name]['values'] for name in self._gridParameters]
+        queries = []
+        captions = []
+        for element in itertools.product(*values):
+            tileQuery = dict(query)
+            tileQuery.update(zip(self._gridParameters, element))
+            queries.append(tileQuery)
+            captions.append(', '.join(self._formatText(v) for v in element))
+        return queries, captions
+
+    # Lay the tiles out again when the grid parameters or their values change
+    def _layoutGrid(self, captions):
+        pl = self._store.parameter_list
+        values = [pl[name]['values'] for name in self._gridParameters]
+        if len(values) == 1:
+            columns = int(math.ceil(math.sqrt(len(values[0]))))
+        else:
+            columns = len(values[1])
+
+        layoutKey = (tuple(self._gridParameters), tuple(len(v) for v in values))
+        if layoutKey != self._gridLayoutKey:
+            self._gridLayoutKey = layoutKey
+            self._gridView.setTiles(captions, columns)
+
+    # Put a loaded thumbnail in its tile, unless the grid moved on since
+    def _onThumbnailReady(self, generation, index, img):
+        if generation != self._gridGeneration:
+            return
+        self._gridView.setTile(index, self._pixmapFromImage(img) if img else None)
+
+    # Look up the document for the query, coloring it first if the store
+    # holds value images or expanding it if it was compacted. The file
+    # name follows from the query, so no search of the store is needed.
+    def _getDocument(self, query):
+        doc = self._index.get(query)
+        if doc and IO.recoloring.is_value_image_store(self._store):
+            doc = IO.recoloring.recolor_document(self._store, doc, query)
+        elif doc:
+            # Rebuild the full frame of cropped images
+            doc = IO.image_compaction.expand_document(doc)
+        return doc
+
+    # Follow the background indexing
+    def _onIndexTimer(self):
+        self._indexProgress.setValue(int(100 * self._index.progress()))
+        if self._index.ready:
+            self._indexTimer.stop()
+            self._indexProgress.hide()
+            self.statusBar().showMessage(
+                '{0} documents indexed'.format(self._index.count), 5000)
+
+    # Pick up what was added to the store since the last tick, re-rendering
+    # if the displayed document is among it
+    def _onTailTimer(self):
+        if self._store.refresh():
+            self._onParametersChanged()
+        added = self._index.poll()
+        if added:
+            self.statusBar().showMessage(
+                '{0} new documents'.format(len(added)), 2000)
+        for descriptor in added:
+            if self._isDisplayed(descriptor):
+                self.render()
+                break
+
+    # Whether a document is part of what is displayed: its parameters
+    # match the current query, except for those laid out in the grid.
+    # Parameters the query has but the document doesn't, such as the
+    # color of a value image, don't matter.
+    def _isDisplayed(self, descriptor):
+        return all(str(value) == str(self._currentQuery[name])
+                   for name, value in descriptor.items()
+                   if name in self._currentQuery and
+                   not name in self._gridParameters)
+
+    # Extend the sliders to parameter values added to the store, and add
+    # sliders for parameters that now have a choice of values
+    def _onParametersChanged(self):
+        pl = self._store.parameter_list
+        for name in sorted(pl):
+            properties = pl[name]
+            if not name in self._currentQuery:
+                self._currentQuery[name] = properties['default']
+            if not name in self._sliderParameters:
+                self._createParameterWidget(name)
+                continue
+            slider = self._parametersWidget.findChild(QSlider, name)
+            slider.setMaximum(len(properties['values'])-1)
+
+        if ('phi' in pl):
+            self._mouseInteractor.setPhiValues(pl['phi']['values'])
+
+        if ('theta' in pl):
+            self._mouseInteractor.setThetaValues(pl['theta']['values'])
+
+        self._updateGridCombos()
+
+        # The grid grows with the values of its parameters
+        if self._gridParameters:
+            self.render()
+
+    # Convert a PIL image into a pixmap
+    def _pixmapFromImage(self, pimg):
+        imageString = pimg.convert('RGBA').tostring('raw', 'BGRA')
+        qimg = QImage(imageString, pimg.size[0], pimg.size[1], QImage.Format_ARGB32)
+        return QPixmap.fromImage(qimg)
+
     # Get the main widget
     def mainWidget(self):
         return self._mainWidget
 
     # Given a document, read the data into an image that can be displayed in Qt
     def displayDocument(self, doc):
-        #load it into PIL
-        imageparser = PIL.ImageFile.Parser()
-        imageparser.feed(doc.data)
-        pimg = imageparser.close()
-        imageString = pimg.convert('RGBA').tostring('raw', 'BGRA')
-        qimg = QImage(imageString, pimg.size[0], pimg.size[1], QImage.Format_ARGB32)
-        pix = QPixmap.fromImage(qimg)
+        self._displayImage(self._imageFromDocument(doc))
+
+    # Decode a document's data into a PIL image
+    def _imageFromDocument(self, doc):
+        if isinstance(doc.data, str):
+            imageparser = PIL.ImageFile.Parser()
+            imageparser.feed(doc.data)
+            return imageparser.close()
+        #already decoded, for instance by recoloring
+        return PIL.Image.fromarray(doc.data)
+
+    # Show a PIL image in the display widget
+    def _displayImage(self, pimg):
+        pix = self._pixmapFromImage(pimg)
 
         # Try to resize the display widget
         self._displayWidget.sizeHint = pix.size
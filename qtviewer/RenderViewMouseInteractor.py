@@ -27,18 +27,46 @@ class RenderViewMouseInteractor():
         self._stepPhi   = 30
         self._stepTheta = 30
 
+        # Whether stepping past either end of the angle list wraps around.
+        self._wrapPhi   = True
+        self._wrapTheta = True
+
     def setPhiValues(self, phiValues):
         self._phiValues = phiValues
+        self._phiIndices = self._indexAngles(phiValues)
 
         # Warning - this assumes an even angle spacing through the phiValues array.
         self._stepPhi = phiValues[1] - phiValues[0]
 
     def setThetaValues(self, thetaValues):
         self._thetaValues = thetaValues
+        self._thetaIndices = self._indexAngles(thetaValues)
 
         # Warning - this assumes an even angle spacing through the thetaValues array.
         self._stepTheta = thetaValues[1] - thetaValues[0]
 
+    # Configure from the 'camera_path' metadata written by the explorer's
+    # camera track, which lists the angles and which of them may wrap
+    # around. An angle wraps only if its values go all the way around, and
+    # angles the path doesn't drive keep their setting.
+    def setCameraPath(self, cameraPath):
+        values = dict(zip(cameraPath['parameters'], cameraPath['values']))
+        if 'phi' in values:
+            self.setPhiValues(values['phi'])
+            self._wrapPhi = ('phi' in cameraPath['wrap'] and
+                             self._spansCircle(values['phi']))
+        if 'theta' in values:
+            self.setThetaValues(values['theta'])
+            self._wrapTheta = ('theta' in cameraPath['wrap'] and
+                               self._spansCircle(values['theta']))
+
+    # Whether evenly spaced angles, in degrees, cover the whole circle
+    def _spansCircle(self, angles):
+        if len(angles) < 2:
+            return False
+        step = abs(angles[1] - angles[0])
+        return max(angles) - min(angles) + step >= 360 - 1e-6
+
     def setPhi(self, phi):
         self._phi = phi
 
@@ -80,12 +108,14 @@ class RenderViewMouseInteractor():
             # If the phi angles are not evenly spaced, this logic won't work.
             # Should look at angle above and below this one to make the increment decision.
             if (math.fabs(dphi) > self._stepPhi):
-                self._phi   = self._incrementAngle(self._phi, phi_sign, self._phiValues)
+                self._phi   = self._incrementAngle(self._phi, phi_sign, self._phiValues,
+                                                   self._phiIndices, self._wrapPhi)
                 self._xy = (mouseEvent.x(), mouseEvent.y())
 
             # The same comment for the phi update holds for the theta update.
             if (math.fabs(dtheta) > self._stepTheta):
-                self._theta = self._incrementAngle(self._theta, theta_sign, self._thetaValues)
+                self._theta = self._incrementAngle(self._theta, theta_sign, self._thetaValues,
+                                                     self._thetaIndices, self._wrapTheta)
                 self._xy = (mouseEvent.x(), mouseEvent.y())
 
         elif (self._state == self.ZoomState):
@@ -116,14 +146,18 @@ class RenderViewMouseInteractor():
                 self._scale = self._scale * (1.0 / scaleFactor)
 
 
+    # Map each angle to its position in the angle list
+    def _indexAngles(self, angles):
+        return dict((angle, index) for index, angle in enumerate(angles))
+
     # Increment angle to be either the next or previous angle in the angle list
-    def _incrementAngle(self, angle, sign, angles):
+    def _incrementAngle(self, angle, sign, angles, indices, wrap=True):
         # Find index of angle in array of angles
-        index = angles.index(angle)
+        index = indices[angle]
         index = index + sign * 1
         if (index < 0):
-            index = len(angles)-1
+            index = len(angles)-1 if wrap else 0
         if (index >= len(angles)):
-            index = 0
+            index = 0 if wrap else len(angles)-1
 
         return angles[index]